@@ -0,0 +1,116 @@
+import time
+import asyncio
+import itertools
+from typing import Any, Callable
+
+# --- AGENDADOR POR MODELO LOCAL ---
+# Cada modelo local carregado ganha uma fila com prioridade e um worker por
+# réplica do modelo (cada réplica é um objeto Llama próprio). Só os workers
+# geram com os modelos, então duas gerações nunca rodam no mesmo objeto e o número
+# de threads ocupadas fica limitado ao número de réplicas. Com a fila cheia o
+# pedido é recusado na hora (FilaCheia -> HTTP 503 com Retry-After) em vez de
+# empilhar threads até tudo estourar o timeout.
+# O llama-cpp-python avalia uma sequência por vez, então não há batching de
+# pedidos: o paralelismo vem das réplicas ("replicas" na config do serviço).
+CAPACIDADE_FILA_PADRAO = 16
+# Menor número = atendido antes. A resposta que o usuário está lendo vem primeiro.
+PRIORIDADES_PADRAO = {"gerar_stream": 0, "gerar": 1, "sumarizar_stream": 2, "sumarizar": 2}
+PRIORIDADE_SEM_ENDPOINT = 5
+# Peso da última execução na média móvel usada para estimar o Retry-After.
+PESO_MEDIA_EXECUCAO = 0.2
+
+
+class FilaCheia(Exception):
+    def __init__(self, nome_modelo: str, retry_after_s: int):
+        super().__init__(f"A fila do serviço '{nome_modelo}' está cheia. Tente de novo em {retry_after_s}s.")
+        self.retry_after_s = retry_after_s
+
+
+class AgendadorModelo:
+    """
+    Fila limitada com prioridade para as réplicas de um modelo local. 'funcao(modelo)'
+    é executada numa thread por um worker livre; o resultado volta com o tempo de fila.
+    """
+
+    def __init__(self, nome: str, replicas: list, capacidade_fila: int = CAPACIDADE_FILA_PADRAO):
+        self.nome = nome
+        self.replicas = replicas
+        self.capacidade_fila = capacidade_fila
+        self._fila = None
+        self._workers = []
+        self._sequencia = itertools.count()
+        self._ocupados = 0
+        self._media_execucao_s = None
+        self._atendidos = 0
+        self._recusados = 0
+        self._espera_total_s = 0.0
+
+    def iniciar(self):
+        """Cria a fila e os workers; precisa ser chamado com o event loop do servidor rodando."""
+        self._fila = asyncio.PriorityQueue(maxsize=self.capacidade_fila)
+        self._workers = [asyncio.create_task(self._trabalhar(replica), name=f"{self.nome}-{i}")
+                         for i, replica in enumerate(self.replicas)]
+
+    async def parar(self):
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+
+    def enviar(self, funcao: Callable[[Any], Any], prioridade: int = PRIORIDADE_SEM_ENDPOINT) -> asyncio.Future:
+        """
+        Enfileira o pedido e retorna um futuro com (resultado, espera na fila em s).
+        Levanta FilaCheia imediatamente se não houver vaga. Cancelar o futuro
+        antes de o pedido sair da fila faz o worker descartá-lo.
+        """
+        futuro = asyncio.get_running_loop().create_future()
+        try:
+            self._fila.put_nowait((prioridade, next(self._sequencia), time.perf_counter(), funcao, futuro))
+        except asyncio.QueueFull:
+            self._recusados += 1
+            raise FilaCheia(self.nome, self.estimar_retry_after())
+        return futuro
+
+    def estimar_retry_after(self) -> int:
+        """Segundos até a fila andar o suficiente: pedidos à frente x tempo médio / réplicas."""
+        media = self._media_execucao_s or 1.0
+        return max(1, round(self._fila.qsize() * media / max(1, len(self.replicas))))
+
+    async def _trabalhar(self, replica):
+        while True:
+            _, _, enfileirado_em, funcao, futuro = await self._fila.get()
+            try:
+                if futuro.cancelled():
+                    continue
+                espera = time.perf_counter() - enfileirado_em
+                self._ocupados += 1
+                inicio = time.perf_counter()
+                try:
+                    resultado = await asyncio.to_thread(funcao, replica)
+                except Exception as e:
+                    if not futuro.done():
+                        futuro.set_exception(e)
+                else:
+                    if not futuro.done():
+                        futuro.set_result((resultado, espera))
+                finally:
+                    self._ocupados -= 1
+                    duracao = time.perf_counter() - inicio
+                    self._media_execucao_s = duracao if self._media_execucao_s is None else (
+                        PESO_MEDIA_EXECUCAO * duracao + (1 - PESO_MEDIA_EXECUCAO) * self._media_execucao_s)
+                    self._atendidos += 1
+                    self._espera_total_s += espera
+            finally:
+                self._fila.task_done()
+
+    def estado(self) -> dict:
+        return {
+            "replicas": len(self.replicas),
+            "ocupadas": self._ocupados,
+            "na_fila": self._fila.qsize() if self._fila else 0,
+            "capacidade_fila": self.capacidade_fila,
+            "atendidos": self._atendidos,
+            "recusados": self._recusados,
+            "espera_media_s": self._espera_total_s / self._atendidos if self._atendidos else None,
+            "execucao_media_s": self._media_execucao_s,
+        }
@@ -0,0 +1,283 @@
+import os
+import json
+import shutil
+import sqlite3
+import threading
+
+import faiss
+import numpy as np
+from langchain_community.docstore.base import AddableMixin, Docstore
+from langchain_community.vectorstores import FAISS
+from langchain_core.documents import Document
+
+# --- TIPOS DE ÍNDICE FAISS ---
+# Cada contexto pode declarar em contexts.json o tipo de índice a usar, ex:
+#   "indice": {"tipo": "hnsw", "m": 32, "ef_busca": 64}
+# Sem essa chave o contexto continua com o índice plano (busca exata).
+ARQUIVO_MANIFESTO = "manifesto.json"
+ARQUIVO_INDICE = "index.faiss"
+ARQUIVO_CHUNKS = "chunks.sqlite"
+ARQUIVO_PICKLE_LEGADO = "index.pkl"
+
+ESPECIFICACOES_PADRAO = {
+    "flat": {},
+    "hnsw": {"m": 32, "ef_construcao": 80, "ef_busca": 64},
+    "ivf_flat": {"nlist": 256, "nprobe": 16},
+    "ivf_pq": {"nlist": 256, "nprobe": 16, "m_pq": 48, "bits": 8},
+    "sq": {"codificacao": "fp16"},
+}
+CODIFICACOES_SQ = {"fp16": "SQfp16", "8bit": "SQ8", "4bit": "SQ4"}
+
+# Índices que não suportam remover vetores mantendo as posições compactadas
+# (o LangChain assume isso em FAISS.delete). Neles, remoções exigem reconstrução.
+TIPOS_SEM_REMOCAO = {"hnsw", "ivf_flat", "ivf_pq"}
+
+def normalizar_espec_indice(espec: dict | None) -> dict:
+    """Valida a especificação de índice de um contexto e preenche os valores padrão."""
+    espec = dict(espec or {})
+    tipo = espec.pop("tipo", "flat").lower()
+    if tipo not in ESPECIFICACOES_PADRAO:
+        raise ValueError(f"Tipo de índice '{tipo}' inválido. Use um de: {', '.join(ESPECIFICACOES_PADRAO)}.")
+    desconhecidos = set(espec) - set(ESPECIFICACOES_PADRAO[tipo])
+    if desconhecidos:
+        raise ValueError(f"Parâmetros não reconhecidos para o índice '{tipo}': {', '.join(sorted(desconhecidos))}.")
+    normalizada = {"tipo": tipo, **ESPECIFICACOES_PADRAO[tipo], **espec}
+    if tipo == "sq" and normalizada["codificacao"] not in CODIFICACOES_SQ:
+        raise ValueError(f"Codificação '{normalizada['codificacao']}' inválida. Use uma de: {', '.join(CODIFICACOES_SQ)}.")
+    return normalizada
+
+def tamanho_amostra_treino(espec: dict) -> int:
+    """Quantos vetores acumular antes de treinar o índice (0 = não precisa de treino)."""
+    tipo = espec["tipo"]
+    if tipo in ("ivf_flat", "ivf_pq"):
+        # Recomendação do FAISS: ~39 pontos por centróide.
+        return max(espec["nlist"] * 39, 2 ** espec.get("bits", 0) * 39)
+    if tipo == "sq":
+        return 1000
+    return 0
+
+def criar_indice_faiss(espec: dict, vetores_treino: np.ndarray) -> tuple["faiss.Index", dict]:
+    """
+    Cria (e treina, se necessário) o índice descrito por 'espec'. Retorna o
+    índice e a especificação efetivamente usada: com poucos vetores, o número
+    de listas do IVF é reduzido e o PQ cai para o índice plano.
+    """
+    dimensao = vetores_treino.shape[1]
+    n = vetores_treino.shape[0]
+    efetiva = dict(espec)
+    tipo = espec["tipo"]
+
+    if tipo == "ivf_pq" and n < 2 ** espec["bits"]:
+        print(f"   ⚠️ Apenas {n} vetores: insuficiente para treinar o PQ. Usando índice plano.")
+        efetiva = {"tipo": "flat"}
+        tipo = "flat"
+    if tipo == "ivf_pq" and dimensao % espec["m_pq"] != 0:
+        raise ValueError(f"'m_pq' ({espec['m_pq']}) precisa dividir a dimensão dos vetores ({dimensao}).")
+    if tipo in ("ivf_flat", "ivf_pq"):
+        nlist = min(espec["nlist"], max(1, n // 39))
+        if nlist != espec["nlist"]:
+            print(f"   ⚠️ Apenas {n} vetores: reduzindo nlist de {espec['nlist']} para {nlist}.")
+        efetiva["nlist"] = nlist
+
+    if tipo == "flat":
+        index = faiss.IndexFlatL2(dimensao)
+    elif tipo == "hnsw":
+        index = faiss.IndexHNSWFlat(dimensao, espec["m"])
+        index.hnsw.efConstruction = espec["ef_construcao"]
+    elif tipo == "ivf_flat":
+        index = faiss.index_factory(dimensao, f"IVF{efetiva['nlist']},Flat")
+    elif tipo == "ivf_pq":
+        index = faiss.index_factory(dimensao, f"IVF{efetiva['nlist']},PQ{espec['m_pq']}x{espec['bits']}")
+    else:
+        index = faiss.index_factory(dimensao, CODIFICACOES_SQ[espec["codificacao"]])
+
+    if not index.is_trained:
+        print(f"   -> Treinando índice '{tipo}' com {n} vetores...")
+        index.train(vetores_treino)
+    aplicar_parametros_busca(index, efetiva)
+    preparar_reconstrucao(index)
+    return index, efetiva
+
+def aplicar_parametros_busca(index: "faiss.Index", espec: dict):
+    """Ajusta os parâmetros de busca (efSearch, nprobe) que não fazem parte do treino."""
+    tipo = espec.get("tipo", "flat")
+    if tipo == "hnsw":
+        faiss.downcast_index(index).hnsw.efSearch = espec["ef_busca"]
+    elif tipo in ("ivf_flat", "ivf_pq"):
+        faiss.extract_index_ivf(index).nprobe = espec["nprobe"]
+
+def preparar_reconstrucao(index: "faiss.Index"):
+    """
+    Índices IVF só reconstroem vetores (usados pelo MMR) com o mapa direto
+    posição -> lista. Ele é criado aqui, uma vez, ao criar ou carregar o índice:
+    criá-lo na primeira busca alteraria um índice já compartilhado entre threads.
+    As inserções seguintes mantêm o mapa, e o write_index o grava junto.
+    """
+    try:
+        ivf = faiss.extract_index_ivf(index)
+    except RuntimeError:
+        return
+    if ivf.direct_map.type == faiss.DirectMap.NoMap:
+        ivf.make_direct_map()
+
+# --- DOCSTORE EM SQLITE ---
+# O texto e os metadados dos chunks ficam em 'chunks.sqlite' e são lidos sob
+# demanda, por ID, apenas para os k resultados de cada busca. A tabela
+# 'posicoes' guarda o mapeamento posição no FAISS -> ID do chunk.
+
+class DocstoreSQLite(Docstore, AddableMixin):
+    """Docstore do LangChain persistido em SQLite, com leitura preguiçosa por ID."""
+
+    def __init__(self, caminho: str, somente_leitura: bool = False):
+        self.caminho = caminho
+        self._lock = threading.Lock()
+        if somente_leitura:
+            self._conn = sqlite3.connect(f"file:{caminho}?mode=ro", uri=True, check_same_thread=False)
+            # Leitura via mmap: as páginas do arquivo são mapeadas em vez de copiadas.
+            self._conn.execute("PRAGMA mmap_size = 268435456")
+        else:
+            self._conn = sqlite3.connect(caminho, check_same_thread=False)
+            self._conn.execute("PRAGMA journal_mode = OFF")
+            self._conn.execute("PRAGMA synchronous = OFF")
+            self._conn.execute("CREATE TABLE IF NOT EXISTS chunks (id TEXT PRIMARY KEY, texto TEXT NOT NULL, metadados TEXT NOT NULL)")
+            self._conn.execute("CREATE TABLE IF NOT EXISTS posicoes (posicao INTEGER PRIMARY KEY, id TEXT NOT NULL)")
+            self._conn.commit()
+
+    def search(self, search: str) -> str | Document:
+        with self._lock:
+            linha = self._conn.execute("SELECT texto, metadados FROM chunks WHERE id = ?", (search,)).fetchone()
+        if linha is None:
+            return f"ID {search} not found."
+        return Document(id=search, page_content=linha[0], metadata=json.loads(linha[1]))
+
+    def add(self, texts: dict[str, Document]) -> None:
+        with self._lock:
+            self._conn.executemany(
+                "INSERT INTO chunks (id, texto, metadados) VALUES (?, ?, ?)",
+                [(id_, doc.page_content, json.dumps(doc.metadata, ensure_ascii=False)) for id_, doc in texts.items()],
+            )
+            self._conn.commit()
+
+    def delete(self, ids: list) -> None:
+        with self._lock:
+            self._conn.executemany("DELETE FROM chunks WHERE id = ?", [(id_,) for id_ in ids])
+            self._conn.commit()
+
+    def atualizar_metadados(self, metadados_por_id: dict[str, dict]):
+        with self._lock:
+            self._conn.executemany(
+                "UPDATE chunks SET metadados = ? WHERE id = ?",
+                [(json.dumps(metadados, ensure_ascii=False), id_) for id_, metadados in metadados_por_id.items()],
+            )
+            self._conn.commit()
+
+    def iterar_textos(self):
+        """(id, texto) de todos os chunks, na ordem das posições do FAISS."""
+        with self._lock:
+            linhas = self._conn.execute(
+                "SELECT chunks.id, chunks.texto FROM posicoes JOIN chunks ON chunks.id = posicoes.id ORDER BY posicoes.posicao"
+            ).fetchall()
+        yield from linhas
+
+    def ler_posicoes(self) -> dict[int, str]:
+        with self._lock:
+            return dict(self._conn.execute("SELECT posicao, id FROM posicoes"))
+
+    def gravar_posicoes(self, index_to_docstore_id: dict[int, str]):
+        with self._lock:
+            self._conn.execute("DELETE FROM posicoes")
+            self._conn.executemany("INSERT INTO posicoes (posicao, id) VALUES (?, ?)", index_to_docstore_id.items())
+            self._conn.commit()
+
+    def fechar(self):
+        with self._lock:
+            self._conn.close()
+
+# --- LEITURA E GRAVAÇÃO DOS ÍNDICES ---
+
+def abrir_docstore_construcao(pasta_contexto: str, copiar_existente: bool = True) -> DocstoreSQLite:
+    """
+    Abre um docstore gravável numa cópia temporária de 'chunks.sqlite'. O
+    arquivo definitivo só é substituído em salvar_indice, então um build
+    interrompido não deixa o índice salvo inconsistente.
+    """
+    os.makedirs(pasta_contexto, exist_ok=True)
+    caminho_tmp = os.path.join(pasta_contexto, ARQUIVO_CHUNKS + ".tmp")
+    if os.path.exists(caminho_tmp):
+        os.remove(caminho_tmp)
+    caminho = os.path.join(pasta_contexto, ARQUIVO_CHUNKS)
+    if copiar_existente and os.path.exists(caminho):
+        shutil.copyfile(caminho, caminho_tmp)
+    return DocstoreSQLite(caminho_tmp)
+
+def descartar_construcao(db: FAISS | None):
+    """Fecha e apaga a cópia temporária do docstore quando o build não vai ser salvo."""
+    if db is not None and isinstance(db.docstore, DocstoreSQLite) and db.docstore.caminho.endswith(".tmp"):
+        db.docstore.fechar()
+        os.remove(db.docstore.caminho)
+
+def atualizar_metadados_chunks(db: FAISS, metadados_por_id: dict[str, dict]):
+    """Reescreve os metadados de chunks já inseridos (o vetor e o texto não mudam)."""
+    if isinstance(db.docstore, DocstoreSQLite):
+        db.docstore.atualizar_metadados(metadados_por_id)
+    else:
+        for id_, metadados in metadados_por_id.items():
+            db.docstore.search(id_).metadata = metadados
+
+def novo_db(embeddings, index: "faiss.Index", docstore: DocstoreSQLite) -> FAISS:
+    return FAISS(embedding_function=embeddings, index=index, docstore=docstore, index_to_docstore_id={})
+
+def salvar_indice(db: FAISS, pasta_contexto: str):
+    """
+    Grava 'index.faiss' e 'chunks.sqlite'. Índices antigos (pickle) são
+    convertidos para o docstore em SQLite na primeira gravação.
+    """
+    os.makedirs(pasta_contexto, exist_ok=True)
+    docstore = db.docstore
+    if not isinstance(docstore, DocstoreSQLite):
+        docstore = abrir_docstore_construcao(pasta_contexto, copiar_existente=False)
+        docstore.add({id_: db.docstore.search(id_) for id_ in db.index_to_docstore_id.values()})
+        db.docstore = docstore
+    docstore.gravar_posicoes(db.index_to_docstore_id)
+    docstore.fechar()
+
+    caminho_indice = os.path.join(pasta_contexto, ARQUIVO_INDICE)
+    faiss.write_index(db.index, caminho_indice + ".tmp")
+    os.replace(caminho_indice + ".tmp", caminho_indice)
+    os.replace(docstore.caminho, os.path.join(pasta_contexto, ARQUIVO_CHUNKS))
+    caminho_pickle = os.path.join(pasta_contexto, ARQUIVO_PICKLE_LEGADO)
+    if os.path.exists(caminho_pickle):
+        os.remove(caminho_pickle)
+
+def ler_manifesto(pasta_contexto: str) -> dict | None:
+    try:
+        with open(os.path.join(pasta_contexto, ARQUIVO_MANIFESTO), 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
+
+def carregar_indice(pasta_contexto: str, embeddings, para_escrita: bool = False) -> FAISS:
+    """
+    Carrega o índice de um contexto, seja qual for o tipo salvo em disco,
+    e reaplica os parâmetros de busca registrados no manifesto. O texto dos
+    chunks não é carregado: fica no SQLite até ser pedido por uma busca.
+    Com 'para_escrita=True' o docstore é aberto numa cópia gravável.
+    """
+    caminho_chunks = os.path.join(pasta_contexto, ARQUIVO_CHUNKS)
+    if os.path.exists(caminho_chunks):
+        index = faiss.read_index(os.path.join(pasta_contexto, ARQUIVO_INDICE))
+        if para_escrita:
+            docstore = abrir_docstore_construcao(pasta_contexto)
+        else:
+            docstore = DocstoreSQLite(caminho_chunks, somente_leitura=True)
+        db = FAISS(embedding_function=embeddings, index=index, docstore=docstore,
+                   index_to_docstore_id=docstore.ler_posicoes())
+    else:
+        # Índices gerados antes do docstore em SQLite (index.pkl).
+        db = FAISS.load_local(pasta_contexto, embeddings, allow_dangerous_deserialization=True)
+    manifesto = ler_manifesto(pasta_contexto) or {}
+    espec = manifesto.get("indice_efetivo")
+    if espec:
+        aplicar_parametros_busca(db.index, espec)
+    preparar_reconstrucao(db.index)
+    return db
@@ -1,16 +1,38 @@
+from __future__ import annotations
+
 import os
 import json
+import time
+import functools
+from typing import TYPE_CHECKING
+
+INICIO_PROCESSO = time.perf_counter()
+
 import requests
 from dotenv import load_dotenv
 
-# Dependências do LangChain
-from langchain_community.vectorstores import FAISS
-from langchain_huggingface import HuggingFaceEmbeddings
+# Dependências do LangChain/FAISS/torch: importadas só quando um especialista
+# RAG é aberto, para o menu e o chat direto subirem sem esse custo.
+if TYPE_CHECKING:
+    from langchain_community.vectorstores import FAISS
+    from indice_lexical import IndiceLexical
+    from pool_contextos import PoolContextos
 
 # (Não precisamos mais de ChatOpenAI ou da classe LLMRemotoLocal aqui!)
 
 # --- FUNÇÃO HELPER PARA COMUNICAÇÃO COM O SERVIDOR ---
 
+URL_GATEWAY = "http://127.0.0.1:8000"
+# Conexões mantidas abertas com o gateway (keep-alive), reaproveitadas entre chamadas.
+MAX_CONEXOES_GATEWAY = 8
+
+@functools.lru_cache(maxsize=None)
+def obter_sessao_gateway() -> requests.Session:
+    sessao = requests.Session()
+    adaptador = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=MAX_CONEXOES_GATEWAY)
+    sessao.mount("http://", adaptador)
+    return sessao
+
 def chamar_servidor_gateway(endpoint: str, prompt_text: str) -> str:
     """
     Função centralizada para chamar um endpoint específico no nosso servidor gateway.
@@ -18,10 +40,10 @@ def chamar_servidor_gateway(endpoint: str, prompt_text: str) -> str:
     """
     try:
         # Monta a URL completa para o endpoint desejado
-        url = f"http://127.0.0.1:8000/{endpoint.strip('/')}"
+        url = f"{URL_GATEWAY}/{endpoint.strip('/')}"
         
         # Envia a requisição com o prompt no corpo JSON
-        response = requests.post(url, json={"prompt": prompt_text}, timeout=300)
+        response = obter_sessao_gateway().post(url, json={"prompt": prompt_text}, timeout=300)
         
         # Levanta um erro para respostas com status 4xx ou 5xx
         response.raise_for_status()
@@ -36,6 +58,104 @@ def chamar_servidor_gateway(endpoint: str, prompt_text: str) -> str:
     except Exception as e:
         return f"ERRO inesperado ao chamar o gateway: {e}"
 
+def chamar_servidor_gateway_stream(endpoint: str, prompt_text: str, imprimir: bool = True) -> tuple[str, dict]:
+    """
+    Chama a versão em streaming de um endpoint ('/gerar_stream', '/sumarizar_stream'),
+    imprimindo os pedaços de texto conforme chegam. Retorna (texto, métricas) com o
+    tempo até o primeiro token (TTFT) e a taxa de tokens/s. Se o gateway não tiver o
+    endpoint de streaming, cai para a chamada normal.
+
+    O corpo é Server-Sent Events: cada 'data:' traz {"texto": ...}; o evento 'fim'
+    traz o uso de tokens e 'erro' interrompe a geração.
+    """
+    url = f"{URL_GATEWAY}/{endpoint.strip('/')}_stream"
+    inicio = time.perf_counter()
+    metricas = {"streaming": True, "erro": False, "ttft_s": None, "tokens": 0}
+    partes = []
+    try:
+        with obter_sessao_gateway().post(url, json={"prompt": prompt_text}, stream=True, timeout=(10, 300)) as response:
+            if response.status_code in (404, 405):
+                texto = chamar_servidor_gateway(endpoint, prompt_text)
+                if imprimir:
+                    print(texto, end="", flush=True)
+                return texto, {"streaming": False, "erro": texto.startswith("ERRO"), "total_s": time.perf_counter() - inicio}
+            response.raise_for_status()
+            evento = "message"
+            for linha in response.iter_lines(decode_unicode=True):
+                if not linha:
+                    evento = "message"
+                    continue
+                if linha.startswith("event:"):
+                    evento = linha[len("event:"):].strip()
+                    continue
+                if not linha.startswith("data:"):
+                    continue
+                dados = json.loads(linha[len("data:"):].strip())
+                if evento == "erro":
+                    partes.append(f"\nERRO durante a geração em /{endpoint}: {dados.get('detail')}")
+                    metricas["erro"] = True
+                    break
+                if evento == "fim":
+                    uso = dados.get("uso") or {}
+                    if uso.get("completion_tokens"):
+                        metricas["tokens"] = uso["completion_tokens"]
+                    metricas["servidor"] = dados.get("tempos")
+                    break
+                pedaco = dados.get("texto", "")
+                if not pedaco:
+                    continue
+                if metricas["ttft_s"] is None:
+                    metricas["ttft_s"] = time.perf_counter() - inicio
+                partes.append(pedaco)
+                metricas["tokens"] += 1
+                if imprimir:
+                    print(pedaco, end="", flush=True)
+    except requests.exceptions.Timeout:
+        partes.append(f"ERRO: A requisição para o endpoint /{endpoint}_stream excedeu o tempo limite.")
+        metricas["erro"] = True
+    except requests.exceptions.RequestException as e:
+        partes.append(f"ERRO DE CONEXÃO com o endpoint /{endpoint}_stream: {e}")
+        metricas["erro"] = True
+    except ValueError as e:
+        partes.append(f"ERRO: Evento inválido recebido de /{endpoint}_stream: {e}")
+        metricas["erro"] = True
+    if metricas["erro"] and imprimir:
+        print(partes[-1], end="", flush=True)
+
+    metricas["total_s"] = time.perf_counter() - inicio
+    if metricas["ttft_s"] is not None:
+        duracao_geracao = metricas["total_s"] - metricas["ttft_s"]
+        metricas["tokens_por_s"] = metricas["tokens"] / duracao_geracao if duracao_geracao > 0 else None
+    return "".join(partes).strip(), metricas
+
+def formatar_metricas_stream(metricas: dict) -> str:
+    if not metricas.get("streaming"):
+        return f"sem streaming, {metricas['total_s']:.2f}s"
+    if metricas.get("ttft_s") is None:
+        return f"nenhum token recebido, {metricas['total_s']:.2f}s"
+    taxa = metricas.get("tokens_por_s")
+    espera_fila = (metricas.get("servidor") or {}).get("espera_fila_s")
+    return (f"TTFT {metricas['ttft_s']:.2f}s | {metricas['tokens']} tokens em {metricas['total_s']:.2f}s"
+            + (f" | {taxa:.1f} tokens/s" if taxa else "")
+            + (f" | fila no servidor: {espera_fila:.2f}s" if espera_fila else ""))
+
+def contar_tokens_gateway(servico: str, textos: list[str], log=print) -> tuple[list[int], str, int | None]:
+    """
+    Pede ao gateway a contagem de tokens dos textos no modelo do serviço.
+    Retorna (tokens, método, n_ctx); sem o gateway, usa a estimativa por caracteres
+    (e avisa por 'log').
+    """
+    from empacotador_contexto import estimar_tokens
+    try:
+        response = obter_sessao_gateway().post(f"{URL_GATEWAY}/contar_tokens",
+                                               json={"servico": servico, "textos": textos}, timeout=30)
+        response.raise_for_status()
+        dados = response.json()
+        return dados["tokens"], dados["metodo"], dados.get("n_ctx")
+    except (requests.exceptions.RequestException, KeyError, ValueError) as e:
+        log(f"   ⚠️ Contagem de tokens indisponível no gateway ({e}). Usando estimativa.")
+        return estimar_tokens(textos), "estimativa", None
+
 # --- CONFIGURAÇÃO E CARREGAMENTO INICIAL ---
 
 print("-> Configurando o ambiente do assistente (Cliente Orquestrador)...")
@@ -44,9 +164,19 @@ load_dotenv()
 # Carrega o nome do modelo ATIVO a partir do JSON (que o servidor configura)
 nome_modelo_principal_ativo = "Modelo Principal Desconhecido"
 nome_modelo_sumarizador_ativo = "Modelo Sumarizador Desconhecido"
+# Janela de contexto por serviço, usada quando o gateway não informa a do modelo carregado.
+n_ctx_por_servico = {}
+PARAMETROS_ORCAMENTO = {"tokens_reservados_resposta": 1024, "margem_seguranca": 64, "n_ctx_nuvem": 32768}
 try:
     with open("config_modelo_local.json", 'r', encoding='utf-8') as f:
         config = json.load(f)
+
+        PARAMETROS_ORCAMENTO.update(config.get("parametros_orcamento", {}))
+        for nome_servico, servico in config.get("servicos", {}).items():
+            if servico.get("tipo") == "local":
+                n_ctx_por_servico[nome_servico] = config.get("parametros_carregamento_local", {}).get("n_ctx", 2048)
+            else:
+                n_ctx_por_servico[nome_servico] = PARAMETROS_ORCAMENTO["n_ctx_nuvem"]
         
         # Lê a configuração do serviço gerador principal
         servico_principal = config.get("servicos", {}).get("gerador_principal", {})
@@ -75,57 +205,290 @@ except FileNotFoundError as e:
     print(f"ERRO: Arquivo de configuração RAG não encontrado: {e.filename}")
     exit()
 
-embeddings = HuggingFaceEmbeddings(model_name="all-MiniLM-L6-v2")
+NOME_MODELO_EMBEDDING = "all-MiniLM-L6-v2"
 PASTA_BASE_INDICES = "indices_rag"
-print("✅ Ambiente do cliente configurado.")
+# Cache de respostas entre sessões (ver cache_consultas). USAR_CACHE_RESPOSTAS=0 desativa.
+USAR_CACHE_RESPOSTAS = os.getenv("USAR_CACHE_RESPOSTAS", "1") != "0"
+# Sumarização (opção do menu): "map_reduce" extrai grupos de chunks em paralelo
+# (ver sumarizacao_map_reduce); "unico" envia todo o contexto num prompt só.
+MODO_RESUMO = os.getenv("MODO_RESUMO", "map_reduce")
+print(f"✅ Ambiente do cliente configurado. (Inicialização em {time.perf_counter() - INICIO_PROCESSO:.2f}s)")
 print(f"   -> Modelo de Geração Principal Ativo no Servidor: {nome_modelo_principal_ativo}")
 print(f"   -> Modelo de Sumarização Ativo no Servidor: {nome_modelo_sumarizador_ativo}")
 
 
+@functools.lru_cache(maxsize=None)
+def obter_embeddings():
+    """
+    Carrega o modelo de embedding na primeira vez que um especialista RAG é aberto.
+    Os vetores das perguntas ficam num LRU: repetir uma pergunta não roda o modelo de novo.
+    """
+    from langchain_huggingface import HuggingFaceEmbeddings
+    from cache_consultas import EmbeddingsConsultaComCache
+    return EmbeddingsConsultaComCache(HuggingFaceEmbeddings(model_name=NOME_MODELO_EMBEDDING))
+
+@functools.lru_cache(maxsize=None)
+def obter_cache_recuperacao():
+    from cache_consultas import CacheLRU, CAPACIDADE_LRU_RECUPERACAO
+    return CacheLRU(CAPACIDADE_LRU_RECUPERACAO)
+
+@functools.lru_cache(maxsize=None)
+def obter_cache_respostas():
+    from cache_consultas import CacheRespostas
+    return CacheRespostas()
+
+def carregar_especialista(id_contexto: str) -> tuple[FAISS, IndiceLexical | None]:
+    """
+    Carrega modelo de embedding, índice vetorial e índice lexical (BM25, se existir)
+    de um contexto, relatando o tempo de cada etapa.
+    """
+    print(f"\n-> Carregando o conhecimento do '{CONTEXTOS_DISPONIVEIS[id_contexto]['nome_exibicao']}'...")
+    inicio = time.perf_counter()
+    embeddings = obter_embeddings()
+    fim_modelo = time.perf_counter()
+    from armazenamento_indices import carregar_indice
+    from indice_lexical import carregar_indice_lexical
+    pasta_contexto = os.path.join(PASTA_BASE_INDICES, id_contexto)
+    db = carregar_indice(pasta_contexto, embeddings)
+    fim_indice = time.perf_counter()
+    indice_lexical = carregar_indice_lexical(pasta_contexto)
+    fim_lexical = time.perf_counter()
+    print(f"   -> Modelo de embedding: {fim_modelo - inicio:.2f}s | Índice: {fim_indice - fim_modelo:.2f}s"
+          f" | BM25: {f'{fim_lexical - fim_indice:.2f}s' if indice_lexical else 'ausente (reindexe para gerar)'}")
+    return db, indice_lexical
+
+
 # --- LÓGICA DE CHAT (ORQUESTRAÇÃO) ---
 
-def loop_chat_rag(db: FAISS, nome_especialista: str, usar_resumo: bool):
+def calcular_orcamento(servico: str, prompt_sem_contexto: str, textos: list[str],
+                       log=print) -> tuple[list[int], int, dict]:
     """
-    Orquestra o fluxo de RAG, chamando os endpoints do servidor gateway
-    conforme necessário.
+    Conta os tokens dos textos no modelo do serviço e calcula quanto cabe de contexto:
+    janela do modelo - template/pergunta - resposta reservada - margem.
+    Retorna (tokens de cada texto, orçamento, detalhes da contagem).
     """
-    print(f"\n✅ Especialista '{nome_especialista}' pronto!")
-    print("   Digite 'sair' a qualquer momento para terminar.")
-    
-    while True:
-        pergunta = input(f"\n🤖 Você pergunta para '{nome_especialista}': ")
-        if pergunta.strip().lower() == 'sair': break
+    tokens, metodo, n_ctx = contar_tokens_gateway(servico, [prompt_sem_contexto, *textos], log)
+    n_ctx = n_ctx or n_ctx_por_servico.get(servico, 2048)
+    orcamento = max(0, n_ctx - tokens[0] - PARAMETROS_ORCAMENTO["tokens_reservados_resposta"]
+                    - PARAMETROS_ORCAMENTO["margem_seguranca"])
+    return tokens[1:], orcamento, {"n_ctx": n_ctx, "tokens_prompt": tokens[0], "metodo": metodo}
 
-        print(f"   -> Fase 1: Buscando documentos relevantes...")
-        docs_relevantes = db.similarity_search(pergunta, k=15)
-        
-        if not docs_relevantes:
-            print("\n💡 Resposta do Especialista:\nNão encontrei documentos relevantes para esta pergunta.")
-            print("-" * 20)
-            continue
+def montar_contexto(docs_relevantes: list, servico: str, prompt_sem_contexto: str, log=print) -> tuple[str, dict]:
+    """Empacota os chunks (já em ordem de relevância) no orçamento de tokens do serviço que vai recebê-los."""
+    from empacotador_contexto import empacotar_contexto
+    tokens, orcamento, detalhes = calcular_orcamento(servico, prompt_sem_contexto,
+                                                     [doc.page_content for doc in docs_relevantes], log)
+    contexto, relatorio = empacotar_contexto(docs_relevantes, tokens, orcamento)
+    relatorio.update(detalhes)
+    return contexto, relatorio
+
+def sumarizar_em_paralelo(docs_relevantes: list, pergunta: str, log=print) -> tuple[str, dict]:
+    """Sumarização map-reduce: grupos de chunks extraídos concorrentemente no /sumarizar."""
+    from sumarizacao_map_reduce import sumarizar_map_reduce
+    template = PROMPTS_CONFIG["sumarizacao_local"]["template"]
+    textos = [doc.page_content for doc in docs_relevantes]
+    tokens, orcamento, _ = calcular_orcamento("sumarizador", template.format(pergunta=pergunta, contexto_completo=""),
+                                              textos, log)
+    return sumarizar_map_reduce(
+        textos, tokens, orcamento,
+        montar_prompt=lambda contexto: template.format(pergunta=pergunta, contexto_completo=contexto),
+        chamar=lambda prompt: chamar_servidor_gateway("sumarizar", prompt),
+        log=log,
+    )
+
+def interpretar_contextos(texto: str) -> list[str] | None:
+    """Converte 'urls,meuooba' (ou números do menu) numa lista de IDs de contextos indexados."""
+    ids = []
+    ids_por_numero = {str(i): id_ctx for i, id_ctx in enumerate(CONTEXTOS_DISPONIVEIS, start=2)}
+    for item in (parte.strip() for parte in texto.split(',')):
+        id_ctx = ids_por_numero.get(item, item)
+        if id_ctx not in CONTEXTOS_DISPONIVEIS:
+            print(f"ERRO: Contexto '{item}' não definido em contexts.json.")
+            return None
+        if not os.path.exists(os.path.join(PASTA_BASE_INDICES, id_ctx)):
+            print(f"ERRO: O especialista '{CONTEXTOS_DISPONIVEIS[id_ctx]['nome_exibicao']}' não foi indexado.")
+            return None
+        if id_ctx not in ids:
+            ids.append(id_ctx)
+    return ids or None
+
+def assinatura_recuperacao() -> tuple:
+    """Parâmetros que mudam os chunks recuperados para a mesma pergunta."""
+    from recuperacao_rag import (
+        K_CANDIDATOS, K_FINAL, LAMBDA_MMR, MODELO_CROSS_ENCODER, MODO_RERANQUEAMENTO, BUSCA_HIBRIDA, K_RRF,
+    )
+    parametro_reranqueamento = {"mmr": LAMBDA_MMR, "cross_encoder": MODELO_CROSS_ENCODER}.get(MODO_RERANQUEAMENTO)
+    return (K_CANDIDATOS, K_FINAL, MODO_RERANQUEAMENTO, parametro_reranqueamento,
+            BUSCA_HIBRIDA, K_RRF if BUSCA_HIBRIDA else None)
+
+def assinatura_geracao(usar_resumo: bool) -> tuple:
+    """
+    A resposta depende também dos modelos ativos, dos templates e de quanto contexto
+    cabe no prompt (orçamento de tokens e agrupamento do map-reduce): tudo entra na chave do cache.
+    """
+    from sumarizacao_map_reduce import TAMANHO_GRUPO_RESUMO
+    servico_contexto = "sumarizador" if usar_resumo else "gerador_principal"
+    return (nome_modelo_principal_ativo, PROMPTS_CONFIG["geracao_rag_local"]["template"],
+            nome_modelo_sumarizador_ativo if usar_resumo else None,
+            PROMPTS_CONFIG["sumarizacao_local"]["template"] if usar_resumo else None,
+            MODO_RESUMO if usar_resumo else None,
+            TAMANHO_GRUPO_RESUMO if usar_resumo and MODO_RESUMO == "map_reduce" else None,
+            sorted(PARAMETROS_ORCAMENTO.items()), n_ctx_por_servico.get(servico_contexto))
+
+def responder_pergunta(contextos: list, id_contexto: str, versao: str, pergunta: str, usar_resumo: bool,
+                       imprimir: bool = True, usar_cache: bool = True, usar_cache_respostas: bool = True) -> dict:
+    """
+    Responde uma pergunta RAG de ponta a ponta: busca, sumarização opcional e geração.
+    Com 'imprimir' o progresso e a resposta vão para o terminal (chat); sem ele, nada
+    é impresso (modo em lote). Retorna um registro com a resposta, os IDs dos chunks
+    usados e o tempo de cada fase em ms (embedding, busca, sumarização, geração).
+    """
+    from cache_consultas import chave_consulta
+    from recuperacao_rag import recuperar_em_contextos, formatar_tempos, MODO_RERANQUEAMENTO
+    log = print if imprimir else (lambda *args, **kwargs: None)
+    inicio = time.perf_counter()
+    registro = {"pergunta": pergunta, "contextos": [c.id for c in contextos], "resposta": None, "chunks": [],
+                "cache": None, "erro": False, "geracao": None, "resumo": None,
+                "tempos_ms": {"embedding": 0.0, "busca": 0.0, "sumarizacao": 0.0, "geracao": 0.0}}
+    tempos_fases = registro["tempos_ms"]
+
+    def finalizar() -> dict:
+        tempos_fases["total"] = (time.perf_counter() - inicio) * 1000
+        return registro
+
+    cache_respostas = obter_cache_respostas() if USAR_CACHE_RESPOSTAS and usar_cache and usar_cache_respostas else None
+    # A chave da resposta inclui a da recuperação: outros chunks, outra resposta.
+    chave_resposta = chave_consulta(id_contexto, versao, *assinatura_recuperacao(), *assinatura_geracao(usar_resumo),
+                                    pergunta)
+    resposta_cache = cache_respostas.obter(chave_resposta) if cache_respostas is not None else None
+    if resposta_cache is not None:
+        log(f"\n💡 Resposta do Especialista (cache, {(time.perf_counter() - inicio) * 1000:.1f} ms):")
+        log(resposta_cache)
+        registro.update({"resposta": resposta_cache, "cache": "resposta"})
+        return finalizar()
+
+    log(f"   -> Fase 1: Buscando documentos relevantes...")
+    cache_recuperacao = obter_cache_recuperacao() if usar_cache else None
+    chave_recuperacao = chave_consulta(id_contexto, versao, *assinatura_recuperacao(), pergunta)
+    docs_relevantes = cache_recuperacao.obter(chave_recuperacao) if cache_recuperacao is not None else None
+    if docs_relevantes is None:
+        inicio_busca = time.perf_counter()
+        docs_relevantes, tempos = recuperar_em_contextos(
+            [(c.id, c.db, c.indice_lexical) for c in contextos], pergunta
+        )
+        # A busca é o tempo total da recuperação menos o embedding da pergunta.
+        tempos_fases["embedding"] = tempos.get("embedding_ms", 0.0)
+        tempos_fases["busca"] = (time.perf_counter() - inicio_busca) * 1000 - tempos_fases["embedding"]
+        log(f"   -> {len(docs_relevantes)} chunks selecionados ({MODO_RERANQUEAMENTO}) | {formatar_tempos(tempos)}")
+        if cache_recuperacao is not None:
+            cache_recuperacao.guardar(chave_recuperacao, docs_relevantes)
+    else:
+        registro["cache"] = "recuperacao"
+        log("   -> Documentos recuperados do cache.")
+    registro["chunks"] = [{"id": doc.id, "contexto": doc.metadata.get("contexto"), "fonte": doc.metadata.get("source")}
+                          for doc in docs_relevantes]
+
+    if not docs_relevantes:
+        registro["resposta"] = "Não encontrei documentos relevantes para esta pergunta."
+        log(f"\n💡 Resposta do Especialista:\n{registro['resposta']}")
+        return finalizar()
 
-        contexto_original = "\n\n".join([doc.page_content for doc in docs_relevantes])
+    # --- ORQUESTRAÇÃO DOS ENDPOINTS ---
+    resumo_falhou = False
+    inicio_resumo = time.perf_counter()
+    if usar_resumo and MODO_RESUMO == "map_reduce":
+        log("   -> Fase 2a: Sumarização map-reduce (grupos em paralelo no endpoint /sumarizar)...")
+        contexto_para_geracao, resumo = sumarizar_em_paralelo(docs_relevantes, pergunta, log)
+        registro["resumo"] = resumo
+        resumo_falhou = resumo["erros"] > 0
+        log(f"   -> {resumo['grupos']} grupos | {resumo['descartados_insuficientes']} sem informação útil, "
+            f"{resumo['erros']} com erro, {resumo['chunks_fora_do_orcamento']} chunks fora do orçamento")
+        log(f"   -> Map: {resumo['mapa_s']:.2f}s (em série seriam {resumo['soma_chamadas_s']:.2f}s, "
+            f"maior chamada {resumo['maior_chamada_s']:.2f}s) | Reduce: {resumo['reducao_s'] * 1000:.1f} ms")
+    else:
+        # O contexto é empacotado para o primeiro modelo que o recebe: o sumarizador ou o gerador.
+        if usar_resumo:
+            servico_contexto = "sumarizador"
+            prompt_sem_contexto = PROMPTS_CONFIG["sumarizacao_local"]["template"].format(pergunta=pergunta, contexto_completo="")
+        else:
+            servico_contexto = "gerador_principal"
+            prompt_sem_contexto = PROMPTS_CONFIG["geracao_rag_local"]["template"].format(contexto="", pergunta=pergunta)
+        contexto_original, orcamento = montar_contexto(docs_relevantes, servico_contexto, prompt_sem_contexto, log)
+        log(f"   -> Orçamento de contexto ({servico_contexto}): {orcamento['usados']}/{orcamento['orcamento']} tokens "
+            f"| {orcamento['chunks_incluidos']} chunks em {orcamento['trechos']} trechos, "
+            f"{orcamento['chunks_descartados']} descartados | contagem: {orcamento['metodo']}")
         contexto_para_geracao = contexto_original
-        
-        # --- ORQUESTRAÇÃO DOS ENDPOINTS ---
+
         if usar_resumo:
-            print("   -> Fase 2a: Formatando prompt de sumarização e chamando endpoint /sumarizar...")
+            log("   -> Fase 2a: Formatando prompt de sumarização e chamando endpoint /sumarizar...")
             prompt_sumarizacao = PROMPTS_CONFIG["sumarizacao_local"]["template"].format(
                 pergunta=pergunta, contexto_completo=contexto_original
             )
             contexto_para_geracao = chamar_servidor_gateway("sumarizar", prompt_sumarizacao)
-            print("   -> Contexto sumarizado recebido do servidor.")
+            resumo_falhou = contexto_para_geracao.startswith("ERRO")
+            log("   -> Contexto sumarizado recebido do servidor.")
+    # Sem resumo, esta fase mede só a contagem de tokens e o empacotamento.
+    tempos_fases["sumarizacao"] = (time.perf_counter() - inicio_resumo) * 1000
 
-        print("   -> Fase 2b: Formatando prompt final e chamando endpoint /gerar...")
-        # Usamos um template padrão, que pode ser o 'local' ou 'nuvem' dependendo do seu gosto.
-        # A lógica é a mesma.
-        prompt_geracao = PROMPTS_CONFIG["geracao_rag_local"]["template"].format(
-            contexto=contexto_para_geracao, pergunta=pergunta
-        )
-        resposta_final = chamar_servidor_gateway("gerar", prompt_geracao)
-        
-        print("\n💡 Resposta do Especialista:")
-        print(resposta_final)
+    log("   -> Fase 2b: Formatando prompt final e chamando endpoint /gerar...")
+    # Usamos um template padrão, que pode ser o 'local' ou 'nuvem' dependendo do seu gosto.
+    # A lógica é a mesma.
+    prompt_geracao = PROMPTS_CONFIG["geracao_rag_local"]["template"].format(
+        contexto=contexto_para_geracao, pergunta=pergunta
+    )
+    log("\n💡 Resposta do Especialista:")
+    inicio_geracao = time.perf_counter()
+    resposta_final, metricas = chamar_servidor_gateway_stream("gerar", prompt_geracao, imprimir=imprimir)
+    tempos_fases["geracao"] = (time.perf_counter() - inicio_geracao) * 1000
+    registro.update({"resposta": resposta_final, "geracao": metricas, "erro": metricas["erro"] or resumo_falhou})
+    # Erros do gateway (e sumarizações que falharam) não são guardados.
+    if cache_respostas is not None and resposta_final and not registro["erro"]:
+        cache_respostas.guardar(chave_resposta, resposta_final)
+    return finalizar()
+
+def loop_chat_rag(pool: PoolContextos, ids_contextos: list[str], usar_resumo: bool):
+    """
+    Orquestra o fluxo de RAG, chamando os endpoints do servidor gateway
+    conforme necessário. Perguntas repetidas são atendidas pelos caches
+    (resposta, chunks recuperados e embedding da pergunta). Com mais de um
+    contexto ativo, a busca é feita em todos ao mesmo tempo. Os contextos
+    ficam residentes no pool: '/contexto a,b' troca os ativos na hora.
+    """
+    from cache_consultas import versao_indice
+
+    print("   Digite 'sair' a qualquer momento para terminar, '/contexto a,b' para trocar de especialistas")
+    print("   e '/contextos' para ver os que estão em memória.")
+
+    def ativar(ids: list[str]):
+        contextos = pool.obter_varios(ids)
+        nome = " + ".join(CONTEXTOS_DISPONIVEIS[c.id]["nome_exibicao"] for c in contextos)
+        # O índice de cada contexto entra na versão: reindexar qualquer um invalida os caches.
+        versao = "|".join(versao_indice(os.path.join(PASTA_BASE_INDICES, c.id)) for c in contextos)
+        print(f"\n✅ Especialista '{nome}' pronto!")
+        return contextos, nome, "+".join(ids), versao
+
+    contextos, nome_especialista, id_contexto, versao = ativar(ids_contextos)
+
+    while True:
+        pergunta = input(f"\n🤖 Você pergunta para '{nome_especialista}': ")
+        if pergunta.strip().lower() == 'sair': break
+        if pergunta.strip().lower() == '/contextos':
+            for residente in pool.residentes():
+                print(f"   - {residente.id} ({residente.tamanho_bytes / 1024 / 1024:.1f} MB)")
+            print(f"   Total: {pool.tamanho_total() / 1024 / 1024:.1f} MB de {pool.orcamento_bytes / 1024 / 1024:.0f} MB")
+            continue
+        if pergunta.strip().lower().startswith('/contexto'):
+            novos_ids = interpretar_contextos(pergunta.strip()[len('/contexto'):])
+            if novos_ids:
+                inicio_troca = time.perf_counter()
+                contextos, nome_especialista, id_contexto, versao = ativar(novos_ids)
+                print(f"   -> Troca de contexto em {(time.perf_counter() - inicio_troca) * 1000:.1f} ms.")
+            continue
+
+        registro = responder_pergunta(contextos, id_contexto, versao, pergunta, usar_resumo)
+        if registro["geracao"]:
+            print(f"\n   ({formatar_metricas_stream(registro['geracao'])} | total da pergunta: "
+                  f"{registro['tempos_ms']['total'] / 1000:.2f}s)")
         print("-" * 20)
 
 def loop_chat_puro():
@@ -147,19 +510,77 @@ def loop_chat_puro():
         prompt_final = template_string.format(pergunta=pergunta)
         
         # A chamada é sempre para o endpoint de geração
-        response = chamar_servidor_gateway("gerar", prompt_final)
-
         print("\n💡 Resposta do Gateway:")
-        print(response)
+        _, metricas = chamar_servidor_gateway_stream("gerar", prompt_final)
+        print(f"\n   ({formatar_metricas_stream(metricas)})")
         print("-" * 20)
 
 
+def rodar_lote(args):
+    """Modo não interativo: responde as perguntas de um arquivo e grava as respostas em JSONL."""
+    from cache_consultas import versao_indice
+    from execucao_lote import ler_perguntas, executar_lote, formatar_resumo_lote
+    from pool_contextos import PoolContextos
+
+    ids_contextos = interpretar_contextos(args.contexto)
+    if not ids_contextos:
+        exit(1)
+    try:
+        perguntas = ler_perguntas(args.lote)
+    except (OSError, ValueError) as e:
+        print(f"ERRO: Não foi possível ler as perguntas: {e}")
+        exit(1)
+    caminho_saida = args.saida or f"{os.path.splitext(args.lote)[0]}.respostas.jsonl"
+
+    contextos = PoolContextos(carregar_especialista, PASTA_BASE_INDICES).obter_varios(ids_contextos)
+    id_contexto = "+".join(ids_contextos)
+    versao = "|".join(versao_indice(os.path.join(PASTA_BASE_INDICES, c.id)) for c in contextos)
+    print(f"\n-> Lote: {len(perguntas)} perguntas para '{id_contexto}' | concorrência {args.concorrencia}"
+          f" | resumo: {MODO_RESUMO if args.resumo else 'não'} | saída: {caminho_saida}")
+
+    resumo = executar_lote(
+        perguntas,
+        # Sem '--cache-respostas', toda pergunta passa pela busca e pela geração: o registro
+        # traz os chunks e os tempos de cada fase, e uma nova execução mede o pipeline.
+        lambda pergunta: responder_pergunta(contextos, id_contexto, versao, pergunta, args.resumo,
+                                            imprimir=False, usar_cache=not args.sem_cache,
+                                            usar_cache_respostas=args.cache_respostas),
+        caminho_saida, args.concorrencia,
+    )
+    print(f"\n✅ {formatar_resumo_lote(resumo)}")
+
+def criar_parser_argumentos():
+    import argparse
+    from execucao_lote import CONCORRENCIA_LOTE_PADRAO
+    parser = argparse.ArgumentParser(description="Assistente de IA com servidor gateway. Sem argumentos, abre o menu interativo.")
+    parser.add_argument("--lote", help="Arquivo de perguntas (.jsonl com o campo 'pergunta', ou texto com uma por linha).")
+    parser.add_argument("--contexto", help="Especialista(s) que respondem o lote, ex: 'urls' ou 'urls,meuooba'.")
+    parser.add_argument("--saida", help="Arquivo JSONL das respostas (padrão: <lote>.respostas.jsonl).")
+    parser.add_argument("--concorrencia", type=int, default=CONCORRENCIA_LOTE_PADRAO,
+                        help=f"Perguntas em andamento ao mesmo tempo (padrão: {CONCORRENCIA_LOTE_PADRAO}).")
+    parser.add_argument("--resumo", action="store_true", help="Sumariza o contexto antes da geração.")
+    parser.add_argument("--cache-respostas", action="store_true",
+                        help="Usa o cache persistente de respostas; perguntas já respondidas saem sem chunks nem tempos.")
+    parser.add_argument("--sem-cache", action="store_true",
+                        help="Ignora também o cache em memória dos chunks recuperados.")
+    return parser
+
+
 # --- EXECUÇÃO PRINCIPAL (SIMPLIFICADA) ---
 
 if __name__ == "__main__":
+    parser = criar_parser_argumentos()
+    args = parser.parse_args()
+    if args.lote:
+        if not args.contexto:
+            parser.error("--lote exige --contexto.")
+        rodar_lote(args)
+        exit()
+
     print("\n--- Assistente de IA com Servidor Gateway ---")
     print("Escolha o modo de operação:")
     print(f"  1. Conversa Geral (com o modelo principal: {nome_modelo_principal_ativo})")
+    print("     (Para consultar vários especialistas de uma vez, separe os números por vírgula, ex: 2,3)")
     
     opcoes_rag = {}
     # Começa o menu RAG a partir do número 2
@@ -172,19 +593,18 @@ if __name__ == "__main__":
 
     if escolha_principal == '1':
         loop_chat_puro()
-    elif escolha_principal in opcoes_rag:
-        ctx_info = opcoes_rag[escolha_principal]
-        if "❌" in ctx_info["status"]:
-            print(f"\nERRO: O especialista '{ctx_info['nome']}' não foi indexado.")
+    elif escolha_principal.split(',')[0].strip() in opcoes_rag:
+        # Vários especialistas podem ser escolhidos de uma vez, ex: "2,3".
+        ids_escolhidos = interpretar_contextos(escolha_principal)
+        if not ids_escolhidos:
             exit()
         
         # Não perguntamos mais qual motor usar, a decisão está no servidor!
         usar_resumo = input("Deseja SUMARIZAR o contexto antes de enviar? (s/n, padrão 'n'): ").lower() == 's'
         
-        print(f"\n-> Carregando o conhecimento do '{ctx_info['nome']}'...")
-        db_contexto = FAISS.load_local(os.path.join(PASTA_BASE_INDICES, ctx_info["id"]), embeddings, allow_dangerous_deserialization=True)
-        
-        loop_chat_rag(db_contexto, ctx_info["nome"], usar_resumo)
+        from pool_contextos import PoolContextos
+        pool = PoolContextos(carregar_especialista, PASTA_BASE_INDICES)
+        loop_chat_rag(pool, ids_escolhidos, usar_resumo)
     else:
         print("Escolha inválida.")
         
@@ -0,0 +1,227 @@
+import os
+import sys
+import json
+import glob
+import time
+import random
+import shutil
+import argparse
+import platform
+import resource
+import tempfile
+import threading
+import contextlib
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+
+# Mede cada etapa da indexação (chunking, embedding, build/save/load do FAISS)
+# sobre os arquivos de 'documentos_rag/' e sobre versões sintéticas ampliadas
+# do mesmo corpus. O resultado sai em JSON para comparar execuções; o progresso
+# das etapas vai para o stderr para não misturar com o JSON.
+# A memória de cada etapa é o pico da RSS atual, amostrada enquanto ela roda
+# (ru_maxrss só cresce e repetiria o pico da etapa mais pesada nas seguintes).
+# Cada escala roda num processo novo, sem herdar a memória das anteriores.
+
+PASTA_DOCUMENTOS = "documentos_rag"
+INTERVALO_AMOSTRA_RSS_S = 0.01
+
+def rss_atual_bytes() -> int | None:
+    """Memória residente atual do processo: /proc no Linux, psutil se instalado; None sem nenhum dos dois."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        pass
+    try:
+        import psutil
+    except ImportError:
+        return None
+    return psutil.Process().memory_info().rss
+
+class AmostradorRSS:
+    """Guarda o pico da RSS atual enquanto o bloco roda, amostrando numa thread."""
+
+    def __init__(self, intervalo_s: float = INTERVALO_AMOSTRA_RSS_S):
+        self.intervalo_s = intervalo_s
+        self.inicio = self.pico = None
+        self._parar = threading.Event()
+        self._thread = threading.Thread(target=self._amostrar, daemon=True)
+
+    def _registrar(self):
+        rss = rss_atual_bytes()
+        if rss is not None:
+            self.pico = rss if self.pico is None else max(self.pico, rss)
+
+    def _amostrar(self):
+        while not self._parar.wait(self.intervalo_s):
+            self._registrar()
+
+    def __enter__(self):
+        self.inicio = rss_atual_bytes()
+        self._registrar()
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._parar.set()
+        self._thread.join()
+        self._registrar()
+
+def pico_rss_processo_mb() -> float:
+    """Plano B sem /proc nem psutil: pico do processo inteiro (ru_maxrss é em KB no Linux)."""
+    pico = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(pico / 1024 if sys.platform != "darwin" else pico / (1024 * 1024), 1)
+
+def tamanho_pasta_bytes(pasta: str) -> int:
+    return sum(os.path.getsize(os.path.join(raiz, nome)) for raiz, _, nomes in os.walk(pasta) for nome in nomes)
+
+def medir(etapa: str, funcao, contar=None) -> tuple[object, dict]:
+    """
+    Executa uma etapa com o stdout desviado para o stderr e devolve (resultado, métricas).
+    'contar' recebe o resultado e diz quantos chunks a etapa processou.
+    """
+    print(f"-> Etapa '{etapa}'...", file=sys.stderr)
+    inicio = time.perf_counter()
+    with contextlib.redirect_stdout(sys.stderr), AmostradorRSS() as memoria:
+        resultado = funcao()
+    duracao = time.perf_counter() - inicio
+    metricas = {"tempo_s": round(duracao, 4)}
+    if memoria.pico is not None:
+        metricas["pico_rss_mb"] = round(memoria.pico / 1024 / 1024, 1)
+        metricas["rss_inicio_mb"] = round(memoria.inicio / 1024 / 1024, 1)
+    else:
+        metricas["pico_rss_processo_mb"] = pico_rss_processo_mb()
+    if contar is not None:
+        itens = contar(resultado)
+        metricas["chunks"] = itens
+        metricas["chunks_por_s"] = round(itens / duracao, 1) if duracao > 0 else None
+    return resultado, metricas
+
+def carregar_corpus(padrao: str) -> list[tuple[str, str]]:
+    documentos = []
+    for caminho in sorted(glob.glob(padrao)):
+        with open(caminho, 'r', encoding='utf-8') as f:
+            documentos.append((caminho, f.read()))
+    return documentos
+
+def ampliar_corpus(documentos: list[tuple[str, str]], escala: int) -> list[tuple[str, str]]:
+    """Replica o corpus 'escala' vezes, marcando cada cópia para que os documentos não sejam idênticos."""
+    if escala == 1:
+        return documentos
+    return [(f"{caminho}#copia{i}", f"[Cópia sintética {i}]\n{texto}")
+            for i in range(escala) for caminho, texto in documentos]
+
+def executar_escala(documentos: list[tuple[str, str]], escala: int, args) -> dict:
+    import numpy as np
+    from chunker_customizado import chunkificar_texto_completo
+    from gerenciador_indices import EstagioEmbedding, obter_embeddings
+    from armazenamento_indices import (
+        normalizar_espec_indice, tamanho_amostra_treino, criar_indice_faiss, abrir_docstore_construcao, novo_db,
+        salvar_indice, carregar_indice,
+    )
+
+    corpus = ampliar_corpus(documentos, escala)
+    resultado = {
+        "escala": escala,
+        "documentos": len(corpus),
+        "bytes": sum(len(texto.encode('utf-8')) for _, texto in corpus),
+        "etapas": {},
+    }
+    etapas = resultado["etapas"]
+
+    # 1. Chunking
+    def chunkificar():
+        return [chunk for _, texto in corpus for chunk in chunkificar_texto_completo(texto)]
+    chunks, etapas["chunking"] = medir("chunking", chunkificar, contar=len)
+
+    # 2. Embedding (sem o cache em disco, para medir o modelo). Em escalas grandes
+    #    embedamos só uma amostra e replicamos os vetores para as etapas do FAISS.
+    amostra = chunks
+    if args.max_chunks_embedding and len(chunks) > args.max_chunks_embedding:
+        amostra = random.Random(42).sample(chunks, args.max_chunks_embedding)
+    obter_embeddings()
+
+    def embedar():
+        with EstagioEmbedding(args.lote_embedding, args.processos_embedding, usar_cache=False) as estagio:
+            return estagio.embedar(amostra)
+    vetores_amostra, etapas["embedding"] = medir("embedding", embedar, contar=len)
+    etapas["embedding"]["vetores_replicados"] = len(amostra) < len(chunks)
+
+    vetores = np.asarray(vetores_amostra, dtype=np.float32)
+    if len(amostra) < len(chunks):
+        vetores = np.resize(vetores, (len(chunks), vetores.shape[1]))
+
+    # 3. Build, save e load do índice FAISS
+    pasta = tempfile.mkdtemp(prefix="benchmark_indice_")
+    try:
+        espec = normalizar_espec_indice(json.loads(args.indice) if args.indice else None)
+        ids = [f"chunk-{i}" for i in range(len(chunks))]
+
+        def construir():
+            index, _ = criar_indice_faiss(espec, vetores[:max(1, tamanho_amostra_treino(espec))])
+            db = novo_db(obter_embeddings(), index, abrir_docstore_construcao(pasta, copiar_existente=False))
+            for inicio in range(0, len(chunks), 512):
+                fim = inicio + 512
+                db.add_embeddings(zip(chunks[inicio:fim], vetores[inicio:fim].tolist()),
+                                  metadatas=[{"source": "benchmark"}] * len(chunks[inicio:fim]), ids=ids[inicio:fim])
+            return db
+        db, etapas["faiss_build"] = medir("faiss_build", construir, contar=lambda db: len(db.index_to_docstore_id))
+
+        _, etapas["faiss_save"] = medir("faiss_save", lambda: salvar_indice(db, pasta))
+        etapas["faiss_save"]["tamanho_indice_bytes"] = tamanho_pasta_bytes(pasta)
+        del db
+
+        db_carregado, etapas["faiss_load"] = medir("faiss_load", lambda: carregar_indice(pasta, obter_embeddings()))
+
+        consultas = vetores[random.Random(7).sample(range(len(chunks)), min(args.consultas, len(chunks)))]
+        def buscar():
+            for vetor in consultas:
+                db_carregado.similarity_search_with_score_by_vector(vetor.tolist(), k=15)
+        _, etapas["busca"] = medir("busca", buscar)
+        etapas["busca"]["consultas"] = len(consultas)
+        etapas["busca"]["latencia_media_ms"] = round(etapas["busca"]["tempo_s"] * 1000 / max(1, len(consultas)), 3)
+        db_carregado.docstore.fechar()
+    finally:
+        shutil.rmtree(pasta, ignore_errors=True)
+
+    return resultado
+
+def executar_escala_isolada(documentos: list[tuple[str, str]], escala: int, args) -> dict:
+    """Roda a escala num processo novo ("spawn"), para a memória não vir das escalas anteriores."""
+    with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context("spawn")) as executor:
+        return executor.submit(executar_escala, documentos, escala, args).result()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark das etapas de indexação RAG.")
+    parser.add_argument("--corpus", type=str, default=os.path.join(PASTA_DOCUMENTOS, "*.txt"), help="Glob dos arquivos de texto usados como corpus.")
+    parser.add_argument("--escalas", type=str, default="1,10,100", help="Fatores de ampliação sintética do corpus, separados por vírgula.")
+    parser.add_argument("--max-chunks-embedding", type=int, default=5000, help="Máximo de chunks embedados por escala (0 = todos).")
+    parser.add_argument("--lote-embedding", type=int, default=64, help="Tamanho do lote do estágio de embedding.")
+    parser.add_argument("--processos-embedding", type=int, default=1, help="Processos do estágio de embedding.")
+    parser.add_argument("--indice", type=str, default=None, help='Especificação do índice em JSON, ex: \'{"tipo": "hnsw"}\'.')
+    parser.add_argument("--consultas", type=int, default=100, help="Quantidade de buscas k=15 medidas após o load.")
+    parser.add_argument("--saida", type=str, default=None, help="Arquivo JSON de saída (padrão: stdout).")
+    args = parser.parse_args()
+
+    documentos = carregar_corpus(args.corpus)
+    if not documentos:
+        print(f"ERRO: Nenhum arquivo encontrado para o padrão '{args.corpus}'.", file=sys.stderr)
+        sys.exit(1)
+
+    relatorio = {
+        "data": datetime.now().isoformat(timespec="seconds"),
+        "maquina": {"python": platform.python_version(), "plataforma": platform.platform(), "cpus": os.cpu_count()},
+        "parametros": vars(args),
+        "corpus": [caminho for caminho, _ in documentos],
+        "resultados": [executar_escala_isolada(documentos, int(escala), args) for escala in args.escalas.split(",")],
+    }
+
+    saida = json.dumps(relatorio, ensure_ascii=False, indent=2)
+    if args.saida:
+        with open(args.saida, 'w', encoding='utf-8') as f:
+            f.write(saida)
+        print(f"✅ Resultados salvos em '{args.saida}'.", file=sys.stderr)
+    else:
+        print(saida)
@@ -0,0 +1,130 @@
+import os
+import time
+import sqlite3
+import hashlib
+import threading
+from collections import OrderedDict
+
+from langchain_core.embeddings import Embeddings
+
+from cache_embeddings import normalizar_texto
+
+# --- CONFIGURAÇÃO ---
+# Três camadas de cache para o chat RAG, da mais barata para a mais cara de refazer:
+#   1. embedding da pergunta (LRU em memória);
+#   2. chunks recuperados, por (contexto, versão do índice, pergunta normalizada);
+#   3. resposta final do gateway, persistida em SQLite com TTL entre sessões.
+# A versão do índice entra nas chaves: reindexar um contexto invalida as camadas 2 e 3.
+PASTA_CACHE_CONSULTAS = "cache_consultas"
+ARQUIVO_CACHE_RESPOSTAS = os.path.join(PASTA_CACHE_CONSULTAS, "respostas.sqlite")
+CAPACIDADE_LRU_EMBEDDINGS = 1024
+CAPACIDADE_LRU_RECUPERACAO = 256
+TTL_RESPOSTAS_PADRAO_S = 24 * 3600
+
+
+def chave_consulta(*partes) -> str:
+    """Chave estável para uma combinação de partes; a última costuma ser a pergunta (normalizada aqui)."""
+    *prefixo, pergunta = partes
+    conteudo = "\0".join([*(str(p) for p in prefixo), normalizar_texto(pergunta).lower()])
+    return hashlib.sha256(conteudo.encode('utf-8')).hexdigest()
+
+def versao_indice(pasta_contexto: str) -> str:
+    """
+    Identifica a versão do índice salvo em disco pelo mtime/tamanho do arquivo
+    do FAISS: toda gravação do gerenciador troca esse arquivo.
+    """
+    for nome in ("index.faiss", "index.pkl"):
+        caminho = os.path.join(pasta_contexto, nome)
+        if os.path.exists(caminho):
+            info = os.stat(caminho)
+            return f"{info.st_mtime_ns}-{info.st_size}"
+    return "sem-indice"
+
+
+class CacheLRU:
+    """Dicionário limitado em memória, descartando o item usado há mais tempo."""
+
+    def __init__(self, capacidade: int):
+        self.capacidade = capacidade
+        self._itens = OrderedDict()
+        self._lock = threading.Lock()
+        self.acertos = 0
+        self.faltas = 0
+
+    def obter(self, chave):
+        with self._lock:
+            if chave not in self._itens:
+                self.faltas += 1
+                return None
+            self._itens.move_to_end(chave)
+            self.acertos += 1
+            return self._itens[chave]
+
+    def guardar(self, chave, valor):
+        with self._lock:
+            self._itens[chave] = valor
+            self._itens.move_to_end(chave)
+            while len(self._itens) > self.capacidade:
+                self._itens.popitem(last=False)
+
+
+class EmbeddingsConsultaComCache(Embeddings):
+    """
+    Envolve o modelo de embeddings guardando os vetores das perguntas num LRU.
+    Os documentos continuam passando direto (na indexação quem cuida é o CacheEmbeddings).
+    """
+
+    def __init__(self, embeddings_base: Embeddings, capacidade: int = CAPACIDADE_LRU_EMBEDDINGS):
+        self.embeddings_base = embeddings_base
+        self.lru = CacheLRU(capacidade)
+
+    def embed_documents(self, texts: list[str]) -> list[list[float]]:
+        return self.embeddings_base.embed_documents(texts)
+
+    def embed_query(self, text: str) -> list[float]:
+        chave = normalizar_texto(text)
+        vetor = self.lru.obter(chave)
+        if vetor is None:
+            vetor = self.embeddings_base.embed_query(text)
+            self.lru.guardar(chave, vetor)
+        return vetor
+
+
+class CacheRespostas:
+    """Respostas finais persistidas em SQLite; entradas mais velhas que o TTL são ignoradas e apagadas."""
+
+    def __init__(self, caminho: str = ARQUIVO_CACHE_RESPOSTAS, ttl_s: float | None = None):
+        if ttl_s is None:
+            ttl_s = float(os.getenv("TTL_CACHE_RESPOSTAS_S", TTL_RESPOSTAS_PADRAO_S))
+        self.ttl_s = ttl_s
+        pasta = os.path.dirname(caminho)
+        if pasta:
+            os.makedirs(pasta, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(caminho, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS respostas ("
+            " chave TEXT PRIMARY KEY, resposta TEXT NOT NULL, criado_em REAL NOT NULL)"
+        )
+        self._conn.execute("DELETE FROM respostas WHERE criado_em < ?", (time.time() - self.ttl_s,))
+        self._conn.commit()
+
+    def obter(self, chave: str) -> str | None:
+        with self._lock:
+            linha = self._conn.execute(
+                "SELECT resposta FROM respostas WHERE chave = ? AND criado_em >= ?", (chave, time.time() - self.ttl_s)
+            ).fetchone()
+        return linha[0] if linha else None
+
+    def guardar(self, chave: str, resposta: str):
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO respostas (chave, resposta, criado_em) VALUES (?, ?, ?)",
+                (chave, resposta, time.time()),
+            )
+            self._conn.commit()
+
+    def fechar(self):
+        with self._lock:
+            self._conn.close()
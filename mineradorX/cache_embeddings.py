@@ -0,0 +1,146 @@
+import os
+import re
+import time
+import sqlite3
+import hashlib
+import threading
+import unicodedata
+from array import array
+
+from langchain_core.embeddings import Embeddings
+
+# --- CONFIGURAÇÃO ---
+# O cache é compartilhado por todos os contextos: um chunk que aparece em mais
+# de uma coleção (ex: os arquivos '_parte2') só é embedado uma vez por modelo.
+PASTA_CACHE_EMBEDDINGS = "cache_embeddings"
+ARQUIVO_CACHE_EMBEDDINGS = os.path.join(PASTA_CACHE_EMBEDDINGS, "embeddings.sqlite")
+LIMITE_CACHE_PADRAO_MB = 512
+
+_ESPACOS = re.compile(r'\s+')
+
+def normalizar_texto(texto: str) -> str:
+    """Normaliza unicode e espaços para que variações triviais caiam na mesma chave."""
+    return _ESPACOS.sub(' ', unicodedata.normalize('NFC', texto)).strip()
+
+def chave_embedding(nome_modelo: str, texto: str) -> str:
+    """Chave de conteúdo do cache: (modelo, hash do texto normalizado)."""
+    texto_normalizado = normalizar_texto(texto)
+    return hashlib.sha256(f"{nome_modelo}\0{texto_normalizado}".encode('utf-8')).hexdigest()
+
+
+class CacheEmbeddings:
+    """
+    Cache em disco (SQLite) de vetores de embedding, endereçado por conteúdo.
+    Quando o tamanho total passa do limite, os vetores acessados há mais tempo
+    são descartados (LRU).
+    """
+
+    def __init__(self, caminho: str = ARQUIVO_CACHE_EMBEDDINGS, limite_mb: float | None = None):
+        if limite_mb is None:
+            limite_mb = float(os.getenv("LIMITE_CACHE_EMBEDDINGS_MB", LIMITE_CACHE_PADRAO_MB))
+        self.limite_bytes = int(limite_mb * 1024 * 1024)
+        pasta = os.path.dirname(caminho)
+        if pasta:
+            os.makedirs(pasta, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(caminho, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings ("
+            " chave TEXT PRIMARY KEY, vetor BLOB NOT NULL, ultimo_acesso REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_ultimo_acesso ON embeddings (ultimo_acesso)")
+        self._conn.commit()
+        # Total em bytes mantido a cada inserção/despejo, sem varrer a tabela toda vez.
+        self._tamanho_total = self._medir_tamanho()
+
+    def obter_muitos(self, chaves: list[str]) -> list[list[float] | None]:
+        """Retorna os vetores na mesma ordem das chaves (None para as ausentes)."""
+        encontrados = {}
+        with self._lock:
+            for i in range(0, len(chaves), 500):
+                lote = chaves[i:i + 500]
+                marcadores = ",".join("?" * len(lote))
+                for chave, blob in self._conn.execute(
+                    f"SELECT chave, vetor FROM embeddings WHERE chave IN ({marcadores})", lote
+                ):
+                    encontrados[chave] = array('f', blob).tolist()
+            if encontrados:
+                agora = time.time()
+                self._conn.executemany(
+                    "UPDATE embeddings SET ultimo_acesso = ? WHERE chave = ?",
+                    [(agora, chave) for chave in encontrados],
+                )
+                self._conn.commit()
+        return [encontrados.get(chave) for chave in chaves]
+
+    def guardar_muitos(self, chaves: list[str], vetores: list[list[float]]):
+        agora = time.time()
+        linhas = [(chave, array('f', vetor).tobytes(), agora) for chave, vetor in zip(chaves, vetores)]
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO embeddings (chave, vetor, ultimo_acesso) VALUES (?, ?, ?)", linhas,
+            )
+            self._conn.commit()
+            self._tamanho_total += sum(len(blob) for _, blob, _ in linhas)
+            self._aplicar_limite()
+
+    def _medir_tamanho(self) -> int:
+        return self._conn.execute("SELECT COALESCE(SUM(LENGTH(vetor)), 0) FROM embeddings").fetchone()[0]
+
+    def _aplicar_limite(self):
+        if self._tamanho_total <= self.limite_bytes:
+            return
+        # O total corrente só superestima (chaves substituídas, outros processos no mesmo
+        # arquivo): antes de despejar, confere o tamanho real, uma varredura só aqui.
+        self._tamanho_total = self._medir_tamanho()
+        if self._tamanho_total <= self.limite_bytes:
+            return
+        # Libera até 90% do limite para não despejar a cada inserção.
+        excesso = self._tamanho_total - int(self.limite_bytes * 0.9)
+        removidos = 0
+        chaves_remover = []
+        for chave, tamanho in self._conn.execute(
+            "SELECT chave, LENGTH(vetor) FROM embeddings ORDER BY ultimo_acesso"
+        ):
+            chaves_remover.append((chave,))
+            removidos += tamanho
+            if removidos >= excesso:
+                break
+        self._conn.executemany("DELETE FROM embeddings WHERE chave = ?", chaves_remover)
+        self._conn.commit()
+        self._tamanho_total -= removidos
+
+    def fechar(self):
+        with self._lock:
+            self._conn.close()
+
+
+class EmbeddingsComCache(Embeddings):
+    """
+    Envolve um modelo de embeddings do LangChain consultando o CacheEmbeddings
+    antes de chamar o modelo. Só os textos ausentes do cache são calculados.
+    """
+
+    def __init__(self, embeddings_base: Embeddings, nome_modelo: str, cache: CacheEmbeddings | None = None):
+        self.embeddings_base = embeddings_base
+        self.nome_modelo = nome_modelo
+        self.cache = cache if cache is not None else CacheEmbeddings()
+        self.acertos = 0
+        self.faltas = 0
+
+    def embed_documents(self, texts: list[str]) -> list[list[float]]:
+        chaves = [chave_embedding(self.nome_modelo, texto) for texto in texts]
+        vetores = self.cache.obter_muitos(chaves)
+        indices_faltantes = [i for i, vetor in enumerate(vetores) if vetor is None]
+        self.acertos += len(texts) - len(indices_faltantes)
+        self.faltas += len(indices_faltantes)
+        if indices_faltantes:
+            calculados = self.embeddings_base.embed_documents([texts[i] for i in indices_faltantes])
+            self.cache.guardar_muitos([chaves[i] for i in indices_faltantes], calculados)
+            for i, vetor in zip(indices_faltantes, calculados):
+                vetores[i] = vetor
+        return vetores
+
+    def embed_query(self, text: str) -> list[float]:
+        return self.embeddings_base.embed_query(text)
@@ -1,9 +1,32 @@
 import re
+import os
+import time
+import functools
+import multiprocessing
+from collections import deque
+from collections.abc import Iterable, Iterator
+from concurrent.futures import ProcessPoolExecutor
+
 import nltk
 
 # Defina aqui o número mínimo de caracteres que um chunk deve ter.
 TAMANHO_MINIMO_CHUNK = 300
 
+PADRAO_BLOCO_CODIGO = re.compile(r'```.*?```', re.DOTALL)
+PADRAO_PLACEHOLDER = re.compile(r'__CODE_BLOCK_PLACEHOLDER_(0|[1-9][0-9]*)__')
+# Modo de chunking por tokens do modelo de embedding. O all-MiniLM-L6-v2 trunca
+# a entrada em 256 tokens, incluindo [CLS] e [SEP]; tudo além disso é ignorado.
+MODELO_TOKENIZADOR_PADRAO = "sentence-transformers/all-MiniLM-L6-v2"
+TOKENS_ESPECIAIS_POR_CHUNK = 2
+CONFIG_CHUNKING_PADRAO = {
+    "caracteres": {},
+    "tokens": {"modelo_tokenizador": MODELO_TOKENIZADOR_PADRAO, "min_tokens": 64, "max_tokens": 256, "sobreposicao": 0},
+}
+
+PADRAO_CAMINHO = re.compile(r'((?<=[\s,(])(/|./)[\w./\-_]+)')
+PADRAO_VARIAVEL = re.compile(r'(\$\w+)')
+PADRAO_ATRIBUICAO = re.compile(r'(\b[A-Z_]{3,}=[\w"\./\-_]+)')
+
 # Garante que o 'punkt' esteja disponível
 try:
     nltk.data.find('tokenizers/punkt')
@@ -14,9 +37,9 @@ except nltk.downloader.DownloadError:
 
 def aplicar_formatacao_inline(texto):
     """Aplica formatação inline (`) em elementos específicos do texto."""
-    texto = re.sub(r'((?<=[\s,(])(/|./)[\w./\-_]+)', r'`\1`', texto)
-    texto = re.sub(r'(\$\w+)', r'`\1`', texto)
-    texto = re.sub(r'(\b[A-Z_]{3,}=[\w"\./\-_]+)', r'`\1`', texto)
+    texto = PADRAO_CAMINHO.sub(r'`\1`', texto)
+    texto = PADRAO_VARIAVEL.sub(r'`\1`', texto)
+    texto = PADRAO_ATRIBUICAO.sub(r'`\1`', texto)
     return texto
 
 def chunkificar_texto_completo(texto_completo: str) -> list[str]:
@@ -25,12 +48,19 @@ def chunkificar_texto_completo(texto_completo: str) -> list[str]:
     Esta função encapsula a lógica do seu script original.
     """
     # 1. Proteger blocos de código
-    code_blocks = re.findall(r'(```.*?```)', texto_completo, re.DOTALL)
-    placeholders = []
-    for i, block in enumerate(code_blocks):
-        placeholder = f"__CODE_BLOCK_PLACEHOLDER_{i}__"
-        placeholders.append(placeholder)
-        texto_completo = texto_completo.replace(block, placeholder, 1)
+    # Uma única passada com os offsets de cada bloco: o texto protegido é
+    # montado de uma vez, sem um str.replace (e uma cópia do texto) por bloco.
+    code_blocks = []
+    partes = []
+    posicao = 0
+    for match in PADRAO_BLOCO_CODIGO.finditer(texto_completo):
+        partes.append(texto_completo[posicao:match.start()])
+        partes.append(f"__CODE_BLOCK_PLACEHOLDER_{len(code_blocks)}__")
+        code_blocks.append(match.group())
+        posicao = match.end()
+    partes.append(texto_completo[posicao:])
+    texto_completo = "".join(partes)
+    del partes
 
     # 2. Lógica de Chunking
     sentencas = nltk.sent_tokenize(texto_completo, language='portuguese')
@@ -53,18 +83,240 @@ def chunkificar_texto_completo(texto_completo: str) -> list[str]:
         chunks_finais.append(" ".join(chunk_temporario).strip())
 
     # 3. Restaurar blocos de código
-    # Esta parte é complexa de reintegrar de forma limpa. Para o RAG,
-    # é mais eficaz tratar os blocos de código como chunks separados.
+    # Para o RAG, é mais eficaz tratar os blocos de código como chunks separados,
+    # mas eles também são devolvidos ao texto de onde saíram. Cada chunk é
+    # percorrido uma vez, trocando só os placeholders que ele realmente contém.
+    def restaurar(match):
+        indice = int(match.group(1))
+        return code_blocks[indice] if indice < len(code_blocks) else match.group(0)
+
     chunks_processados = []
     for chunk in chunks_finais:
-        # Se um placeholder está no chunk, simplesmente o substituímos.
-        # Uma lógica mais avançada poderia ser necessária para múltiplos placeholders em um chunk.
-        for i, placeholder in enumerate(placeholders):
-            if placeholder in chunk:
-                chunk = chunk.replace(placeholder, code_blocks[i])
+        if code_blocks and "__CODE_BLOCK_PLACEHOLDER_" in chunk:
+            chunk = PADRAO_PLACEHOLDER.sub(restaurar, chunk)
         chunks_processados.append(chunk)
 
     # Adiciona os blocos de código originais como chunks individuais para garantir que não se percam
     chunks_processados.extend(code_blocks)
 
-    return [chunk for chunk in chunks_processados if chunk] # Retorna a lista de chunks de texto
\ No newline at end of file
+    return [chunk for chunk in chunks_processados if chunk] # Retorna a lista de chunks de texto
+
+
+# --- CHUNKING POR TOKENS DO MODELO DE EMBEDDING ---
+
+def normalizar_config_chunking(config: dict | None) -> dict:
+    """Valida a configuração de chunking de um contexto e preenche os valores padrão."""
+    config = dict(config or {})
+    modo = config.pop("modo", "caracteres")
+    if modo not in CONFIG_CHUNKING_PADRAO:
+        raise ValueError(f"Modo de chunking '{modo}' inválido. Use um de: {', '.join(CONFIG_CHUNKING_PADRAO)}.")
+    desconhecidos = set(config) - set(CONFIG_CHUNKING_PADRAO[modo])
+    if desconhecidos:
+        raise ValueError(f"Parâmetros não reconhecidos para o chunking '{modo}': {', '.join(sorted(desconhecidos))}.")
+    normalizada = {"modo": modo, **CONFIG_CHUNKING_PADRAO[modo], **config}
+    if modo == "tokens":
+        limite = normalizada["max_tokens"] - TOKENS_ESPECIAIS_POR_CHUNK
+        if not 0 < normalizada["min_tokens"] <= limite or not 0 <= normalizada["sobreposicao"] < normalizada["min_tokens"]:
+            raise ValueError("Chunking por tokens exige 0 < min_tokens <= max_tokens - 2 e 0 <= sobreposicao < min_tokens.")
+    return normalizada
+
+@functools.lru_cache(maxsize=None)
+def obter_tokenizador(nome_modelo: str):
+    """Tokenizador do modelo de embedding, carregado uma vez por processo."""
+    from transformers import AutoTokenizer
+    return AutoTokenizer.from_pretrained(nome_modelo)
+
+def _contar_tokens(tokenizador, texto: str) -> int:
+    return len(tokenizador(texto, add_special_tokens=False)["input_ids"])
+
+def _dividir_em_janelas(tokenizador, texto: str, max_tokens: int) -> list[str]:
+    """
+    Divide um texto longo em pedaços de até max_tokens, cortando sempre no
+    início de uma palavra (nunca num sub-token '##'), para que cada pedaço,
+    tokenizado de novo, continue cabendo no limite. Só uma palavra sozinha
+    maior que max_tokens é cortada no meio; como o pedaço que começa no meio
+    dela é tokenizado de outro jeito, cada pedaço é recontado e o corte recua
+    até ele caber.
+    """
+    codificado = tokenizador(texto, add_special_tokens=False, return_offsets_mapping=True)
+    tokens = tokenizador.convert_ids_to_tokens(codificado["input_ids"])
+    offsets = codificado["offset_mapping"]
+    pedacos = []
+    inicio = 0
+    while inicio < len(tokens):
+        fim = min(inicio + max_tokens, len(tokens))
+        if fim < len(tokens):
+            corte = fim
+            while corte > inicio and tokens[corte].startswith("##"):
+                corte -= 1
+            # Uma palavra maior que a janela não tem onde cortar: corta no limite.
+            if corte > inicio:
+                fim = corte
+        pedaco = texto[offsets[inicio][0]:offsets[fim - 1][1]].strip()
+        while fim > inicio + 1 and _contar_tokens(tokenizador, pedaco) > max_tokens:
+            fim -= 1
+            pedaco = texto[offsets[inicio][0]:offsets[fim - 1][1]].strip()
+        if pedaco:
+            pedacos.append(pedaco)
+        inicio = fim
+    return pedacos
+
+def _dividir_bloco_codigo(tokenizador, bloco: str, max_tokens: int) -> list[str]:
+    """Divide um bloco de código grande por linhas; linhas enormes viram janelas de tokens."""
+    if _contar_tokens(tokenizador, bloco) <= max_tokens:
+        return [bloco]
+    pedacos = []
+    linhas_atuais = []
+    tokens_atuais = 0
+    for linha in bloco.split('\n'):
+        n = _contar_tokens(tokenizador, linha)
+        if n > max_tokens:
+            if linhas_atuais:
+                pedacos.append('\n'.join(linhas_atuais))
+                linhas_atuais, tokens_atuais = [], 0
+            pedacos.extend(_dividir_em_janelas(tokenizador, linha, max_tokens))
+            continue
+        if tokens_atuais + n > max_tokens and linhas_atuais:
+            pedacos.append('\n'.join(linhas_atuais))
+            linhas_atuais, tokens_atuais = [], 0
+        linhas_atuais.append(linha)
+        tokens_atuais += n
+    if linhas_atuais:
+        pedacos.append('\n'.join(linhas_atuais))
+    return [pedaco for pedaco in pedacos if pedaco.strip()]
+
+def chunkificar_por_tokens(texto_completo: str, tokenizador, min_tokens: int = 64, max_tokens: int = 256,
+                           sobreposicao: int = 0) -> list[str]:
+    """
+    Variante do chunker que mede os chunks em tokens do modelo de embedding.
+    Segue a mesma regra de fechamento (tamanho mínimo + sentença terminada em
+    "."), mas nunca passa de max_tokens (já descontados [CLS] e [SEP]), de modo
+    que cada chunk é embedado inteiro, sem truncamento. Blocos de código viram
+    chunks próprios, divididos se forem grandes demais. Com 'sobreposicao', as
+    últimas sentenças de um chunk (até esse número de tokens) abrem o seguinte.
+    """
+    limite = max_tokens - TOKENS_ESPECIAIS_POR_CHUNK
+    chunks_codigo = []
+    partes_texto = []
+    posicao = 0
+    for match in PADRAO_BLOCO_CODIGO.finditer(texto_completo):
+        partes_texto.append(texto_completo[posicao:match.start()])
+        chunks_codigo.extend(_dividir_bloco_codigo(tokenizador, match.group(), limite))
+        posicao = match.end()
+    partes_texto.append(texto_completo[posicao:])
+    texto_sem_codigo = "\n".join(partes_texto)
+    del partes_texto
+
+    # Sentenças com sua contagem de tokens; sentenças maiores que o limite viram janelas.
+    sentencas = []
+    for sentenca in nltk.sent_tokenize(texto_sem_codigo, language='portuguese'):
+        n = _contar_tokens(tokenizador, sentenca)
+        if n <= limite:
+            sentencas.append((sentenca, n))
+        else:
+            sentencas.extend((pedaco, _contar_tokens(tokenizador, pedaco))
+                             for pedaco in _dividir_em_janelas(tokenizador, sentenca, limite))
+
+    chunks_finais = []
+    chunk_temporario = []
+    tokens_temporario = 0
+    tokens_proprios = 0  # tokens que não vieram da sobreposição
+
+    def fechar_chunk():
+        nonlocal chunk_temporario, tokens_temporario, tokens_proprios
+        chunks_finais.append(" ".join(s for s, _ in chunk_temporario).strip())
+        mantidas = []
+        tokens_mantidos = 0
+        for sentenca, n in reversed(chunk_temporario):
+            if tokens_mantidos + n > sobreposicao:
+                break
+            mantidas.insert(0, (sentenca, n))
+            tokens_mantidos += n
+        chunk_temporario, tokens_temporario, tokens_proprios = mantidas, tokens_mantidos, 0
+
+    for sentenca, n in sentencas:
+        if tokens_temporario + n > limite and tokens_proprios:
+            fechar_chunk()
+        while tokens_temporario + n > limite and chunk_temporario:
+            # A sobreposição não pode empurrar o chunk além do limite.
+            tokens_temporario -= chunk_temporario.pop(0)[1]
+        chunk_temporario.append((sentenca, n))
+        tokens_temporario += n
+        tokens_proprios += n
+        if tokens_temporario >= min_tokens and sentenca.strip().endswith('.'):
+            fechar_chunk()
+
+    if tokens_proprios:
+        sobra = " ".join(s for s, _ in chunk_temporario).strip()
+        # Um resto menor que o mínimo é anexado ao chunk anterior, se couber.
+        if (chunks_finais and tokens_proprios < min_tokens and not sobreposicao
+                and _contar_tokens(tokenizador, chunks_finais[-1]) + tokens_temporario <= limite):
+            chunks_finais[-1] = f"{chunks_finais[-1]} {sobra}"
+        else:
+            chunks_finais.append(sobra)
+
+    # Conferência final: juntar sentenças/linhas pode tokenizar diferente da soma das
+    # partes (BPE, palavras cortadas), então cada chunk é recontado e, se passou, redividido.
+    chunks = []
+    for chunk in chunks_finais + chunks_codigo:
+        if not chunk:
+            continue
+        if _contar_tokens(tokenizador, chunk) <= limite:
+            chunks.append(chunk)
+        else:
+            chunks.extend(_dividir_em_janelas(tokenizador, chunk, limite))
+    return chunks
+
+# --- CHUNKING DE VÁRIOS DOCUMENTOS EM PARALELO ---
+
+def _inicializar_worker_chunking():
+    # Carrega o tokenizador 'punkt' uma única vez por processo.
+    nltk.sent_tokenize("Aquecimento do tokenizador.", language='portuguese')
+
+def chunkificar_com_estatisticas(texto: str, config: dict | None = None) -> tuple[list[str], dict]:
+    """
+    Chunkifica um documento conforme a configuração de chunking do contexto
+    (normalizada) e devolve também estatísticas do processamento.
+    """
+    inicio = time.perf_counter()
+    if config and config["modo"] == "tokens":
+        chunks = chunkificar_por_tokens(texto, obter_tokenizador(config["modelo_tokenizador"]), config["min_tokens"],
+                                        config["max_tokens"], config["sobreposicao"])
+    else:
+        chunks = chunkificar_texto_completo(texto)
+    estatisticas = {
+        "caracteres": len(texto),
+        "chunks": len(chunks),
+        "maior_chunk": max((len(chunk) for chunk in chunks), default=0),
+        "tempo_s": round(time.perf_counter() - inicio, 4),
+    }
+    return chunks, estatisticas
+
+def chunkificar_documentos(textos: Iterable[str], processos: int | None = None,
+                           config: dict | None = None) -> Iterator[tuple[list[str], dict]]:
+    """
+    Chunkifica muitos documentos distribuindo-os entre processos. Os resultados
+    (chunks, estatísticas) saem na mesma ordem da entrada, e no máximo alguns
+    documentos por processo ficam em andamento, então 'textos' pode ser um
+    gerador de tamanho arbitrário. Com processos <= 1, roda no processo atual.
+    """
+    if processos is None:
+        processos = os.cpu_count() or 1
+    chunkificar = functools.partial(chunkificar_com_estatisticas, config=config)
+    if processos <= 1:
+        yield from map(chunkificar, textos)
+        return
+
+    janela = processos * 4
+    with ProcessPoolExecutor(
+        max_workers=processos,
+        mp_context=multiprocessing.get_context("spawn"),
+        initializer=_inicializar_worker_chunking,
+    ) as pool:
+        pendentes = deque()
+        for texto in textos:
+            pendentes.append(pool.submit(chunkificar, texto))
+            if len(pendentes) >= janela:
+                yield pendentes.popleft().result()
+        while pendentes:
+            yield pendentes.popleft().result()
@@ -0,0 +1,246 @@
+import os
+import math
+import time
+import random
+import asyncio
+import importlib.util
+from contextlib import asynccontextmanager
+from email.utils import parsedate_to_datetime
+
+import httpx
+
+# --- CLIENTE HTTP DA ROTA DE NUVEM (OPENROUTER) ---
+# Um único httpx.AsyncClient vive enquanto o servidor estiver no ar: as conexões
+# (TCP+TLS, e HTTP/2 quando o pacote 'h2' está instalado) são reaproveitadas
+# entre chamadas. Respostas 429/5xx e falhas de conexão são repetidas com
+# backoff exponencial, respeitando o Retry-After do provedor. Um disjuntor
+# (circuit breaker) para de chamar o provedor depois de várias falhas seguidas,
+# para que um OpenRouter fora do ar não prenda os pedidos até o timeout.
+# A 'url_base' é configurável (ou OPENROUTER_BASE_URL), o que permite apontar
+# o gateway para um servidor de teste local.
+URL_BASE_OPENROUTER = "https://openrouter.ai/api/v1"
+CONFIG_CLIENTE_NUVEM_PADRAO = {
+    "url_base": URL_BASE_OPENROUTER,
+    "http2": True,
+    "max_conexoes": 20,
+    "max_conexoes_ociosas": 10,
+    "keepalive_s": 30.0,
+    "timeout_conexao_s": 10.0,
+    "timeout_s": 180.0,
+    "tentativas": 3,
+    "backoff_base_s": 0.5,
+    "backoff_max_s": 20.0,
+    "falhas_para_abrir_circuito": 5,
+    "circuito_aberto_s": 30.0,
+}
+STATUS_RETENTAVEIS = {429, 500, 502, 503, 504}
+# Provedor sobrecarregado: o gateway repassa o status e o Retry-After ao cliente.
+STATUS_SOBRECARGA = {429, 503}
+# Erros de transporte em que o pedido pode ser repetido com segurança: a conexão
+# nem abriu, ou o servidor a fechou sem mandar nenhum byte de resposta (conexão
+# keep-alive vencida). Só são tratados assim quando saem do send(), que retorna
+# assim que os cabeçalhos chegam. Um erro de leitura (ReadError) pode vir depois
+# de o provedor já ter processado (e cobrado) o pedido, então não é repetido.
+ERROS_RETENTAVEIS = (httpx.ConnectError, httpx.ConnectTimeout, httpx.RemoteProtocolError)
+
+
+class CircuitoAberto(Exception):
+    def __init__(self, retry_after_s: int):
+        super().__init__(f"O provedor de nuvem está indisponível (circuito aberto). Tente de novo em {retry_after_s}s.")
+        self.retry_after_s = retry_after_s
+
+
+class ProvedorSobrecarregado(Exception):
+    """429/503 que sobrou depois das retentativas (ou com um Retry-After longo demais para esperar)."""
+
+    def __init__(self, status_code: int, retry_after_s: int):
+        super().__init__(f"O provedor de nuvem respondeu HTTP {status_code}. Tente de novo em {retry_after_s}s.")
+        self.status_code = status_code
+        self.retry_after_s = retry_after_s
+
+
+class DisjuntorCircuito:
+    """
+    Fechado: tudo passa. Depois de 'falhas_para_abrir' falhas seguidas, abre e
+    recusa chamadas por 'tempo_aberto_s'. Passado esse tempo, deixa uma chamada de
+    teste passar (meio aberto): se ela funcionar o circuito fecha, senão abre de novo.
+    """
+
+    def __init__(self, falhas_para_abrir: int, tempo_aberto_s: float):
+        self.falhas_para_abrir = falhas_para_abrir
+        self.tempo_aberto_s = tempo_aberto_s
+        self.falhas_seguidas = 0
+        self.aberto_ate = None
+        self.teste_em_andamento = False
+
+    @property
+    def estado(self) -> str:
+        if self.aberto_ate is None:
+            return "fechado"
+        return "aberto" if time.monotonic() < self.aberto_ate else "meio_aberto"
+
+    def verificar(self):
+        """Levanta CircuitoAberto se uma chamada agora seria recusada, sem reservar o teste."""
+        estado = self.estado
+        if estado == "aberto" or (estado == "meio_aberto" and self.teste_em_andamento):
+            restante = self.aberto_ate - time.monotonic() if estado == "aberto" else 1
+            raise CircuitoAberto(max(1, round(restante)))
+
+    def permitir(self):
+        self.verificar()
+        if self.estado == "meio_aberto":
+            self.teste_em_andamento = True
+
+    def registrar_sucesso(self):
+        self.falhas_seguidas = 0
+        self.aberto_ate = None
+        self.teste_em_andamento = False
+
+    def registrar_falha(self):
+        self.falhas_seguidas += 1
+        if self.teste_em_andamento or self.falhas_seguidas >= self.falhas_para_abrir:
+            if self.estado == "fechado":
+                print(f"   ⚠️ Provedor de nuvem com {self.falhas_seguidas} falhas seguidas: "
+                      f"circuito aberto por {self.tempo_aberto_s:.0f}s.")
+            self.aberto_ate = time.monotonic() + self.tempo_aberto_s
+            self.teste_em_andamento = False
+
+
+def http2_disponivel() -> bool:
+    return importlib.util.find_spec("h2") is not None
+
+
+def ler_retry_after(resposta: httpx.Response) -> float | None:
+    """Retry-After em segundos, aceitando tanto o número quanto a data HTTP."""
+    valor = resposta.headers.get("Retry-After")
+    if not valor:
+        return None
+    try:
+        return max(0.0, float(valor))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(valor).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+class ClienteOpenRouter:
+    """Cliente compartilhado do endpoint /chat/completions, com retentativas e disjuntor."""
+
+    def __init__(self, chave_api: str | None, config: dict | None = None):
+        self.config = {**CONFIG_CLIENTE_NUVEM_PADRAO, **(config or {})}
+        self.config["url_base"] = os.getenv("OPENROUTER_BASE_URL", self.config["url_base"]).rstrip("/")
+        self.chave_api = chave_api
+        self.disjuntor = DisjuntorCircuito(self.config["falhas_para_abrir_circuito"], self.config["circuito_aberto_s"])
+        self._cliente = None
+        self.http2 = False
+
+    async def iniciar(self):
+        self.http2 = self.config["http2"] and http2_disponivel()
+        if self.config["http2"] and not self.http2:
+            print("⚠️ AVISO: pacote 'h2' não instalado; a rota de nuvem usará HTTP/1.1 (pip install 'httpx[http2]').")
+        self._cliente = httpx.AsyncClient(
+            base_url=self.config["url_base"],
+            http2=self.http2,
+            headers={"Authorization": f"Bearer {self.chave_api}"} if self.chave_api else None,
+            limits=httpx.Limits(max_connections=self.config["max_conexoes"],
+                                max_keepalive_connections=self.config["max_conexoes_ociosas"],
+                                keepalive_expiry=self.config["keepalive_s"]),
+            timeout=httpx.Timeout(self.config["timeout_s"], connect=self.config["timeout_conexao_s"]),
+        )
+
+    async def fechar(self):
+        if self._cliente is not None:
+            await self._cliente.aclose()
+            self._cliente = None
+
+    def _backoff(self, tentativa: int) -> float:
+        espera = min(self.config["backoff_max_s"], self.config["backoff_base_s"] * 2 ** tentativa)
+        # Jitter para pedidos que falharam juntos não voltarem todos ao mesmo tempo.
+        return espera * random.uniform(0.5, 1.0)
+
+    async def _enviar(self, json_data: dict, stream: bool = False) -> httpx.Response:
+        """
+        Faz o POST com retentativas e retorna a última resposta (que pode ser um erro
+        HTTP, para o chamador tratar). Com 'stream' o corpo ainda não foi lido.
+        """
+        for tentativa in range(self.config["tentativas"] + 1):
+            self.disjuntor.permitir()
+            ultima = tentativa == self.config["tentativas"]
+            try:
+                requisicao = self._cliente.build_request("POST", "/chat/completions", json=json_data)
+                resposta = await self._cliente.send(requisicao, stream=stream)
+            except ERROS_RETENTAVEIS as e:
+                self.disjuntor.registrar_falha()
+                if ultima:
+                    raise
+                motivo, espera = f"{type(e).__name__}: {e}", self._backoff(tentativa)
+            except httpx.PoolTimeout:
+                # Nenhuma conexão livre no pool: o gargalo é local, não do provedor.
+                self.disjuntor.teste_em_andamento = False
+                raise
+            except httpx.TransportError:
+                # Timeout e erro de leitura/escrita e afins: conta como falha do provedor,
+                # mas não repete, porque o pedido pode já ter sido processado (e cobrado).
+                self.disjuntor.registrar_falha()
+                raise
+            except asyncio.CancelledError:
+                # Cliente desconectou: não diz nada sobre o provedor, só libera o teste do disjuntor.
+                self.disjuntor.teste_em_andamento = False
+                raise
+            else:
+                if resposta.status_code not in STATUS_RETENTAVEIS:
+                    # Erros 4xx (fora o 429) são do pedido, não do provedor.
+                    self.disjuntor.registrar_sucesso()
+                    return resposta
+                if resposta.status_code >= 500:
+                    self.disjuntor.registrar_falha()
+                else:
+                    self.disjuntor.teste_em_andamento = False
+                retry_after = ler_retry_after(resposta)
+                espera = retry_after if retry_after is not None else self._backoff(tentativa)
+                # Um Retry-After maior que o backoff máximo não vale a espera: devolve o erro.
+                if ultima or espera > self.config["backoff_max_s"]:
+                    return resposta
+                await resposta.aclose()
+                motivo = f"HTTP {resposta.status_code}"
+            print(f"   ⚠️ OpenRouter: tentativa {tentativa + 1} falhou ({motivo}); nova tentativa em {espera:.1f}s.")
+            await asyncio.sleep(espera)
+
+    def _verificar_sobrecarga(self, resposta: httpx.Response):
+        if resposta.status_code in STATUS_SOBRECARGA:
+            retry_after = ler_retry_after(resposta)
+            raise ProvedorSobrecarregado(
+                resposta.status_code, max(1, math.ceil(retry_after if retry_after is not None else self.config["backoff_max_s"])))
+
+    async def completar(self, json_data: dict) -> dict:
+        """
+        Chamada sem streaming: retorna o JSON da resposta. Levanta ProvedorSobrecarregado
+        para 429/503 e httpx.HTTPStatusError para os demais erros HTTP.
+        """
+        resposta = await self._enviar(json_data)
+        self._verificar_sobrecarga(resposta)
+        resposta.raise_for_status()
+        return resposta.json()
+
+    @asynccontextmanager
+    async def stream(self, json_data: dict):
+        """
+        Abre a chamada em streaming e entrega a resposta com o corpo ainda não lido.
+        Só o início é repetido: depois do primeiro byte, uma falha vai para o chamador.
+        429/503 viram ProvedorSobrecarregado; os demais erros HTTP chegam como resposta.
+        """
+        resposta = await self._enviar(json_data, stream=True)
+        try:
+            self._verificar_sobrecarga(resposta)
+            yield resposta
+        except httpx.TransportError:
+            self.disjuntor.registrar_falha()
+            raise
+        finally:
+            await resposta.aclose()
+
+    def estado(self) -> dict:
+        return {"url_base": self.config["url_base"], "http2": self.http2, "circuito": self.disjuntor.estado,
+                "falhas_seguidas": self.disjuntor.falhas_seguidas}
@@ -0,0 +1,143 @@
+import os
+import re
+import zlib
+
+import numpy as np
+
+# --- DEDUPLICAÇÃO DE CHUNKS QUASE IDÊNTICOS ---
+# As bases coletadas repetem muito texto (rodapés, menus, artigos copiados
+# entre páginas, os arquivos '_parte2'). Antes do embedding, cada chunk novo
+# recebe uma assinatura MinHash dos seus shingles de palavras; o LSH (bandas
+# da assinatura) encontra os candidatos e a similaridade de Jaccard estimada
+# decide se ele é uma duplicata de um chunk já mantido. Desativada por padrão
+# (descartar chunks muda o que a busca encontra); liga-se por contexto em
+# contexts.json:
+#   "deduplicacao": true                  (valores de CONFIG_DEDUPLICACAO_PADRAO)
+#   "deduplicacao": {"limiar": 0.9}       (ajustando algum parâmetro)
+ARQUIVO_ASSINATURAS = "minhash.npz"
+
+CONFIG_DEDUPLICACAO_PADRAO = {"limiar": 0.85, "num_permutacoes": 128, "tamanho_shingle": 5}
+
+# Primo de Mersenne usado nas permutações (a * h + b) mod P, como no datasketch.
+_PRIMO_MERSENNE = np.uint64((1 << 61) - 1)
+_MAX_HASH = np.uint64((1 << 32) - 1)
+_SEMENTE_PERMUTACOES = 1
+_PALAVRAS = re.compile(r'\w+')
+
+def normalizar_config_deduplicacao(config: dict | bool | None) -> dict | None:
+    """
+    Valida a configuração de deduplicação de um contexto. Retorna None se ela
+    estiver desativada (chave ausente, null ou false).
+    """
+    if config is None or config is False:
+        return None
+    config = dict(config) if isinstance(config, dict) else {}
+    desconhecidos = set(config) - set(CONFIG_DEDUPLICACAO_PADRAO)
+    if desconhecidos:
+        raise ValueError(f"Parâmetros de deduplicação não reconhecidos: {', '.join(sorted(desconhecidos))}.")
+    normalizada = {**CONFIG_DEDUPLICACAO_PADRAO, **config}
+    if not 0 < normalizada["limiar"] <= 1:
+        raise ValueError("O limiar de deduplicação deve estar entre 0 e 1.")
+    return normalizada
+
+def escolher_bandas(num_permutacoes: int, limiar: float) -> tuple[int, int]:
+    """
+    Escolhe (bandas, linhas por banda) para o LSH de modo que o ponto de
+    inflexão da curva de candidatos, (1/b)^(1/r), fique logo abaixo do limiar.
+    """
+    opcoes = [(num_permutacoes // r, r) for r in range(1, num_permutacoes + 1) if num_permutacoes % r == 0]
+    abaixo = [(b, r) for b, r in opcoes if (1 / b) ** (1 / r) <= limiar]
+    return max(abaixo or opcoes[:1], key=lambda br: (1 / br[0]) ** (1 / br[1]))
+
+
+class DeduplicadorMinHash:
+    """
+    Índice MinHash/LSH em memória dos chunks mantidos. As permutações usam uma
+    semente fixa, então as assinaturas salvas continuam válidas entre execuções.
+    """
+
+    def __init__(self, limiar: float, num_permutacoes: int, tamanho_shingle: int):
+        self.limiar = limiar
+        self.num_permutacoes = num_permutacoes
+        self.tamanho_shingle = tamanho_shingle
+        gerador = np.random.RandomState(_SEMENTE_PERMUTACOES)
+        self._a = gerador.randint(1, int(_PRIMO_MERSENNE), size=num_permutacoes, dtype=np.uint64)
+        self._b = gerador.randint(0, int(_PRIMO_MERSENNE), size=num_permutacoes, dtype=np.uint64)
+        self.bandas, self.linhas = escolher_bandas(num_permutacoes, limiar)
+        self.ids = []
+        self.assinaturas = []
+        self._baldes = [{} for _ in range(self.bandas)]
+
+    @classmethod
+    def da_config(cls, config: dict) -> "DeduplicadorMinHash":
+        return cls(config["limiar"], config["num_permutacoes"], config["tamanho_shingle"])
+
+    def assinatura(self, texto: str) -> np.ndarray:
+        palavras = _PALAVRAS.findall(texto.lower())
+        k = self.tamanho_shingle
+        shingles = {" ".join(palavras[i:i + k]) for i in range(max(1, len(palavras) - k + 1))}
+        hashes = np.fromiter((zlib.crc32(s.encode('utf-8')) for s in shingles), dtype=np.uint64, count=len(shingles))
+        with np.errstate(over='ignore'):
+            permutados = (np.outer(hashes, self._a) + self._b) % _PRIMO_MERSENNE & _MAX_HASH
+        return permutados.min(axis=0).astype(np.uint32)
+
+    def _chaves_baldes(self, assinatura: np.ndarray):
+        for banda in range(self.bandas):
+            yield banda, assinatura[banda * self.linhas:(banda + 1) * self.linhas].tobytes()
+
+    def encontrar_duplicata(self, assinatura: np.ndarray) -> str | None:
+        """Retorna o ID do chunk mantido mais parecido, se a similaridade estimada atingir o limiar."""
+        candidatos = set()
+        for banda, chave in self._chaves_baldes(assinatura):
+            candidatos.update(self._baldes[banda].get(chave, ()))
+        melhor, melhor_similaridade = None, self.limiar
+        for posicao in candidatos:
+            similaridade = float(np.mean(self.assinaturas[posicao] == assinatura))
+            if similaridade >= melhor_similaridade:
+                melhor, melhor_similaridade = self.ids[posicao], similaridade
+        return melhor
+
+    def adicionar(self, id_chunk: str, assinatura: np.ndarray):
+        posicao = len(self.ids)
+        self.ids.append(id_chunk)
+        self.assinaturas.append(assinatura)
+        for banda, chave in self._chaves_baldes(assinatura):
+            self._baldes[banda].setdefault(chave, []).append(posicao)
+
+    def salvar(self, pasta_contexto: str, ids_validos: set[str]):
+        """Grava as assinaturas dos chunks que continuam no índice."""
+        manter = [i for i, id_chunk in enumerate(self.ids) if id_chunk in ids_validos]
+        assinaturas = np.stack([self.assinaturas[i] for i in manter]) if manter else \
+            np.empty((0, self.num_permutacoes), dtype=np.uint32)
+        caminho = os.path.join(pasta_contexto, ARQUIVO_ASSINATURAS)
+        with open(caminho + ".tmp", 'wb') as f:
+            np.savez(f, ids=np.array([self.ids[i] for i in manter], dtype=str), assinaturas=assinaturas,
+                     tamanho_shingle=self.tamanho_shingle)
+        os.replace(caminho + ".tmp", caminho)
+
+    def carregar(self, pasta_contexto: str, ids_validos: set[str]) -> bool:
+        """Recarrega as assinaturas salvas (só dos IDs ainda no índice). Retorna False se não houver arquivo compatível."""
+        caminho = os.path.join(pasta_contexto, ARQUIVO_ASSINATURAS)
+        if not os.path.exists(caminho):
+            return False
+        with np.load(caminho) as dados:
+            assinaturas = dados["assinaturas"]
+            if assinaturas.shape[1] != self.num_permutacoes or int(dados["tamanho_shingle"]) != self.tamanho_shingle:
+                return False
+            for id_chunk, assinatura in zip(dados["ids"].tolist(), assinaturas):
+                if id_chunk in ids_validos:
+                    self.adicionar(id_chunk, assinatura)
+        return True
+
+
+def fontes_por_chunk(fontes: dict, duplicatas: dict) -> dict[str, list[str]]:
+    """
+    A partir das fontes do manifesto, lista as fontes de cada chunk mantido
+    que representa mais de uma fonte ou substitui duplicatas.
+    """
+    todas = {}
+    representantes = set(duplicatas.values())
+    for fonte, info in fontes.items():
+        for hash_chunk in info["chunks"]:
+            todas.setdefault(duplicatas.get(hash_chunk, hash_chunk), set()).add(fonte)
+    return {h: sorted(f) for h, f in todas.items() if len(f) > 1 or h in representantes}
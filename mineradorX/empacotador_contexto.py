@@ -0,0 +1,71 @@
+from __future__ import annotations
+
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from langchain_core.documents import Document
+
+# --- EMPACOTAMENTO DO CONTEXTO POR ORÇAMENTO DE TOKENS ---
+# O contexto enviado ao gateway precisa caber na janela do modelo junto com o
+# template do prompt e os tokens reservados para a resposta. Os chunks entram
+# por ordem de relevância enquanto houver orçamento; depois, chunks vizinhos
+# da mesma fonte (metadado "posicao") são unidos num único trecho, na ordem
+# original do documento.
+SEPARADOR_TRECHOS = "\n\n"
+CARACTERES_POR_TOKEN_ESTIMADOS = 4
+
+def estimar_tokens(textos: list[str]) -> list[int]:
+    """Estimativa usada quando o gateway não consegue contar com o tokenizador do modelo."""
+    return [len(texto) // CARACTERES_POR_TOKEN_ESTIMADOS + 1 for texto in textos]
+
+def mesclar_adjacentes(selecionados: list[tuple[int, Document]]) -> list[str]:
+    """
+    Recebe (rank, documento) dos chunks escolhidos e une os que são vizinhos na
+    mesma fonte. Os trechos resultantes saem na ordem do chunk mais relevante de cada um.
+    """
+    sem_posicao = []
+    por_fonte = {}
+    for rank, doc in selecionados:
+        if doc.metadata.get("posicao") is None:
+            sem_posicao.append((rank, doc.page_content))
+        else:
+            por_fonte.setdefault(doc.metadata.get("source"), []).append((doc.metadata["posicao"], rank, doc.page_content))
+
+    trechos = list(sem_posicao)
+    for chunks in por_fonte.values():
+        chunks.sort()
+        grupo = [chunks[0]]
+        for anterior, atual in zip(chunks, chunks[1:]):
+            if atual[0] == anterior[0] + 1:
+                grupo.append(atual)
+            else:
+                trechos.append((min(r for _, r, _ in grupo), "\n".join(t for _, _, t in grupo)))
+                grupo = [atual]
+        trechos.append((min(r for _, r, _ in grupo), "\n".join(t for _, _, t in grupo)))
+    return [texto for _, texto in sorted(trechos, key=lambda t: t[0])]
+
+def empacotar_contexto(documentos: list[Document], tokens_documentos: list[int], orcamento: int,
+                       tokens_separador: int = 1) -> tuple[str, dict]:
+    """
+    Escolhe, em ordem de relevância, os documentos que cabem em 'orcamento' tokens
+    (um documento grande demais é pulado, mas os seguintes ainda podem entrar) e
+    retorna (contexto, relatório do orçamento usado).
+    """
+    selecionados = []
+    usados = 0
+    for rank, (doc, tokens) in enumerate(zip(documentos, tokens_documentos)):
+        custo = tokens + (tokens_separador if selecionados else 0)
+        if usados + custo > orcamento:
+            continue
+        selecionados.append((rank, doc))
+        usados += custo
+
+    trechos = mesclar_adjacentes(selecionados) if selecionados else []
+    relatorio = {
+        "orcamento": orcamento,
+        "usados": usados,
+        "chunks_incluidos": len(selecionados),
+        "chunks_descartados": len(documentos) - len(selecionados),
+        "trechos": len(trechos),
+    }
+    return SEPARADOR_TRECHOS.join(trechos), relatorio
@@ -0,0 +1,104 @@
+import os
+import json
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Callable
+
+# --- EXECUÇÃO EM LOTE ---
+# Roda um conjunto de perguntas por um contexto sem o chat interativo, com
+# várias perguntas em andamento ao mesmo tempo contra o gateway. Cada resposta
+# vira uma linha JSONL (gravada assim que fica pronta, para uma execução
+# interrompida não perder o que já foi feito) e, no fim, o resumo traz a vazão
+# e a distribuição de tempo de cada fase.
+CONCORRENCIA_LOTE_PADRAO = 4
+FASES_LOTE = ("embedding", "busca", "sumarizacao", "geracao", "total")
+
+def ler_perguntas(caminho: str) -> list[dict]:
+    """
+    Lê as perguntas de um arquivo .jsonl ({"pergunta": ..., "id": opcional} por linha)
+    ou de texto (uma pergunta por linha; linhas vazias e começadas por '#' são ignoradas).
+    """
+    perguntas = []
+    jsonl = caminho.lower().endswith(".jsonl")
+    with open(caminho, 'r', encoding='utf-8') as f:
+        for numero, linha in enumerate(f, start=1):
+            linha = linha.strip()
+            if not linha or (not jsonl and linha.startswith("#")):
+                continue
+            if jsonl:
+                try:
+                    dados = json.loads(linha)
+                except json.JSONDecodeError as e:
+                    raise ValueError(f"Linha {numero} de '{caminho}' não é um JSON válido: {e}")
+                if not dados.get("pergunta"):
+                    raise ValueError(f"Linha {numero} de '{caminho}' não tem o campo 'pergunta'.")
+                perguntas.append({"id": dados.get("id", numero), "pergunta": dados["pergunta"]})
+            else:
+                perguntas.append({"id": numero, "pergunta": linha})
+    return perguntas
+
+def percentil(valores: list[float], p: float) -> float:
+    ordenados = sorted(valores)
+    return ordenados[min(len(ordenados) - 1, int(round(p / 100 * (len(ordenados) - 1))))]
+
+def resumir_lote(registros: list[dict], duracao_s: float) -> dict:
+    """Vazão do lote e média/p50/p95 (ms) de cada fase, só com as perguntas que não falharam."""
+    validos = [r for r in registros if not r.get("erro")]
+    fases = {}
+    for fase in FASES_LOTE:
+        valores = [r["tempos_ms"][fase] for r in validos if fase in r.get("tempos_ms", {})]
+        if valores:
+            fases[fase] = {"media": sum(valores) / len(valores), "p50": percentil(valores, 50), "p95": percentil(valores, 95)}
+    return {
+        "perguntas": len(registros),
+        "erros": len(registros) - len(validos),
+        "do_cache": sum(1 for r in registros if r.get("cache") == "resposta"),
+        "duracao_s": duracao_s,
+        "perguntas_por_s": len(registros) / duracao_s if duracao_s > 0 else None,
+        "fases_ms": fases,
+    }
+
+def executar_lote(perguntas: list[dict], responder: Callable[[str], dict], caminho_saida: str,
+                  concorrencia: int = CONCORRENCIA_LOTE_PADRAO) -> dict:
+    """
+    Responde as perguntas com 'responder(pergunta) -> registro', até 'concorrencia'
+    ao mesmo tempo, e grava cada registro em 'caminho_saida' (JSONL). Retorna o resumo.
+    """
+    pasta = os.path.dirname(caminho_saida)
+    if pasta:
+        os.makedirs(pasta, exist_ok=True)
+    registros = []
+    lock_saida = threading.Lock()
+
+    def responder_item(item: dict) -> dict:
+        try:
+            registro = responder(item["pergunta"])
+        except Exception as e:
+            registro = {"pergunta": item["pergunta"], "resposta": None, "erro": True, "detalhe_erro": str(e)}
+        return {"id": item["id"], **registro}
+
+    inicio = time.perf_counter()
+    with open(caminho_saida, 'w', encoding='utf-8') as saida, \
+            ThreadPoolExecutor(max_workers=max(1, concorrencia), thread_name_prefix="lote") as executor:
+        futuros = [executor.submit(responder_item, item) for item in perguntas]
+        for concluidas, futuro in enumerate(as_completed(futuros), start=1):
+            registro = futuro.result()
+            with lock_saida:
+                saida.write(json.dumps(registro, ensure_ascii=False) + "\n")
+                saida.flush()
+            registros.append(registro)
+            estado = "❌" if registro.get("erro") else "✅"
+            total_ms = registro.get("tempos_ms", {}).get("total")
+            print(f"   {estado} [{concluidas}/{len(perguntas)}] {registro['id']}"
+                  + (f" ({total_ms / 1000:.2f}s)" if total_ms is not None else ""))
+    return resumir_lote(registros, time.perf_counter() - inicio)
+
+def formatar_resumo_lote(resumo: dict) -> str:
+    linhas = [f"{resumo['perguntas']} perguntas em {resumo['duracao_s']:.2f}s"
+              + (f" ({resumo['perguntas_por_s']:.2f} perguntas/s)" if resumo["perguntas_por_s"] else "")
+              + f" | {resumo['erros']} com erro | {resumo['do_cache']} do cache"]
+    for fase, estatisticas in resumo["fases_ms"].items():
+        linhas.append(f"   {fase:<12} média {estatisticas['media']:9.1f} ms | p50 {estatisticas['p50']:9.1f} ms"
+                      f" | p95 {estatisticas['p95']:9.1f} ms")
+    return "\n".join(linhas)
@@ -1,86 +1,637 @@
+from __future__ import annotations
+
 import os
 import json
 import shutil
+import hashlib
 import time
 import argparse
+import functools
+import multiprocessing
+from collections import deque
+from collections.abc import Iterator
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, TimeoutError as FuturesTimeoutError
+from typing import TYPE_CHECKING
 from dotenv import load_dotenv
-from langchain_community.document_loaders import PyPDFLoader, WebBaseLoader, TextLoader
-from langchain_community.vectorstores import FAISS
-from langchain_huggingface import HuggingFaceEmbeddings
-from langchain_core.documents import Document
 
-# Importa nosso chunker
-from chunker_customizado import chunkificar_texto_completo
+# LangChain, FAISS, torch e o nosso chunker (NLTK) são importados sob demanda,
+# dentro das funções que os usam: '--acao deletar' não paga esse custo.
+if TYPE_CHECKING:
+    from langchain_community.vectorstores import FAISS
+    from langchain_core.documents import Document
+
+INICIO_PROCESSO = time.perf_counter()
 
 # --- CONFIGURAÇÃO ---
 load_dotenv()
-print("-> Carregando modelo de embedding (isso pode levar um momento)...")
-embeddings = HuggingFaceEmbeddings(model_name="all-MiniLM-L6-v2")
-print("✅ Modelo de embedding carregado.")
+NOME_MODELO_EMBEDDING = "all-MiniLM-L6-v2"
+# Mesmo nome usado em armazenamento_indices, repetido aqui para não importar o FAISS.
+ARQUIVO_MANIFESTO = "manifesto.json"
+
+# O manifesto guarda, por contexto, as fontes indexadas e os hashes dos chunks
+# de cada uma. Cada chunk é armazenado no FAISS com o próprio hash como ID,
+# o que permite adicionar apenas o que é novo e remover o que sumiu.
+# Chunks quase idênticos (MinHash/LSH, ver deduplicacao_chunks) são descartados
+# antes do embedding; "duplicatas" mapeia o hash de cada um ao do chunk mantido.
+# Versão 2: os chunks guardam nos metadados a "posicao" dentro da fonte.
+# Versão 3: "source"/"posicao" são refeitos a cada atualização a partir das listas
+# do manifesto (antes, chunks reaproveitados ficavam com a posição antiga).
+VERSAO_MANIFESTO = 3
+
+# Carregamento concorrente das fontes: URLs em threads (limitadas pela rede),
+# PDFs em processos (parsing limitado pela CPU) e um tempo máximo por fonte.
+MAX_CONEXOES_URL = 8
+MAX_PROCESSOS_PDF = max(1, (os.cpu_count() or 2) // 2)
+TIMEOUT_FONTE_SEGUNDOS = 60
+
+# Estágio de embedding: lotes de tamanho fixo (múltiplo do lote interno de 32
+# do sentence-transformers) e, opcionalmente, vários processos, cada um com sua
+# cópia do modelo e uma fatia dos núcleos. Os vetores equivalem aos do caminho
+# serial, mas não são idênticos bit a bit: o sentence-transformers ordena e
+# preenche (padding) cada lote interno, e outro agrupamento muda o arredondamento
+# em ponto flutuante.
+TAMANHO_LOTE_EMBEDDING = 64
+PROCESSOS_EMBEDDING = 1
+
+# Quantidade de chunks que atravessa o pipeline (embedding + inserção no FAISS)
+# de cada vez. Limita a memória do build independentemente do tamanho do contexto.
+TAMANHO_LOTE_INDEXACAO = 512
+
+# Processos usados para chunkificar os documentos carregados (1 = sem paralelismo).
+PROCESSOS_CHUNKING = os.cpu_count() or 1
+
+# --- CARREGAMENTO SOB DEMANDA DO MODELO ---
+
+@functools.lru_cache(maxsize=None)
+def obter_embeddings():
+    """Carrega o modelo de embedding na primeira vez que ele é necessário."""
+    print("-> Carregando modelo de embedding (isso pode levar um momento)...")
+    inicio = time.perf_counter()
+    from langchain_huggingface import HuggingFaceEmbeddings
+    embeddings = HuggingFaceEmbeddings(model_name=NOME_MODELO_EMBEDDING)
+    print(f"✅ Modelo de embedding carregado. ({time.perf_counter() - inicio:.2f}s)")
+    return embeddings
+
+@functools.lru_cache(maxsize=None)
+def obter_embeddings_indexacao():
+    """Na indexação, os vetores passam pelo cache em disco compartilhado entre contextos."""
+    from cache_embeddings import EmbeddingsComCache
+    return EmbeddingsComCache(obter_embeddings(), NOME_MODELO_EMBEDDING)
 
 # --- FUNÇÕES DE CARREGAMENTO DE DADOS ---
 
+def carregar_fonte(fonte: str) -> list[Document] | None:
+    """
+    Carrega o conteúdo de uma única fonte (URL, PDF, TXT).
+    Retorna None se a fonte não puder ser carregada.
+    """
+    print(f"   -> Carregando fonte: {fonte}")
+    from langchain_community.document_loaders import PyPDFLoader, WebBaseLoader, TextLoader
+    try:
+        if fonte.startswith(('http://', 'https://')):
+            loader = WebBaseLoader(fonte, requests_kwargs={"timeout": TIMEOUT_FONTE_SEGUNDOS})
+        elif fonte.lower().endswith('.pdf'):
+            loader = PyPDFLoader(fonte)
+        elif fonte.lower().endswith('.txt'):
+            loader = TextLoader(fonte, encoding='utf-8')
+        else:
+            print(f"      ⚠️ Tipo de arquivo não suportado: {fonte}")
+            return None
+        return loader.load()
+    except Exception as e:
+        print(f"      ❌ Erro ao carregar a fonte {fonte}: {e}")
+        return None
+
+def _novo_pool_pdf() -> multiprocessing.pool.Pool:
+    # "spawn", como nos outros pools de processos: um fork herdaria as threads de download abertas.
+    # multiprocessing.Pool e não ProcessPoolExecutor: terminate() mata os workers, então um
+    # PDF travado não segura o build (nem a saída do programa). Um worker que morre no meio
+    # do parsing é trocado pelo Pool sem aviso; a tarefa dele cai no mesmo tempo esgotado.
+    return multiprocessing.get_context("spawn").Pool(MAX_PROCESSOS_PDF)
+
+def iterar_fontes(lista_fontes: list[str]) -> Iterator[tuple[str, list[Document] | None]]:
+    """
+    Carrega as fontes concorrentemente e entrega (fonte, documentos) na mesma
+    ordem da lista, assim que cada fonte (e as anteriores a ela) termina.
+    Fontes que falham ou excedem TIMEOUT_FONTE_SEGUNDOS são entregues com None.
+    Um PDF que estoura o tempo derruba o pool de processos: os outros PDFs
+    pendentes são reenviados a um pool novo.
+    """
+    janela = MAX_CONEXOES_URL + MAX_PROCESSOS_PDF
+    with ThreadPoolExecutor(max_workers=MAX_CONEXOES_URL) as pool_threads:
+        # Criado no primeiro PDF: uma lista só de URLs/TXT não sobe processos.
+        pool_processos = None
+        pendentes = deque()
+        fontes_restantes = iter(lista_fontes)
+
+        def e_pdf(fonte: str) -> bool:
+            return fonte.lower().endswith('.pdf')
+
+        def submeter_pdf(fonte: str):
+            nonlocal pool_processos
+            if pool_processos is None:
+                pool_processos = _novo_pool_pdf()
+            return pool_processos.apply_async(carregar_fonte, (fonte,))
+
+        def submeter_proxima() -> bool:
+            fonte = next(fontes_restantes, None)
+            if fonte is None:
+                return False
+            tarefa = submeter_pdf(fonte) if e_pdf(fonte) else pool_threads.submit(carregar_fonte, fonte)
+            pendentes.append((fonte, tarefa))
+            return True
+
+        try:
+            while len(pendentes) < janela and submeter_proxima():
+                pass
+            while pendentes:
+                fonte, tarefa = pendentes.popleft()
+                try:
+                    if e_pdf(fonte):
+                        documentos = tarefa.get(timeout=TIMEOUT_FONTE_SEGUNDOS)
+                    else:
+                        documentos = tarefa.result(timeout=TIMEOUT_FONTE_SEGUNDOS)
+                except (FuturesTimeoutError, multiprocessing.TimeoutError):
+                    print(f"      ❌ Tempo esgotado ({TIMEOUT_FONTE_SEGUNDOS}s) ao carregar a fonte {fonte}")
+                    documentos = None
+                    if not e_pdf(fonte):
+                        tarefa.cancel()
+                    else:
+                        # Não dá para cancelar uma tarefa do Pool: encerra o pool inteiro e
+                        # reenvia a um novo os PDFs que ainda não tinham terminado.
+                        inacabados = [i for i, (pendente, t) in enumerate(pendentes) if e_pdf(pendente) and not t.ready()]
+                        pool_processos.terminate()
+                        pool_processos = None
+                        for i in inacabados:
+                            pendentes[i] = (pendentes[i][0], submeter_pdf(pendentes[i][0]))
+                except Exception as e:
+                    print(f"      ❌ Erro ao carregar a fonte {fonte}: {e}")
+                    documentos = None
+                submeter_proxima()
+                yield fonte, documentos
+        finally:
+            if pool_processos is not None:
+                pool_processos.terminate()
+
 def carregar_fontes(lista_fontes: list[str]) -> list[Document]:
     """
     Carrega o conteúdo de diferentes tipos de fontes (URL, PDF, TXT).
     """
     documentos_totais = []
-    for fonte in lista_fontes:
-        print(f"   -> Carregando fonte: {fonte}")
-        try:
-            if fonte.startswith(('http://', 'https://')):
-                loader = WebBaseLoader(fonte)
-                documentos_totais.extend(loader.load())
-            elif fonte.lower().endswith('.pdf'):
-                loader = PyPDFLoader(fonte)
-                documentos_totais.extend(loader.load())
-            elif fonte.lower().endswith('.txt'):
-                loader = TextLoader(fonte, encoding='utf-8')
-                documentos_totais.extend(loader.load())
-            else:
-                print(f"      ⚠️ Tipo de arquivo não suportado: {fonte}")
-        except Exception as e:
-            print(f"      ❌ Erro ao carregar a fonte {fonte}: {e}")
+    for _, documentos in iterar_fontes(lista_fontes):
+        if documentos:
+            documentos_totais.extend(documentos)
     return documentos_totais
 
+# --- ESTÁGIO DE EMBEDDING ---
+
+def _inicializar_worker_embedding(threads_por_processo: int):
+    import torch
+    torch.set_num_threads(threads_por_processo)
+
+def _embedar_lote_worker(textos: list[str]) -> list[list[float]]:
+    return obter_embeddings().embed_documents(textos)
+
+class EstagioEmbedding:
+    """
+    Gera os vetores dos chunks em lotes, consultando antes o cache em disco.
+    Com processos > 1, os lotes que faltam no cache são divididos entre
+    processos. Acumula o progresso entre chamadas e mostra chunks/s (e a
+    estimativa de término quando o total é conhecido).
+    """
+
+    def __init__(self, tamanho_lote: int = TAMANHO_LOTE_EMBEDDING, processos: int = PROCESSOS_EMBEDDING,
+                 total_previsto: int | None = None, usar_cache: bool = True):
+        self.tamanho_lote = tamanho_lote
+        self.processos = processos
+        self.total_previsto = total_previsto
+        self.usar_cache = usar_cache
+        self.acertos_cache = 0
+        self.calculados = 0
+        self.tempo_modelo = 0.0
+        self._pool = None
+
+    def __enter__(self):
+        if self.processos > 1:
+            threads_por_processo = max(1, (os.cpu_count() or self.processos) // self.processos)
+            self._pool = ProcessPoolExecutor(
+                max_workers=self.processos,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=_inicializar_worker_embedding,
+                initargs=(threads_por_processo,),
+            )
+        return self
+
+    def __exit__(self, *exc):
+        if self._pool is not None:
+            self._pool.shutdown()
+            self._pool = None
+
+    def embedar(self, textos: list[str]) -> list[list[float]]:
+        from cache_embeddings import chave_embedding
+        cache = obter_embeddings_indexacao().cache if self.usar_cache else None
+        chaves = [chave_embedding(NOME_MODELO_EMBEDDING, texto) for texto in textos]
+        vetores = cache.obter_muitos(chaves) if cache is not None else [None] * len(textos)
+        faltantes = [i for i, vetor in enumerate(vetores) if vetor is None]
+        self.acertos_cache += len(textos) - len(faltantes)
+        if not faltantes:
+            return vetores
+
+        lotes = [faltantes[i:i + self.tamanho_lote] for i in range(0, len(faltantes), self.tamanho_lote)]
+        textos_lotes = [[textos[i] for i in lote] for lote in lotes]
+        inicio = time.time()
+        if self._pool is not None and len(lotes) > 1:
+            resultados = self._pool.map(_embedar_lote_worker, textos_lotes)
+        else:
+            resultados = map(obter_embeddings().embed_documents, textos_lotes)
+
+        for lote, vetores_lote in zip(lotes, resultados):
+            for i, vetor in zip(lote, vetores_lote):
+                vetores[i] = vetor
+            if cache is not None:
+                cache.guardar_muitos([chaves[i] for i in lote], vetores_lote)
+            self.calculados += len(lote)
+        self.tempo_modelo += time.time() - inicio
+        self.relatar()
+        return vetores
+
+    def relatar(self):
+        taxa = self.calculados / self.tempo_modelo if self.tempo_modelo > 0 else 0.0
+        mensagem = f"   -> Embeddings: {self.calculados} calculados, {self.acertos_cache} do cache ({taxa:.1f} chunks/s"
+        if self.total_previsto and taxa > 0:
+            restantes = max(0, self.total_previsto - self.calculados - self.acertos_cache)
+            mensagem += f", ETA {restantes / taxa:.0f}s"
+        print(mensagem + ")")
+
+def embedar_textos(textos: list[str], tamanho_lote: int = TAMANHO_LOTE_EMBEDDING,
+                   processos: int = PROCESSOS_EMBEDDING) -> list[list[float]]:
+    """Atalho para embedar uma lista fechada de textos com o EstagioEmbedding."""
+    with EstagioEmbedding(tamanho_lote, processos, total_previsto=len(textos)) as estagio:
+        return estagio.embedar(textos)
+
+# --- PIPELINE DE INDEXAÇÃO ---
+
+def iterar_chunks_novos(fontes_para_carregar: list[str], fontes_antigas: dict, assinaturas: dict,
+                        ids_existentes: set[str], fontes_processadas: dict,
+                        processos_chunking: int = PROCESSOS_CHUNKING,
+                        config_chunking: dict | None = None, deduplicador=None,
+                        duplicatas: dict | None = None) -> Iterator[tuple[str, Document]]:
+    """
+    Carrega as fontes, chunkifica documento a documento (em paralelo, mantendo
+    a ordem) e entrega (hash, Document) apenas para os chunks que ainda não
+    estão no índice. Conforme cada fonte termina, registra seus hashes em
+    'fontes_processadas' (usado no manifesto). Com um 'deduplicador', chunks
+    quase idênticos a um já mantido não são entregues e vão para 'duplicatas'.
+    """
+    from langchain_core.documents import Document
+    from chunker_customizado import chunkificar_documentos
+
+    if duplicatas is None:
+        duplicatas = {}
+
+    # Cada texto enviado ao chunker tem uma etiqueta (fonte, metadados) na mesma
+    # ordem; metadados None marca o fim de uma fonte.
+    etiquetas = deque()
+
+    def textos_das_fontes() -> Iterator[str]:
+        for fonte, documentos in iterar_fontes(fontes_para_carregar):
+            if documentos is None:
+                anterior = fontes_antigas.get(fonte)
+                if anterior:
+                    print(f"      ⚠️ Mantendo os chunks indexados anteriormente para: {fonte}")
+                    fontes_processadas[fonte] = anterior
+                continue
+            # Libera cada documento (ex: página de PDF) assim que ele é enviado ao chunker.
+            documentos.reverse()
+            while documentos:
+                doc = documentos.pop()
+                etiquetas.append((fonte, {**doc.metadata, "source": fonte}))
+                yield doc.page_content
+            etiquetas.append((fonte, None))
+            yield ""
+
+    ids_novos_vistos = set()
+    hashes_por_fonte = {}
+    for chunks, _ in chunkificar_documentos(textos_das_fontes(), processos_chunking, config_chunking):
+        fonte, metadados = etiquetas.popleft()
+        hashes_fonte = hashes_por_fonte.setdefault(fonte, [])
+        if metadados is None:
+            fontes_processadas[fonte] = {"assinatura": assinaturas[fonte], "chunks": hashes_por_fonte.pop(fonte)}
+            continue
+        for chunk in chunks:
+            hash_chunk = calcular_hash_chunk(chunk)
+            posicao = len(hashes_fonte)
+            hashes_fonte.append(hash_chunk)
+            if hash_chunk in ids_existentes or hash_chunk in ids_novos_vistos or hash_chunk in duplicatas:
+                continue
+            if deduplicador is not None:
+                assinatura = deduplicador.assinatura(chunk)
+                representante = deduplicador.encontrar_duplicata(assinatura)
+                if representante is not None:
+                    duplicatas[hash_chunk] = representante
+                    continue
+                deduplicador.adicionar(hash_chunk, assinatura)
+            ids_novos_vistos.add(hash_chunk)
+            yield hash_chunk, Document(page_content=chunk, metadata={**metadados, "posicao": posicao})
+
+def agrupar_em_lotes(iteravel, tamanho: int) -> Iterator[list]:
+    lote = []
+    for item in iteravel:
+        lote.append(item)
+        if len(lote) >= tamanho:
+            yield lote
+            lote = []
+    if lote:
+        yield lote
+
+# --- FUNÇÕES DO MANIFESTO ---
+
+def calcular_hash_chunk(texto: str) -> str:
+    """Hash de conteúdo usado como ID do chunk dentro do índice FAISS."""
+    return hashlib.sha256(texto.encode('utf-8')).hexdigest()
+
+def assinatura_fonte(fonte: str) -> str | None:
+    """
+    Assinatura do conteúdo de uma fonte local (hash do arquivo).
+    URLs não têm assinatura: precisam ser baixadas de novo a cada atualização,
+    mas só os chunks que mudaram serão reindexados.
+    """
+    if fonte.startswith(('http://', 'https://')) or not os.path.isfile(fonte):
+        return None
+    h = hashlib.sha256()
+    with open(fonte, 'rb') as f:
+        for bloco in iter(lambda: f.read(1 << 20), b''):
+            h.update(bloco)
+    return h.hexdigest()
+
+def manifesto_vazio(espec_indice: dict, config_chunking: dict, config_deduplicacao: dict | None) -> dict:
+    return {"versao": VERSAO_MANIFESTO, "modelo_embedding": NOME_MODELO_EMBEDDING, "chunking": config_chunking,
+            "deduplicacao": config_deduplicacao, "indice": espec_indice, "indice_efetivo": None,
+            "fontes": {}, "duplicatas": {}}
+
+def carregar_manifesto(pasta_contexto: str, espec_indice: dict, config_chunking: dict,
+                       config_deduplicacao: dict | None) -> dict | None:
+    """
+    Lê o manifesto de um contexto. Retorna None se ele não existir ou tiver sido gerado com
+    outra versão/modelo/tipo de índice/chunking/deduplicação (nesses casos o índice é refeito).
+    """
+    caminho = os.path.join(pasta_contexto, ARQUIVO_MANIFESTO)
+    try:
+        with open(caminho, 'r', encoding='utf-8') as f:
+            manifesto = json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
+    if manifesto.get("versao") != VERSAO_MANIFESTO or manifesto.get("modelo_embedding") != NOME_MODELO_EMBEDDING:
+        return None
+    from armazenamento_indices import normalizar_espec_indice
+    if normalizar_espec_indice(manifesto.get("indice")) != espec_indice:
+        print("   -> O tipo de índice definido em contexts.json mudou.")
+        return None
+    from chunker_customizado import normalizar_config_chunking
+    if normalizar_config_chunking(manifesto.get("chunking")) != config_chunking:
+        print("   -> A configuração de chunking definida em contexts.json mudou.")
+        return None
+    if manifesto.get("deduplicacao") != config_deduplicacao:
+        print("   -> A configuração de deduplicação definida em contexts.json mudou.")
+        return None
+    return manifesto
+
+def salvar_manifesto(pasta_contexto: str, manifesto: dict):
+    caminho = os.path.join(pasta_contexto, ARQUIVO_MANIFESTO)
+    caminho_tmp = caminho + ".tmp"
+    with open(caminho_tmp, 'w', encoding='utf-8') as f:
+        json.dump(manifesto, f, ensure_ascii=False, indent=2)
+    os.replace(caminho_tmp, caminho)
+
 # --- FUNÇÕES DE GERENCIAMENTO DE ÍNDICE ---
 
-def criar_ou_atualizar_contexto(contexto_id: str, definicoes_contexto: dict):
+def construir_db(pasta_contexto: str, espec_indice: dict, lotes: list[tuple]) -> tuple[FAISS, dict]:
+    """
+    Cria o índice FAISS do tipo pedido, treinando-o com os vetores dos lotes
+    acumulados, e insere esses lotes. Cada lote é (textos, vetores, metadados, ids).
+    """
+    import numpy as np
+    from armazenamento_indices import criar_indice_faiss, abrir_docstore_construcao, novo_db
+
+    vetores_treino = np.asarray([v for _, vetores, _, _ in lotes for v in vetores], dtype=np.float32)
+    index, espec_efetiva = criar_indice_faiss(espec_indice, vetores_treino)
+    db = novo_db(obter_embeddings_indexacao(), index, abrir_docstore_construcao(pasta_contexto, copiar_existente=False))
+    for textos, vetores, metadados, ids in lotes:
+        db.add_embeddings(zip(textos, vetores), metadatas=metadados, ids=ids)
+    return db, espec_efetiva
+
+def criar_ou_atualizar_contexto(contexto_id: str, definicoes_contexto: dict, reconstruir: bool = False,
+                                tamanho_lote: int = TAMANHO_LOTE_EMBEDDING, processos: int = PROCESSOS_EMBEDDING,
+                                processos_chunking: int = PROCESSOS_CHUNKING):
     """
     Cria ou atualiza o índice para um contexto específico.
+    Se já existir um índice com manifesto válido, a atualização é incremental:
+    só os chunks novos são embedados e os que sumiram são removidos do FAISS.
+    Com 'reconstruir=True' o índice é apagado e refeito do zero.
     """
+    from armazenamento_indices import (
+        TIPOS_SEM_REMOCAO, normalizar_espec_indice, tamanho_amostra_treino,
+        carregar_indice, salvar_indice, descartar_construcao,
+    )
+
     pasta_base_indices = "indices_rag"
     pasta_contexto = os.path.join(pasta_base_indices, contexto_id)
+    from chunker_customizado import normalizar_config_chunking
+    from deduplicacao_chunks import normalizar_config_deduplicacao
 
-    if os.path.exists(pasta_contexto):
-        print(f"-> Contexto '{contexto_id}' já existe. Removendo índice antigo para atualização.")
-        shutil.rmtree(pasta_contexto)
+    espec_indice = normalizar_espec_indice(definicoes_contexto.get("indice"))
+    config_chunking = normalizar_config_chunking(definicoes_contexto.get("chunking"))
+    config_deduplicacao = normalizar_config_deduplicacao(definicoes_contexto.get("deduplicacao"))
+
+    manifesto_antigo = None
+    db = None
+    if os.path.exists(pasta_contexto) and not reconstruir:
+        manifesto_antigo = carregar_manifesto(pasta_contexto, espec_indice, config_chunking, config_deduplicacao)
+        if manifesto_antigo is not None:
+            try:
+                db = carregar_indice(pasta_contexto, obter_embeddings_indexacao(), para_escrita=True)
+            except Exception as e:
+                print(f"   ⚠️ Não foi possível abrir o índice existente ({e}).")
+                manifesto_antigo = None
 
-    print(f"-> Criando novo índice para o contexto: '{contexto_id}'")
-    
-    # 1. Carregar todas as fontes
-    documentos_carregados = carregar_fontes(definicoes_contexto["fontes"])
-    if not documentos_carregados:
+    if db is None:
+        if os.path.exists(pasta_contexto):
+            print(f"-> Contexto '{contexto_id}' já existe. Removendo índice antigo para reconstrução completa.")
+            shutil.rmtree(pasta_contexto)
+        print(f"-> Criando novo índice '{espec_indice['tipo']}' para o contexto: '{contexto_id}'")
+        manifesto_antigo = manifesto_vazio(espec_indice, config_chunking, config_deduplicacao)
+    else:
+        print(f"-> Atualizando incrementalmente o índice do contexto: '{contexto_id}'")
+
+    start_time = time.time()
+    fontes_antigas = manifesto_antigo["fontes"]
+    ids_existentes = set(db.index_to_docstore_id.values()) if db is not None else set()
+    # Duplicatas antigas só valem enquanto o chunk que as substitui continua no índice.
+    duplicatas = {h: rep for h, rep in manifesto_antigo.get("duplicatas", {}).items() if rep in ids_existentes}
+    deduplicador = None
+    if config_deduplicacao is not None:
+        from deduplicacao_chunks import DeduplicadorMinHash
+        deduplicador = DeduplicadorMinHash.da_config(config_deduplicacao)
+        if ids_existentes and not deduplicador.carregar(pasta_contexto, ids_existentes):
+            print("   ⚠️ Assinaturas MinHash do índice não encontradas; só os chunks novos serão comparados entre si.")
+    fontes_processadas = {}
+    assinaturas = {}
+    fontes_para_carregar = []
+    fontes_reaproveitadas = 0
+
+    # 1. Separar as fontes inalteradas das que precisam ser carregadas
+    for fonte in definicoes_contexto["fontes"]:
+        anterior = fontes_antigas.get(fonte)
+        assinaturas[fonte] = assinatura_fonte(fonte)
+        if (anterior and assinaturas[fonte] is not None and anterior["assinatura"] == assinaturas[fonte]
+                and all(duplicatas.get(h, h) in ids_existentes for h in anterior["chunks"])):
+            print(f"   -> Fonte inalterada, reaproveitando {len(anterior['chunks'])} chunks: {fonte}")
+            fontes_processadas[fonte] = anterior
+            fontes_reaproveitadas += 1
+        else:
+            fontes_para_carregar.append(fonte)
+
+    # 2. Pipeline em fluxo: carregar -> chunkificar -> embedar -> adicionar ao índice,
+    #    em lotes, sem nunca manter todos os chunks do contexto em memória.
+    #    Índices que precisam de treino (IVF, PQ, SQ) acumulam só a amostra de treino.
+    total_novos = 0
+    total_duplicatas_antes = len(duplicatas)
+    espec_efetiva = manifesto_antigo.get("indice_efetivo") or (espec_indice if db is not None else None)
+    lotes_aguardando_treino = []
+    amostra_treino = tamanho_amostra_treino(espec_indice)
+    chunks_novos = iterar_chunks_novos(fontes_para_carregar, fontes_antigas, assinaturas, ids_existentes,
+                                       fontes_processadas, processos_chunking, config_chunking,
+                                       deduplicador, duplicatas)
+    with EstagioEmbedding(tamanho_lote, processos) as estagio:
+        for lote in agrupar_em_lotes(chunks_novos, TAMANHO_LOTE_INDEXACAO):
+            ids_lote = [hash_chunk for hash_chunk, _ in lote]
+            textos_lote = [doc.page_content for _, doc in lote]
+            metadados_lote = [doc.metadata for _, doc in lote]
+            vetores_lote = estagio.embedar(textos_lote)
+            total_novos += len(lote)
+            if db is None:
+                lotes_aguardando_treino.append((textos_lote, vetores_lote, metadados_lote, ids_lote))
+                if sum(len(l[0]) for l in lotes_aguardando_treino) >= amostra_treino:
+                    db, espec_efetiva = construir_db(pasta_contexto, espec_indice, lotes_aguardando_treino)
+                    lotes_aguardando_treino = []
+            else:
+                db.add_embeddings(zip(textos_lote, vetores_lote), metadatas=metadados_lote, ids=ids_lote)
+    if lotes_aguardando_treino:
+        db, espec_efetiva = construir_db(pasta_contexto, espec_indice, lotes_aguardando_treino)
+
+    manifesto_novo = manifesto_vazio(espec_indice, config_chunking, config_deduplicacao)
+    manifesto_novo["indice_efetivo"] = espec_efetiva
+    manifesto_novo["fontes"] = {
+        fonte: fontes_processadas[fonte] for fonte in definicoes_contexto["fontes"] if fonte in fontes_processadas
+    }
+    hashes_fontes = {h for info in manifesto_novo["fontes"].values() for h in info["chunks"]}
+    manifesto_novo["duplicatas"] = {h: rep for h, rep in duplicatas.items() if h in hashes_fontes}
+
+    # Um chunk mantido no lugar de duplicatas continua necessário enquanto alguma
+    # delas existir, mesmo que a fonte original dele tenha sumido.
+    ids_necessarios = {duplicatas.get(h, h) for h in hashes_fontes}
+    if not ids_necessarios:
         print(f"❌ Nenhuma fonte válida encontrada ou carregada para '{contexto_id}'. Abortando.")
+        descartar_construcao(db)
         return
 
-    texto_completo = "\n\n".join([doc.page_content for doc in documentos_carregados])
+    # 3. Remover do índice os chunks que nenhuma fonte produz mais
+    ids_remover = sorted(ids_existentes - ids_necessarios)
+    print(f"   -> Chunks: {total_novos} novos, {len(ids_remover)} removidos, "
+          f"{len(ids_existentes) - len(ids_remover)} reaproveitados ({fontes_reaproveitadas} fontes inalteradas).")
+    if deduplicador is not None:
+        print(f"   -> Deduplicação: {len(duplicatas) - total_duplicatas_antes} chunks quase duplicados descartados nesta execução "
+              f"({len(manifesto_novo['duplicatas'])} no contexto, limiar {config_deduplicacao['limiar']}).")
 
-    # 2. Usar nosso chunker customizado
-    print("   -> Dividindo o texto com o chunker customizado...")
-    chunks_de_texto = chunkificar_texto_completo(texto_completo)
-    docs_para_indexar = [Document(page_content=chunk) for chunk in chunks_de_texto]
-    print(f"   -> Texto dividido em {len(docs_para_indexar)} chunks.")
+    # As listas de chunks (e a ordem das fontes) também contam: reordenar trechos
+    # de uma fonte não cria nem remove chunks, mas muda as posições deles.
+    if (not total_novos and not ids_remover and list(fontes_antigas.items()) == list(manifesto_novo["fontes"].items())
+            and manifesto_antigo.get("duplicatas", {}) == manifesto_novo["duplicatas"]):
+        print(f"✅ Nenhuma alteração no contexto '{contexto_id}'. Índice mantido como está.")
+        descartar_construcao(db)
+        from indice_lexical import ARQUIVO_INDICE_LEXICAL
+        if not os.path.exists(os.path.join(pasta_contexto, ARQUIVO_INDICE_LEXICAL)):
+            atualizar_indice_lexical(pasta_contexto)
+        return
 
-    # 3. Criar e salvar o índice FAISS
-    print("   -> Criando embeddings e salvando o índice...")
-    start_time = time.time()
-    db = FAISS.from_documents(docs_para_indexar, embeddings)
-    os.makedirs(pasta_contexto, exist_ok=True)
-    db.save_local(pasta_contexto)
+    if ids_remover:
+        if espec_efetiva["tipo"] in TIPOS_SEM_REMOCAO:
+            print(f"   -> O índice '{espec_efetiva['tipo']}' não suporta remoção de vetores. Reconstruindo o contexto...")
+            descartar_construcao(db)
+            return criar_ou_atualizar_contexto(contexto_id, definicoes_contexto, reconstruir=True,
+                                               tamanho_lote=tamanho_lote, processos=processos,
+                                               processos_chunking=processos_chunking)
+        db.delete(ids_remover)
+
+    atualizar_metadados_dos_chunks(db, manifesto_antigo, manifesto_novo)
+    salvar_indice(db, pasta_contexto)
+    atualizar_indice_lexical(pasta_contexto)
+    if deduplicador is not None:
+        deduplicador.salvar(pasta_contexto, set(db.index_to_docstore_id.values()))
+    salvar_manifesto(pasta_contexto, manifesto_novo)
     end_time = time.time()
-    
-    print(f"✅ Índice para '{contexto_id}' criado com sucesso em '{pasta_contexto}'. (Levou {end_time - start_time:.2f} segundos)")
+
+    print(f"✅ Índice para '{contexto_id}' salvo com sucesso em '{pasta_contexto}'. (Levou {end_time - start_time:.2f} segundos)")
+
+def atualizar_indice_lexical(pasta_contexto: str):
+    """Refaz o índice BM25 do contexto a partir do docstore recém-salvo."""
+    from armazenamento_indices import DocstoreSQLite, ARQUIVO_CHUNKS
+    from indice_lexical import construir_indice_lexical
+
+    inicio = time.time()
+    docstore = DocstoreSQLite(os.path.join(pasta_contexto, ARQUIVO_CHUNKS), somente_leitura=True)
+    try:
+        termos = construir_indice_lexical(pasta_contexto, docstore.iterar_textos())
+    finally:
+        docstore.fechar()
+    print(f"   -> Índice lexical (BM25) gerado: {termos} termos ({time.time() - inicio:.2f}s).")
+
+def localizacao_dos_chunks(fontes: dict, duplicatas: dict) -> dict[str, tuple[str, int]]:
+    """
+    (fonte, posição) de cada chunk mantido, tirados das listas ordenadas do manifesto:
+    a primeira fonte do contexto que o produz e a posição dele nela. Uma duplicata
+    descartada conta como ocorrência do chunk que a substitui.
+    """
+    localizacao = {}
+    for fonte, info in fontes.items():
+        for posicao, hash_chunk in enumerate(info["chunks"]):
+            localizacao.setdefault(duplicatas.get(hash_chunk, hash_chunk), (fonte, posicao))
+    return localizacao
+
+def atualizar_metadados_dos_chunks(db: FAISS, manifesto_antigo: dict, manifesto_novo: dict):
+    """
+    Mantém "source"/"posicao" de cada chunk iguais aos do manifesto novo (o empacotador
+    une chunks vizinhos por eles) e, em "fontes", todas as fontes que o produzem,
+    inclusive as das duplicatas descartadas. Só os chunks cuja localização ou lista
+    de fontes mudou entre os manifestos são relidos e, se preciso, regravados.
+    """
+    from deduplicacao_chunks import fontes_por_chunk
+    from armazenamento_indices import atualizar_metadados_chunks
+
+    duplicatas_antigas = manifesto_antigo.get("duplicatas", {})
+    fontes_antigas = fontes_por_chunk(manifesto_antigo["fontes"], duplicatas_antigas)
+    fontes_novas = fontes_por_chunk(manifesto_novo["fontes"], manifesto_novo["duplicatas"])
+    locais_antigos = localizacao_dos_chunks(manifesto_antigo["fontes"], duplicatas_antigas)
+    locais_novos = localizacao_dos_chunks(manifesto_novo["fontes"], manifesto_novo["duplicatas"])
+    ids_no_indice = set(db.index_to_docstore_id.values())
+    metadados_por_id = {}
+    for hash_chunk in (fontes_antigas.keys() | fontes_novas.keys() | locais_antigos.keys() | locais_novos.keys()) & ids_no_indice:
+        if (fontes_antigas.get(hash_chunk) == fontes_novas.get(hash_chunk)
+                and locais_antigos.get(hash_chunk) == locais_novos.get(hash_chunk)):
+            continue
+        atuais = db.docstore.search(hash_chunk).metadata
+        metadados = dict(atuais)
+        fontes = fontes_novas.get(hash_chunk)
+        if fontes:
+            metadados["fontes"] = fontes
+        else:
+            metadados.pop("fontes", None)
+        if hash_chunk in locais_novos:
+            metadados["source"], metadados["posicao"] = locais_novos[hash_chunk]
+        if metadados != atuais:
+            metadados_por_id[hash_chunk] = metadados
+    if metadados_por_id:
+        atualizar_metadados_chunks(db, metadados_por_id)
 
 def deletar_contexto(contexto_id: str):
     """
@@ -103,6 +654,10 @@ if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Gerenciador de Índices RAG por Contexto.")
     parser.add_argument("--acao", type=str, required=True, choices=['criar', 'deletar'], help="A ação a ser executada. criar ou deletar.")
     parser.add_argument("--contexto", type=str, required=True, help="O ID do contexto (ex: 'futebol') definido em contexts.json.")
+    parser.add_argument("--reconstruir", action="store_true", help="Ignora o manifesto e refaz o índice do zero em vez de atualizar incrementalmente.")
+    parser.add_argument("--lote-embedding", type=int, default=TAMANHO_LOTE_EMBEDDING, help="Quantidade de chunks por lote enviado ao modelo de embedding.")
+    parser.add_argument("--processos-embedding", type=int, default=PROCESSOS_EMBEDDING, help="Número de processos que dividem os lotes de embedding (1 = sem paralelismo).")
+    parser.add_argument("--processos-chunking", type=int, default=PROCESSOS_CHUNKING, help="Número de processos usados para chunkificar os documentos (1 = sem paralelismo).")
 
     args = parser.parse_args()
 
@@ -117,7 +672,11 @@ if __name__ == "__main__":
         print(f"ERRO: Contexto '{args.contexto}' não definido em contexts.json.")
         exit()
 
+    print(f"-> Inicialização concluída em {time.perf_counter() - INICIO_PROCESSO:.2f}s.")
     if args.acao == 'criar':
-        criar_ou_atualizar_contexto(args.contexto, todos_contextos[args.contexto])
+        criar_ou_atualizar_contexto(args.contexto, todos_contextos[args.contexto], reconstruir=args.reconstruir,
+                                    tamanho_lote=args.lote_embedding, processos=args.processos_embedding,
+                                    processos_chunking=args.processos_chunking)
     elif args.acao == 'deletar':
-        deletar_contexto(args.contexto)
\ No newline at end of file
+        deletar_contexto(args.contexto)
+    print(f"-> Tempo total: {time.perf_counter() - INICIO_PROCESSO:.2f}s.")
\ No newline at end of file
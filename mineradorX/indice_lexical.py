@@ -0,0 +1,109 @@
+import os
+import re
+import json
+import math
+from collections import Counter
+
+import numpy as np
+
+# --- ÍNDICE LEXICAL (BM25) ---
+# O all-MiniLM não distingue bem termos técnicos exatos (nomes de arquivo,
+# flags, $VARIAVEIS), justamente os que o chunker formata com crases. Cada
+# contexto ganha, ao lado do 'index.faiss', um índice invertido BM25 em JSON,
+# reconstruído a partir do docstore sempre que o índice vetorial é salvo.
+ARQUIVO_INDICE_LEXICAL = "lexico_bm25.json"
+VERSAO_INDICE_LEXICAL = 1
+K1_BM25 = 1.5
+B_BM25 = 0.75
+
+_TERMOS = re.compile(r"[\w$./=\-]+")
+_PARTES = re.compile(r"\w+")
+_PONTUACAO_BORDA = "./=-"
+
+def tokenizar(texto: str) -> list[str]:
+    """
+    Termos em minúsculas, preservando caminhos, atribuições e variáveis
+    ('/etc/app.conf', 'FOO=1', '$HOME') como um termo só, além das suas partes.
+    """
+    termos = []
+    for match in _TERMOS.finditer(texto.lower()):
+        termo = match.group().strip(_PONTUACAO_BORDA)
+        if not termo:
+            continue
+        partes = _PARTES.findall(termo)
+        if len(partes) != 1 or partes[0] != termo:
+            termos.append(termo)
+        termos.extend(partes)
+    return termos
+
+
+def construir_indice_lexical(pasta_contexto: str, chunks) -> int:
+    """
+    Gera o arquivo BM25 do contexto a partir de (id, texto) de cada chunk.
+    Retorna a quantidade de termos indexados.
+    """
+    ids = []
+    comprimentos = []
+    postings = {}
+    for posicao, (id_chunk, texto) in enumerate(chunks):
+        termos = Counter(tokenizar(texto))
+        ids.append(id_chunk)
+        comprimentos.append(sum(termos.values()))
+        for termo, frequencia in termos.items():
+            documentos, frequencias = postings.setdefault(termo, ([], []))
+            documentos.append(posicao)
+            frequencias.append(frequencia)
+
+    caminho = os.path.join(pasta_contexto, ARQUIVO_INDICE_LEXICAL)
+    with open(caminho + ".tmp", 'w', encoding='utf-8') as f:
+        json.dump({"versao": VERSAO_INDICE_LEXICAL, "k1": K1_BM25, "b": B_BM25, "ids": ids,
+                   "comprimentos": comprimentos, "termos": postings}, f, ensure_ascii=False, separators=(',', ':'))
+    os.replace(caminho + ".tmp", caminho)
+    return len(postings)
+
+
+class IndiceLexical:
+    """Índice BM25 carregado em memória, com os pesos de cada termo já calculados por documento."""
+
+    def __init__(self, dados: dict):
+        self.ids = dados["ids"]
+        comprimentos = np.asarray(dados["comprimentos"], dtype=np.float32)
+        total = len(self.ids)
+        media = float(comprimentos.mean()) if total else 1.0
+        k1, b = dados["k1"], dados["b"]
+        normalizacao = k1 * (1 - b + b * comprimentos / max(media, 1e-9))
+        self._postings = {}
+        for termo, (documentos, frequencias) in dados["termos"].items():
+            documentos = np.asarray(documentos, dtype=np.int32)
+            frequencias = np.asarray(frequencias, dtype=np.float32)
+            idf = math.log(1 + (total - len(documentos) + 0.5) / (len(documentos) + 0.5))
+            pesos = idf * frequencias * (k1 + 1) / (frequencias + normalizacao[documentos])
+            self._postings[termo] = (documentos, pesos.astype(np.float32))
+
+    def buscar(self, consulta: str, k: int) -> list[tuple[str, float]]:
+        """(id do chunk, pontuação BM25) dos k melhores documentos para a consulta."""
+        termos = Counter(t for t in tokenizar(consulta) if t in self._postings)
+        if not termos:
+            return []
+        pontuacoes = np.zeros(len(self.ids), dtype=np.float32)
+        for termo, repeticoes in termos.items():
+            documentos, pesos = self._postings[termo]
+            pontuacoes[documentos] += repeticoes * pesos
+        k = min(k, int(np.count_nonzero(pontuacoes)))
+        if k == 0:
+            return []
+        melhores = np.argpartition(-pontuacoes, k - 1)[:k]
+        melhores = melhores[np.argsort(-pontuacoes[melhores])]
+        return [(self.ids[i], float(pontuacoes[i])) for i in melhores]
+
+
+def carregar_indice_lexical(pasta_contexto: str) -> IndiceLexical | None:
+    """Carrega o BM25 do contexto, ou None se ele ainda não foi gerado."""
+    try:
+        with open(os.path.join(pasta_contexto, ARQUIVO_INDICE_LEXICAL), 'r', encoding='utf-8') as f:
+            dados = json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
+    if dados.get("versao") != VERSAO_INDICE_LEXICAL:
+        return None
+    return IndiceLexical(dados)
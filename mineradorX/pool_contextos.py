@@ -0,0 +1,88 @@
+from __future__ import annotations
+
+import os
+import weakref
+import threading
+from collections import OrderedDict
+from typing import TYPE_CHECKING, Callable
+
+from indice_lexical import ARQUIVO_INDICE_LEXICAL
+
+if TYPE_CHECKING:
+    from langchain_community.vectorstores import FAISS
+    from indice_lexical import IndiceLexical
+
+# --- POOL DE CONTEXTOS RESIDENTES ---
+# Mantém em memória os contextos já abertos na sessão, para que trocar de
+# especialista (ou perguntar a vários de uma vez) não recarregue nada. Quando
+# o total estimado passa do orçamento, o contexto usado há mais tempo sai do
+# pool. O texto dos chunks fica no SQLite (mmap), então a estimativa conta só
+# o que é lido para a RAM: o 'index.faiss' e o índice BM25.
+ORCAMENTO_POOL_PADRAO_MB = 1024
+ARQUIVOS_RESIDENTES = ("index.faiss", "index.pkl", ARQUIVO_INDICE_LEXICAL)
+
+
+class ContextoCarregado:
+    def __init__(self, id_contexto: str, db: FAISS, indice_lexical: IndiceLexical | None, tamanho_bytes: int):
+        self.id = id_contexto
+        self.db = db
+        self.indice_lexical = indice_lexical
+        self.tamanho_bytes = tamanho_bytes
+
+
+def estimar_tamanho_contexto(pasta_contexto: str) -> int:
+    return sum(os.path.getsize(os.path.join(pasta_contexto, nome))
+               for nome in ARQUIVOS_RESIDENTES if os.path.exists(os.path.join(pasta_contexto, nome)))
+
+
+class PoolContextos:
+    """
+    Contextos carregados, em ordem de uso (LRU), limitados por um orçamento de memória.
+    'carregador(id)' deve retornar (db, indice_lexical) de um contexto.
+    """
+
+    def __init__(self, carregador: Callable, pasta_base: str, orcamento_mb: float | None = None):
+        if orcamento_mb is None:
+            orcamento_mb = float(os.getenv("ORCAMENTO_POOL_CONTEXTOS_MB", ORCAMENTO_POOL_PADRAO_MB))
+        self.orcamento_bytes = int(orcamento_mb * 1024 * 1024)
+        self.carregador = carregador
+        self.pasta_base = pasta_base
+        self._contextos = OrderedDict()
+        self._lock = threading.Lock()
+
+    def obter(self, id_contexto: str) -> ContextoCarregado:
+        """Retorna o contexto do pool, carregando-o (e liberando espaço) se necessário."""
+        with self._lock:
+            if id_contexto in self._contextos:
+                self._contextos.move_to_end(id_contexto)
+                return self._contextos[id_contexto]
+            db, indice_lexical = self.carregador(id_contexto)
+            contexto = ContextoCarregado(id_contexto, db, indice_lexical,
+                                         estimar_tamanho_contexto(os.path.join(self.pasta_base, id_contexto)))
+            self._contextos[id_contexto] = contexto
+            self._liberar_espaco(manter=id_contexto)
+            return contexto
+
+    def obter_varios(self, ids_contextos: list[str]) -> list[ContextoCarregado]:
+        return [self.obter(id_contexto) for id_contexto in ids_contextos]
+
+    def _liberar_espaco(self, manter: str):
+        # Quem ainda usa um contexto removido continua com a referência; ele só
+        # sai da memória quando a última busca em andamento terminar. Por isso o
+        # SQLite do docstore não é fechado aqui, e sim quando o índice é coletado.
+        while self.tamanho_total() > self.orcamento_bytes and len(self._contextos) > 1:
+            id_antigo = next(iter(self._contextos))
+            if id_antigo == manter:
+                break
+            removido = self._contextos.pop(id_antigo)
+            fechar = getattr(removido.db.docstore, "fechar", None)
+            if fechar is not None:
+                weakref.finalize(removido.db, fechar)
+            print(f"   -> Contexto '{id_antigo}' removido da memória ({removido.tamanho_bytes / 1024 / 1024:.1f} MB).")
+
+    def tamanho_total(self) -> int:
+        return sum(contexto.tamanho_bytes for contexto in self._contextos.values())
+
+    def residentes(self) -> list[ContextoCarregado]:
+        with self._lock:
+            return list(self._contextos.values())
@@ -0,0 +1,246 @@
+from __future__ import annotations
+
+import os
+import time
+import weakref
+import functools
+from concurrent.futures import ThreadPoolExecutor
+from typing import TYPE_CHECKING
+
+import faiss
+import numpy as np
+
+if TYPE_CHECKING:
+    from langchain_community.vectorstores import FAISS
+    from langchain_core.documents import Document
+    from indice_lexical import IndiceLexical
+
+# --- RECUPERAÇÃO EM DUAS ETAPAS ---
+# 1. Busca larga no FAISS: K_CANDIDATOS vizinhos mais próximos da pergunta.
+#    Se o contexto tiver índice BM25, a busca lexical roda ao mesmo tempo e as
+#    duas listas são fundidas por Reciprocal Rank Fusion (1 / (K_RRF + posição)).
+# 2. Reranqueamento dos candidatos, ficando só com K_FINAL chunks:
+#    - "mmr": Maximal Marginal Relevance sobre os próprios vetores do índice,
+#      equilibrando relevância e diversidade (descarta quase-repetições);
+#    - "cross_encoder": um CrossEncoder em CPU pontua cada par (pergunta, chunk);
+#    - "nenhum": apenas os K_FINAL primeiros da busca.
+# O modo pode ser trocado pela variável de ambiente RERANQUEAMENTO.
+# K_FINAL é um teto: o empacotador de contexto ainda corta pelo orçamento de tokens.
+K_CANDIDATOS = 50
+K_FINAL = 12
+LAMBDA_MMR = 0.5
+MODO_RERANQUEAMENTO = os.getenv("RERANQUEAMENTO", "mmr")
+MODOS_RERANQUEAMENTO = ("mmr", "cross_encoder", "nenhum")
+# Multilíngue, treinado no mMARCO (inclui português).
+MODELO_CROSS_ENCODER = "cross-encoder/mmarco-mMiniLMv2-L12-H384-v1"
+K_RRF = 60
+# Contextos buscados ao mesmo tempo quando a pergunta vai para vários deles.
+MAX_CONTEXTOS_PARALELOS = 4
+BUSCA_HIBRIDA = os.getenv("BUSCA_HIBRIDA", "1") != "0"
+
+# Posição no FAISS de cada ID, calculada uma vez por índice carregado.
+_POSICOES_POR_ID = weakref.WeakKeyDictionary()
+
+
+@functools.lru_cache(maxsize=None)
+def obter_cross_encoder():
+    from sentence_transformers import CrossEncoder
+    return CrossEncoder(MODELO_CROSS_ENCODER, device="cpu")
+
+@functools.lru_cache(maxsize=None)
+def _executor_buscas() -> ThreadPoolExecutor:
+    return ThreadPoolExecutor(max_workers=2, thread_name_prefix="busca")
+
+@functools.lru_cache(maxsize=None)
+def _executor_contextos() -> ThreadPoolExecutor:
+    # Separado do de cima: as buscas por contexto submetem tarefas a ele e esperam por elas.
+    return ThreadPoolExecutor(max_workers=MAX_CONTEXTOS_PARALELOS, thread_name_prefix="contexto")
+
+def posicoes_por_id(db: FAISS) -> dict[str, int]:
+    if db not in _POSICOES_POR_ID:
+        _POSICOES_POR_ID[db] = {id_: posicao for posicao, id_ in db.index_to_docstore_id.items()}
+    return _POSICOES_POR_ID[db]
+
+def fundir_rrf(listas: list[list[str]], k_rrf: int = K_RRF) -> list[tuple[str, float]]:
+    """Reciprocal Rank Fusion: soma 1 / (k_rrf + posição) de cada ID nas listas ordenadas."""
+    pontuacoes = {}
+    for lista in listas:
+        for rank, id_ in enumerate(lista, start=1):
+            pontuacoes[id_] = pontuacoes.get(id_, 0.0) + 1.0 / (k_rrf + rank)
+    return sorted(pontuacoes.items(), key=lambda item: item[1], reverse=True)
+
+def selecionar_mmr(relevancias: np.ndarray, vetores: np.ndarray, k: int, lambda_mult: float) -> list[int]:
+    """
+    Maximal Marginal Relevance: escolhe, um a um, o candidato com a melhor
+    combinação de relevância e distância aos já escolhidos (similaridade de cosseno).
+    """
+    normalizados = vetores / np.clip(np.linalg.norm(vetores, axis=1, keepdims=True), 1e-12, None)
+    similaridades = normalizados @ normalizados.T
+    escolhidos = [int(np.argmax(relevancias))]
+    while len(escolhidos) < min(k, len(relevancias)):
+        redundancia = similaridades[:, escolhidos].max(axis=1)
+        pontuacao = lambda_mult * relevancias - (1 - lambda_mult) * redundancia
+        pontuacao[escolhidos] = -np.inf
+        escolhidos.append(int(np.argmax(pontuacao)))
+    return escolhidos
+
+def relevancias_cosseno(vetor_pergunta: np.ndarray, vetores: np.ndarray) -> np.ndarray:
+    normas = np.linalg.norm(vetores, axis=1) * max(float(np.linalg.norm(vetor_pergunta)), 1e-12)
+    return (vetores @ vetor_pergunta) / np.clip(normas, 1e-12, None)
+
+def vetores_das_posicoes(db: FAISS, posicoes: list[int]) -> np.ndarray | None:
+    """
+    Reconstrói do índice os vetores dos candidatos. Índices IVF já vêm com o
+    mapa direto (armazenamento_indices.preparar_reconstrucao); se o tipo de
+    índice não permitir reconstrução, retorna None.
+    """
+    try:
+        return np.vstack([db.index.reconstruct(p) for p in posicoes])
+    except RuntimeError:
+        return None
+
+def buscar_candidatos(db: FAISS, vetor_pergunta: np.ndarray, k: int) -> list[tuple[int, float]]:
+    """Etapa 1: (posição no índice, distância) dos k vizinhos mais próximos."""
+    consulta = vetor_pergunta.reshape(1, -1).copy()
+    if getattr(db, "_normalize_L2", False):
+        faiss.normalize_L2(consulta)
+    distancias, posicoes = db.index.search(consulta, k)
+    return [(int(p), float(d)) for p, d in zip(posicoes[0], distancias[0]) if p != -1]
+
+def recuperar_documentos(db: FAISS, pergunta: str, indice_lexical: IndiceLexical | None = None,
+                         k_candidatos: int = K_CANDIDATOS, k_final: int = K_FINAL,
+                         modo: str = MODO_RERANQUEAMENTO, lambda_mmr: float = LAMBDA_MMR,
+                         vetor_pergunta: np.ndarray | None = None) -> tuple[list[Document], dict]:
+    """
+    Recupera os chunks para uma pergunta em duas etapas e retorna
+    (documentos, tempos em ms de cada etapa). 'vetor_pergunta' evita
+    embedar de novo uma pergunta já embedada (busca em vários contextos).
+    """
+    if modo not in MODOS_RERANQUEAMENTO:
+        raise ValueError(f"Modo de reranqueamento '{modo}' inválido. Use um de: {', '.join(MODOS_RERANQUEAMENTO)}.")
+    tempos = {}
+
+    def busca_vetorial():
+        vetor = vetor_pergunta
+        if vetor is None:
+            inicio = time.perf_counter()
+            vetor = np.asarray(db.embeddings.embed_query(pergunta), dtype=np.float32)
+            tempos["embedding_ms"] = (time.perf_counter() - inicio) * 1000
+        inicio = time.perf_counter()
+        candidatos = buscar_candidatos(db, vetor, k_candidatos)
+        tempos["busca_ms"] = (time.perf_counter() - inicio) * 1000
+        return vetor, candidatos
+
+    # Etapa 1: busca vetorial e, se houver, lexical em paralelo.
+    hibrida = indice_lexical is not None and BUSCA_HIBRIDA
+    if hibrida:
+        futuro_vetorial = _executor_buscas().submit(busca_vetorial)
+        inicio = time.perf_counter()
+        ids_lexicais = [id_ for id_, _ in indice_lexical.buscar(pergunta, k_candidatos)]
+        tempos["busca_lexical_ms"] = (time.perf_counter() - inicio) * 1000
+        vetor_consulta, candidatos = futuro_vetorial.result()
+
+        inicio = time.perf_counter()
+        mapa_posicoes = posicoes_por_id(db)
+        ids_vetoriais = [db.index_to_docstore_id[p] for p, _ in candidatos]
+        fundidos = [(mapa_posicoes[id_], pontuacao) for id_, pontuacao
+                    in fundir_rrf([ids_vetoriais, ids_lexicais]) if id_ in mapa_posicoes]
+        posicoes = [p for p, _ in fundidos]
+        relevancias = np.asarray([pontuacao for _, pontuacao in fundidos], dtype=np.float32)
+        relevancias /= max(float(relevancias.max(initial=0.0)), 1e-12)
+        tempos["fusao_ms"] = (time.perf_counter() - inicio) * 1000
+    else:
+        vetor_consulta, candidatos = busca_vetorial()
+        posicoes = [p for p, _ in candidatos]
+        relevancias = None
+
+    def documento(posicao: int) -> Document:
+        return db.docstore.search(db.index_to_docstore_id[posicao])
+
+    # Etapa 2: reranqueamento dos candidatos.
+    inicio = time.perf_counter()
+    if modo == "cross_encoder" and len(posicoes) > k_final:
+        documentos = [documento(p) for p in posicoes]
+        pontuacoes = obter_cross_encoder().predict([(pergunta, doc.page_content) for doc in documentos])
+        ordem = np.argsort(-np.asarray(pontuacoes))[:k_final]
+        selecionados = [documentos[i] for i in ordem]
+    else:
+        escolhidos = range(min(k_final, len(posicoes)))
+        if modo == "mmr" and len(posicoes) > k_final:
+            vetores = vetores_das_posicoes(db, posicoes)
+            if vetores is None:
+                vetores = np.asarray(db.embeddings.embed_documents([documento(p).page_content for p in posicoes]))
+            if relevancias is None:
+                # Sem a fusão, a relevância é o cosseno entre a pergunta e cada candidato.
+                relevancias = relevancias_cosseno(vetor_consulta, vetores)
+            escolhidos = selecionar_mmr(relevancias, vetores, k_final, lambda_mmr)
+        selecionados = [documento(posicoes[i]) for i in escolhidos]
+    tempos["reranqueamento_ms"] = (time.perf_counter() - inicio) * 1000
+    return selecionados, tempos
+
+def similaridades_documentos(db: FAISS, vetor_pergunta: np.ndarray, documentos: list[Document]) -> list[float]:
+    """Cosseno entre a pergunta e cada documento, comparável entre contextos (mesmo modelo de embedding)."""
+    if not documentos:
+        return []
+    mapa_posicoes = posicoes_por_id(db)
+    vetores = None
+    if all(doc.id in mapa_posicoes for doc in documentos):
+        vetores = vetores_das_posicoes(db, [mapa_posicoes[doc.id] for doc in documentos])
+    if vetores is None:
+        vetores = np.asarray(db.embeddings.embed_documents([doc.page_content for doc in documentos]), dtype=np.float32)
+    return relevancias_cosseno(vetor_pergunta, vetores).tolist()
+
+def recuperar_em_contextos(contextos: list[tuple[str, FAISS, IndiceLexical | None]], pergunta: str,
+                           k_final: int = K_FINAL, **parametros) -> tuple[list[Document], dict]:
+    """
+    Busca a pergunta em vários contextos ao mesmo tempo (a pergunta é embedada
+    uma vez só) e junta os resultados por RRF sobre a ordem final de cada contexto,
+    preservando a fusão/reranqueamento feitos em cada um; o cosseno com a pergunta
+    só desempata. Cada documento recebe o metadado "contexto"; chunks idênticos
+    aparecem uma vez (com o contexto em que ficaram mais bem colocados).
+    """
+    if len(contextos) == 1:
+        id_contexto, db, indice_lexical = contextos[0]
+        documentos, tempos = recuperar_documentos(db, pergunta, indice_lexical, k_final=k_final, **parametros)
+        return [_marcar_contexto(doc, id_contexto) for doc in documentos], tempos
+
+    tempos = {}
+    inicio = time.perf_counter()
+    vetor_pergunta = np.asarray(contextos[0][1].embeddings.embed_query(pergunta), dtype=np.float32)
+    tempos["embedding_ms"] = (time.perf_counter() - inicio) * 1000
+
+    def buscar_contexto(id_contexto: str, db: FAISS, indice_lexical: IndiceLexical | None):
+        inicio_contexto = time.perf_counter()
+        documentos, tempos_contexto = recuperar_documentos(db, pergunta, indice_lexical, k_final=k_final,
+                                                           vetor_pergunta=vetor_pergunta, **parametros)
+        pontuacoes = similaridades_documentos(db, vetor_pergunta, documentos)
+        tempos_contexto["total_ms"] = (time.perf_counter() - inicio_contexto) * 1000
+        return id_contexto, documentos, pontuacoes, tempos_contexto
+
+    inicio = time.perf_counter()
+    futuros = [_executor_contextos().submit(buscar_contexto, *contexto) for contexto in contextos]
+    resultados = [futuro.result() for futuro in futuros]
+    tempos["busca_contextos_ms"] = (time.perf_counter() - inicio) * 1000
+
+    inicio = time.perf_counter()
+    documentos_por_id, melhor_rank, cossenos = {}, {}, {}
+    for id_contexto, documentos, pontuacoes, tempos_contexto in resultados:
+        for etapa, valor in tempos_contexto.items():
+            tempos[f"{id_contexto}.{etapa}"] = valor
+        for rank, (doc, pontuacao) in enumerate(zip(documentos, pontuacoes)):
+            cossenos[doc.id] = max(pontuacao, cossenos.get(doc.id, pontuacao))
+            if rank < melhor_rank.get(doc.id, float("inf")):
+                melhor_rank[doc.id] = rank
+                documentos_por_id[doc.id] = _marcar_contexto(doc, id_contexto)
+    fundidos = fundir_rrf([[doc.id for doc in documentos] for _, documentos, _, _ in resultados])
+    fundidos.sort(key=lambda item: (item[1], cossenos[item[0]]), reverse=True)
+    selecionados = [documentos_por_id[id_] for id_, _ in fundidos[:k_final]]
+    tempos["juncao_ms"] = (time.perf_counter() - inicio) * 1000
+    return selecionados, tempos
+
+def _marcar_contexto(doc: Document, id_contexto: str) -> Document:
+    from langchain_core.documents import Document
+    return Document(id=doc.id, page_content=doc.page_content, metadata={**doc.metadata, "contexto": id_contexto})
+
+def formatar_tempos(tempos: dict) -> str:
+    return " | ".join(f"{etapa.removesuffix('_ms')}: {valor:.1f} ms" for etapa, valor in tempos.items())
@@ -1,13 +1,36 @@
 import os
 import re
+import glob
 import nltk
-import sys
+import argparse
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
 
 # --- Nova Constante Configurável ---
 # Defina aqui o número mínimo de caracteres que um chunk deve ter.
 # Ajuste este valor conforme sua necessidade.
 TAMANHO_MINIMO_CHUNK = 300
 
+# --- Padrões pré-compilados (usados por sentença, então não recompilamos a cada chamada) ---
+PADRAO_CAMINHO = re.compile(r'((?<=[\s,(])(/|./)[\w./\-_]+)')
+PADRAO_VARIAVEL = re.compile(r'(\$\w+)')
+PADRAO_ATRIBUICAO = re.compile(r'(\b[A-Z_]{3,}=[\w"\./\-_]+)')
+PADRAO_ITEM_LISTA = re.compile(r'^\s*\d+\.\s')
+PADRAO_SUBITEM_LISTA = re.compile(r'^\s*\d+\.\d+')
+PADRAO_BLOCO_CODIGO = re.compile(r'(```.*?```)', re.DOTALL)
+PADRAO_PLACEHOLDER = re.compile(r'__CODE_BLOCK_PLACEHOLDER_(\d+)__')
+
+# --- Modo streaming ---
+# Quantos caracteres são lidos do disco por vez e o tamanho máximo de um bloco
+# (texto entre dois '###') mantido em memória. Um bloco maior que o limite é
+# fechado na última quebra de linha, o que mantém a memória limitada mesmo em
+# bases de conhecimento enormes sem separadores. Um bloco de código que passa
+# do limite (ou um '```' que nunca fecha) é tratado como texto comum.
+TAMANHO_LEITURA_STREAMING = 1024 * 1024
+LIMITE_BLOCO_STREAMING = 4 * 1024 * 1024
+MARCADOR_CODIGO = '```'
+MARCADOR_BLOCO = '###'
+
 # --- Configuração Inicial do NLTK ---
 try:
     nltk.data.find('tokenizers/punkt')
@@ -18,9 +41,9 @@ except nltk.downloader.DownloadError:
 
 def aplicar_formatacao_inline(texto):
     """Aplica formatação inline (`) em elementos específicos do texto."""
-    texto = re.sub(r'((?<=[\s,(])(/|./)[\w./\-_]+)', r'`\1`', texto)
-    texto = re.sub(r'(\$\w+)', r'`\1`', texto)
-    texto = re.sub(r'(\b[A-Z_]{3,}=[\w"\./\-_]+)', r'`\1`', texto)
+    texto = PADRAO_CAMINHO.sub(r'`\1`', texto)
+    texto = PADRAO_VARIAVEL.sub(r'`\1`', texto)
+    texto = PADRAO_ATRIBUICAO.sub(r'`\1`', texto)
     return texto
 
 def chunkificar_bloco(bloco_texto):
@@ -53,7 +76,7 @@ def chunkificar_bloco(bloco_texto):
         # Define o que é uma "Quebra Forte": um item de lista principal (1., 2., etc.)
         # mas não um sub-item (1.1., 2.3.1., etc.).
         # Se encontrarmos uma quebra forte e o chunk atual não estiver vazio, forçamos o fechamento.
-        is_hard_break = re.match(r'^\s*\d+\.\s', sentenca_strip) and not re.match(r'^\s*\d+\.\d+', sentenca_strip)
+        is_hard_break = PADRAO_ITEM_LISTA.match(sentenca_strip) and not PADRAO_SUBITEM_LISTA.match(sentenca_strip)
 
         if is_hard_break and chunk_temporario:
             chunks_finais.append(" ".join(chunk_temporario).strip())
@@ -96,7 +119,7 @@ def processar_arquivo(caminho_arquivo):
         print(f"ERRO: Arquivo '{caminho_arquivo}' não encontrado.")
         return
 
-    code_blocks = re.findall(r'(```.*?```)', conteudo, re.DOTALL)
+    code_blocks = PADRAO_BLOCO_CODIGO.findall(conteudo)
     placeholders = []
     for i, block in enumerate(code_blocks):
         placeholder = f"__CODE_BLOCK_PLACEHOLDER_{i}__"
@@ -126,14 +149,204 @@ def processar_arquivo(caminho_arquivo):
             f.write(conteudo_final)
         print("\nProcessamento concluído com sucesso!")
         print(f"Arquivo refatorado salvo como: '{caminho_saida}'")
+        return caminho_saida
     except Exception as e:
         print(f"ERRO ao salvar o arquivo de saída: {e}")
 
+
+# --- Modo Streaming (memória limitada) ---
+
+class EscritorChunks:
+    """Grava os chunks no arquivo de saída à medida que chegam, com o mesmo separador do modo em memória."""
+
+    def __init__(self, arquivo):
+        self.arquivo = arquivo
+        self.total = 0
+
+    def escrever_bloco(self, bloco, blocos_codigo):
+        bloco = bloco.strip()
+        if not bloco:
+            return
+        for chunk in chunkificar_bloco(bloco):
+            chunk = PADRAO_PLACEHOLDER.sub(lambda m: blocos_codigo[int(m.group(1))], chunk)
+            if self.total:
+                self.arquivo.write('\n\n###\n\n')
+            self.arquivo.write(chunk)
+            self.total += 1
+
+
+def iterar_blocos(arquivo, tamanho_leitura=TAMANHO_LEITURA_STREAMING, limite_bloco=LIMITE_BLOCO_STREAMING):
+    """
+    Lê o arquivo em pedaços e gera (bloco, blocos_codigo) para cada trecho entre
+    separadores '###'. Os blocos de código (```...```) são trocados por placeholders,
+    como no modo em memória, e um '###' dentro deles não separa blocos.
+    """
+    partes = []            # texto do bloco atual (com placeholders)
+    tamanho_partes = 0
+    blocos_codigo = []
+    codigo = None          # lista de pedaços do bloco de código aberto, ou None
+    tamanho_codigo = 0
+    pendente = ''
+
+    def fechar_bloco():
+        nonlocal partes, tamanho_partes, blocos_codigo
+        bloco = ''.join(partes)
+        codigos = blocos_codigo
+        partes, tamanho_partes, blocos_codigo = [], 0, []
+        return bloco, codigos
+
+    def codigo_como_texto():
+        # Como no modo em memória com um bloco sem fechamento: o código vira texto
+        # comum, inclusive com os '###' internos separando blocos.
+        nonlocal codigo, tamanho_partes
+        restante = ''.join(codigo).split(MARCADOR_BLOCO)
+        codigo = None
+        partes.append(restante[0])
+        tamanho_partes += len(restante[0])
+        for trecho in restante[1:]:
+            yield fechar_bloco()
+            partes.append(trecho)
+            tamanho_partes += len(trecho)
+
+    while True:
+        lido = arquivo.read(tamanho_leitura)
+        fim_arquivo = not lido
+        texto = pendente + lido
+        # Guarda os 2 últimos caracteres para não partir um marcador entre duas leituras.
+        limite = len(texto) if fim_arquivo else max(0, len(texto) - (len(MARCADOR_CODIGO) - 1))
+        pos = 0
+        while pos < limite:
+            if codigo is not None:
+                fim = texto.find(MARCADOR_CODIGO, pos)
+                if fim == -1 or fim >= limite:
+                    codigo.append(texto[pos:limite])
+                    tamanho_codigo += limite - pos
+                    pos = limite
+                    if tamanho_codigo > limite_bloco:
+                        yield from codigo_como_texto()
+                    continue
+                codigo.append(texto[pos:fim + len(MARCADOR_CODIGO)])
+                placeholder = f"__CODE_BLOCK_PLACEHOLDER_{len(blocos_codigo)}__"
+                blocos_codigo.append(''.join(codigo))
+                codigo = None
+                partes.append(placeholder)
+                tamanho_partes += len(blocos_codigo[-1])
+                pos = fim + len(MARCADOR_CODIGO)
+                continue
+
+            pos_codigo = texto.find(MARCADOR_CODIGO, pos, limite + len(MARCADOR_CODIGO) - 1)
+            pos_bloco = texto.find(MARCADOR_BLOCO, pos, limite + len(MARCADOR_BLOCO) - 1)
+            candidatos = [p for p in (pos_codigo, pos_bloco) if p != -1 and p < limite]
+            if not candidatos:
+                partes.append(texto[pos:limite])
+                tamanho_partes += limite - pos
+                pos = limite
+            else:
+                proximo = min(candidatos)
+                partes.append(texto[pos:proximo])
+                if proximo == pos_codigo:
+                    codigo, tamanho_codigo = [MARCADOR_CODIGO], len(MARCADOR_CODIGO)
+                    pos = proximo + len(MARCADOR_CODIGO)
+                else:
+                    yield fechar_bloco()
+                    pos = proximo + len(MARCADOR_BLOCO)
+                    continue
+
+            if tamanho_partes > limite_bloco and codigo is None:
+                bloco = ''.join(partes)
+                corte = bloco.rfind('\n') + 1 or len(bloco)
+                partes, tamanho_partes = [bloco[corte:]], len(bloco) - corte
+                # Os placeholders do trecho fechado continuam válidos: 'blocos_codigo' só é
+                # reiniciado num separador '###', então o bloco seguinte usa a mesma lista.
+                yield bloco[:corte], blocos_codigo
+        pendente = texto[max(pos, limite):]
+        if fim_arquivo:
+            break
+
+    if codigo is not None:
+        # Bloco de código sem fechamento: no modo em memória ele não casa com o padrão.
+        yield from codigo_como_texto()
+    yield fechar_bloco()
+
+
+def processar_arquivo_streaming(caminho_arquivo):
+    """
+    Versão em streaming de processar_arquivo: lê a entrada aos poucos e grava cada
+    chunk assim que ele é gerado. A saída é escrita num arquivo temporário e só
+    substitui o '_refatorado.txt' ao final, para não deixar arquivos pela metade.
+    """
+    print(f"Processando o arquivo (streaming): {caminho_arquivo}")
+    base, ext = os.path.splitext(caminho_arquivo)
+    caminho_saida = f"{base}_refatorado.txt"
+    caminho_temporario = f"{caminho_saida}.tmp"
+    try:
+        with open(caminho_arquivo, 'r', encoding='utf-8') as entrada, \
+             open(caminho_temporario, 'w', encoding='utf-8') as saida:
+            escritor = EscritorChunks(saida)
+            for bloco, blocos_codigo in iterar_blocos(entrada):
+                escritor.escrever_bloco(bloco, blocos_codigo)
+        os.replace(caminho_temporario, caminho_saida)
+    except FileNotFoundError:
+        print(f"ERRO: Arquivo '{caminho_arquivo}' não encontrado.")
+        return None
+    except Exception as e:
+        print(f"ERRO ao processar '{caminho_arquivo}': {e}")
+        if os.path.exists(caminho_temporario):
+            os.remove(caminho_temporario)
+        return None
+    print(f"Arquivo refatorado salvo como: '{caminho_saida}' ({escritor.total} chunks)")
+    return caminho_saida
+
+
+def expandir_entradas(alvo):
+    """Aceita um arquivo, uma pasta (todos os .txt) ou um padrão glob. Ignora as saídas '_refatorado'."""
+    if os.path.isdir(alvo):
+        caminhos = glob.glob(os.path.join(alvo, "*.txt"))
+    elif os.path.isfile(alvo):
+        return [alvo]
+    else:
+        caminhos = glob.glob(alvo)
+    return sorted(c for c in caminhos if os.path.isfile(c) and not c.endswith("_refatorado.txt"))
+
+
+def processar_entradas(alvo, streaming=True, processos=None):
+    """Processa todos os arquivos de 'alvo', em paralelo quando há mais de um."""
+    caminhos = expandir_entradas(alvo)
+    if not caminhos:
+        print(f"ERRO: Nenhum arquivo encontrado para '{alvo}'.")
+        return []
+    funcao = processar_arquivo_streaming if streaming else processar_arquivo
+    processos = min(processos or os.cpu_count() or 1, len(caminhos))
+    if processos <= 1:
+        return [funcao(caminho) for caminho in caminhos]
+
+    print(f"-> Processando {len(caminhos)} arquivos com {processos} processos...")
+    saidas = {}
+    # 'spawn' evita herdar estado do NLTK por fork, como no chunker_customizado.
+    contexto = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=processos, mp_context=contexto) as executor:
+        futuros = {executor.submit(funcao, caminho): caminho for caminho in caminhos}
+        for futuro in as_completed(futuros):
+            caminho = futuros[futuro]
+            try:
+                saidas[caminho] = futuro.result()
+            except Exception as e:
+                print(f"❌ Falha ao processar '{caminho}': {e}")
+                saidas[caminho] = None
+    concluidos = sum(1 for saida in saidas.values() if saida)
+    print(f"✅ {concluidos}/{len(caminhos)} arquivos refatorados.")
+    return [saidas[caminho] for caminho in caminhos]
+
 # --- Ponto de Entrada do Script ---
 if __name__ == "__main__":
-    if len(sys.argv) > 1:
-        nome_arquivo_alvo = sys.argv[1]
+    parser = argparse.ArgumentParser(description="Refatora arquivos de texto em chunks separados por '###'.")
+    parser.add_argument("alvo", nargs="?", default=None, help="Arquivo, pasta ou padrão glob (ex: 'documentos_rag/*.txt').")
+    parser.add_argument("--streaming", action="store_true", help="Lê e grava aos poucos, com memória limitada (recomendado para arquivos grandes).")
+    parser.add_argument("--processos", type=int, default=None, help="Processos para tratar vários arquivos em paralelo (padrão: nº de CPUs).")
+    args = parser.parse_args()
+
+    alvo = args.alvo or input("Digite o nome do arquivo de texto a ser processado (ex: meu_arquivo.txt): ")
+    if os.path.isfile(alvo) and not args.streaming:
+        processar_arquivo(alvo)
     else:
-        nome_arquivo_alvo = input("Digite o nome do arquivo de texto a ser processado (ex: meu_arquivo.txt): ")
-    
-    processar_arquivo(nome_arquivo_alvo)
+        processar_entradas(alvo, streaming=args.streaming, processos=args.processos)
@@ -1,11 +1,17 @@
 import os
 import json
+import time
 import asyncio
-import httpx
-from fastapi import FastAPI, HTTPException
+import threading
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
 from dotenv import load_dotenv
 
+from cliente_openrouter import ClienteOpenRouter, CircuitoAberto, ProvedorSobrecarregado
+from agendador_modelos import AgendadorModelo, FilaCheia, CAPACIDADE_FILA_PADRAO, PRIORIDADES_PADRAO, PRIORIDADE_SEM_ENDPOINT
+
 # Tenta importar llama_cpp
 try:
     from llama_cpp import Llama
@@ -90,11 +96,22 @@ if not configurar_servicos_interativamente():
 
 class PromptRequest(BaseModel): prompt: str
 
+class ContagemTokensRequest(BaseModel):
+    servico: str
+    textos: list[str]
+
 print("\n-> Iniciando o Servidor Gateway Orientado a Serviços...")
 with open("config_modelo_local.json", 'r', encoding='utf-8') as f:
     CONFIG = json.load(f)
 OPENROUTER_KEY = os.getenv("OPENROUTER_API_KEY")
+# Conexões com o OpenRouter reaproveitadas entre pedidos (ver cliente_openrouter).
+cliente_nuvem = ClienteOpenRouter(OPENROUTER_KEY, CONFIG.get("cliente_nuvem"))
 loaded_local_models = {}
+# Um objeto Llama não pode avaliar dois prompts ao mesmo tempo: toda geração
+# local passa pelo agendador do serviço (ver agendador_modelos).
+agendadores = {}
+CONFIG_AGENDADOR = CONFIG.get("agendador", {})
+PRIORIDADES_ENDPOINTS = {**PRIORIDADES_PADRAO, **CONFIG_AGENDADOR.get("prioridades", {})}
 
 if Llama:
     for service_name, service_config in CONFIG.get("servicos", {}).items():
@@ -103,16 +120,38 @@ if Llama:
             if model_path and os.path.exists(model_path):
                 print(f"-> Carregando modelo local para o serviço '{service_name}': {os.path.basename(model_path)}")
                 params = CONFIG.get("parametros_carregamento_local", {})
-                loaded_local_models[service_name] = Llama(model_path=model_path, **params, verbose=False)
-                print(f"✅ Modelo para '{service_name}' carregado.")
+                # Cada réplica é uma cópia do modelo na memória e atende um pedido por vez.
+                replicas = [Llama(model_path=model_path, **params, verbose=False)
+                            for _ in range(max(1, int(service_config.get("replicas", 1))))]
+                loaded_local_models[service_name] = replicas[0]
+                agendadores[service_name] = AgendadorModelo(
+                    service_name, replicas, CONFIG_AGENDADOR.get("capacidade_fila", CAPACIDADE_FILA_PADRAO))
+                print(f"✅ Modelo para '{service_name}' carregado ({len(replicas)} réplica(s)).")
             else:
                 print(f"⚠️ AVISO: Modelo local para o serviço '{service_name}' não encontrado em '{model_path}'.")
 else:
     print("⚠️ AVISO: 'llama-cpp-python' não está instalado. Nenhum serviço local pode ser ativado.")
 
-app = FastAPI()
+@asynccontextmanager
+async def ciclo_de_vida(app: FastAPI):
+    for agendador in agendadores.values():
+        agendador.iniciar()
+    await cliente_nuvem.iniciar()
+    yield
+    await cliente_nuvem.fechar()
+    for agendador in agendadores.values():
+        await agendador.parar()
 
-async def handle_request(service_name: str, prompt: str):
+app = FastAPI(lifespan=ciclo_de_vida)
+
+def enviar_ao_agendador(service_name: str, endpoint: str, funcao) -> asyncio.Future:
+    """Enfileira 'funcao(modelo)' no agendador do serviço; fila cheia vira HTTP 503 com Retry-After."""
+    try:
+        return agendadores[service_name].enviar(funcao, PRIORIDADES_ENDPOINTS.get(endpoint, PRIORIDADE_SEM_ENDPOINT))
+    except FilaCheia as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": str(e.retry_after_s)})
+
+async def handle_request(service_name: str, prompt: str, endpoint: str):
     service_config = CONFIG.get("servicos", {}).get(service_name)
     if not service_config:
         raise HTTPException(status_code=404, detail=f"Serviço '{service_name}' não encontrado na configuração.")
@@ -124,17 +163,16 @@ async def handle_request(service_name: str, prompt: str):
         if not model_obj:
             raise HTTPException(status_code=503, detail=f"Modelo local para o serviço '{service_name}' não está carregado.")
         
-        def blocking_call():
-            return model_obj(prompt, stop=["[/INST]", "</s>"], **params_inferencia)
+        def blocking_call(modelo):
+            return modelo(prompt, stop=["[/INST]", "</s>"], **params_inferencia)
         
         # --- BLOCO CORRIGIDO ---
+        futuro = enviar_ao_agendador(service_name, endpoint, blocking_call)
         try:
-            # Reintroduzimos o asyncio.wait_for para garantir o timeout
-            response = await asyncio.wait_for(
-                asyncio.to_thread(blocking_call),
-                timeout=180.0
-            )
-            return {"texto_gerado": response['choices'][0]['text'].strip()}
+            # Reintroduzimos o asyncio.wait_for para garantir o timeout. Ele conta
+            # também a espera na fila: um pedido que expira ainda na fila é descartado.
+            response, espera_fila = await asyncio.wait_for(futuro, timeout=180.0)
+            return {"texto_gerado": response['choices'][0]['text'].strip(), "espera_fila_s": round(espera_fila, 4)}
         except asyncio.TimeoutError:
             # Capturamos o erro de timeout e retornamos um HTTP 408
             raise HTTPException(status_code=408, detail=f"A geração do serviço local '{service_name}' excedeu o limite de 180 segundos.")
@@ -147,30 +185,284 @@ async def handle_request(service_name: str, prompt: str):
             raise HTTPException(status_code=503, detail="A chave OPENROUTER_API_KEY é necessária para serviços de nuvem.")
             
         model_id = service_config.get("id_openrouter")
-        headers = {"Authorization": f"Bearer {OPENROUTER_KEY}"}
         json_data = {
             "model": model_id,
             "messages": [{"role": "user", "content": prompt}],
             **params_inferencia
         }
         try:
-            async with httpx.AsyncClient() as client:
-                print(f"\n-> Roteando requisição do serviço '{service_name}' para OpenRouter (Modelo: {model_id})...")
-                response = await client.post("https://openrouter.ai/api/v1/chat/completions", headers=headers, json=json_data, timeout=180)
-                response.raise_for_status()
-            
-            return {"texto_gerado": response.json()['choices'][0]['message']['content'].strip()}
+            print(f"\n-> Roteando requisição do serviço '{service_name}' para OpenRouter (Modelo: {model_id})...")
+            response = await cliente_nuvem.completar(json_data)
+            return {"texto_gerado": response['choices'][0]['message']['content'].strip()}
+        except CircuitoAberto as e:
+            raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": str(e.retry_after_s)})
+        except ProvedorSobrecarregado as e:
+            # O cliente recebe o mesmo 429/503 do provedor, com o Retry-After, e não um 500.
+            raise HTTPException(status_code=e.status_code, detail=str(e), headers={"Retry-After": str(e.retry_after_s)})
         except Exception as e:
             raise HTTPException(status_code=500, detail=f"Erro na chamada do serviço de nuvem '{service_name}': {e}")
     else:
         raise HTTPException(status_code=501, detail=f"Tipo de serviço '{service_type}' não implementado.")
 
 
+# --- STREAMING (SERVER-SENT EVENTS) ---
+# '/gerar_stream' e '/sumarizar_stream' repassam os tokens conforme são gerados,
+# para o cliente mostrar a resposta a partir do primeiro token. Protocolo:
+#   data: {"texto": "..."}                            um pedaço do texto
+#   event: fim   + data: {"uso": {...}, "tempos": {...}}  uso de tokens e tempos da geração
+#   event: erro  + data: {"detail": "..."}                falha depois de o streaming começar
+#                  (+ "status" e "retry_after_s" quando o provedor de nuvem está sobrecarregado)
+# Erros detectados antes do início (serviço inexistente, modelo não carregado)
+# continuam sendo respostas HTTP comuns, como nos endpoints sem streaming.
+# O limite de 180 s vale para a espera de cada token, não para a geração inteira.
+TIMEOUT_ENTRE_TOKENS_S = 180.0
+# Enquanto espera o próximo token (ou a vez na fila), confere a cada 1 s se o cliente desconectou.
+INTERVALO_DESCONEXAO_S = 1.0
+# 'X-Accel-Buffering' evita que um proxy (nginx) segure os eventos até o fim.
+CABECALHOS_SSE = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+
+def evento_sse(dados: dict, evento: str | None = None) -> str:
+    prefixo = f"event: {evento}\n" if evento else ""
+    return f"{prefixo}data: {json.dumps(dados, ensure_ascii=False)}\n\n"
+
+def tempos_geracao(inicio: float, primeiro_token: float | None, tokens: int) -> dict:
+    fim = time.perf_counter()
+    tempos = {"total_s": round(fim - inicio, 4), "ttft_s": None, "tokens_por_s": None}
+    if primeiro_token is not None:
+        tempos["ttft_s"] = round(primeiro_token - inicio, 4)
+        if fim > primeiro_token:
+            tempos["tokens_por_s"] = round(tokens / (fim - primeiro_token), 2)
+    return tempos
+
+class RespostaStreamCancelavel(StreamingResponse):
+    """
+    StreamingResponse que chama 'ao_encerrar' quando a resposta termina por qualquer
+    caminho, inclusive se o cliente desconectar antes de o gerador de eventos começar
+    (caso em que o 'finally' do gerador nunca roda e as background tasks são puladas).
+    """
+
+    def __init__(self, conteudo, ao_encerrar, **kwargs):
+        super().__init__(conteudo, **kwargs)
+        self.ao_encerrar = ao_encerrar
+
+    async def __call__(self, scope, receive, send):
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            self.ao_encerrar()
+
+class GeracaoLocalStream:
+    """
+    Geração do llama.cpp com stream=True, enfileirada no agendador do serviço. O worker
+    que pega o pedido repassa cada pedaço por uma fila asyncio; se o cliente desconectar,
+    a geração para no próximo token (ou nem começa, se ainda estiver na fila).
+    """
+
+    def __init__(self, service_name: str, prompt: str, params_inferencia: dict):
+        self.service_name = service_name
+        self.loop = asyncio.get_running_loop()
+        self.fila = asyncio.Queue()
+        self.cancelado = threading.Event()
+        self.fim_da_fila = object()
+        self.uso = {"prompt_tokens": None, "completion_tokens": 0}
+        self.prompt = prompt
+        self.params_inferencia = params_inferencia
+        self.inicio = time.perf_counter()
+        self.futuro = None
+
+    def cancelar(self):
+        self.cancelado.set()
+        if self.futuro is not None:
+            self.futuro.cancel()
+
+    def produzir(self, modelo):
+        try:
+            # Cancelado enquanto esperava na fila: não gasta o prefill do prompt.
+            if self.cancelado.is_set():
+                return
+            self.uso["prompt_tokens"] = len(modelo.tokenize(self.prompt.encode("utf-8")))
+            for parte in modelo(self.prompt, stop=["[/INST]", "</s>"], stream=True, **self.params_inferencia):
+                if self.cancelado.is_set():
+                    break
+                # Cada pedaço do llama.cpp corresponde a um token gerado.
+                self.uso["completion_tokens"] += 1
+                self.loop.call_soon_threadsafe(self.fila.put_nowait, parte["choices"][0]["text"])
+        except Exception as e:
+            self.loop.call_soon_threadsafe(self.fila.put_nowait, e)
+        finally:
+            self.loop.call_soon_threadsafe(self.fila.put_nowait, self.fim_da_fila)
+
+async def proximo_pedaco(geracao: GeracaoLocalStream, requisicao: Request):
+    """
+    Próximo item da fila da geração, ou None se o cliente desconectou enquanto esperava.
+    Sem isso, um pedido ainda na fila só seria cancelado ao tentar enviar o primeiro token,
+    depois de o worker já ter feito o prefill.
+    """
+    prazo = time.monotonic() + TIMEOUT_ENTRE_TOKENS_S
+    while True:
+        restante = prazo - time.monotonic()
+        if restante <= 0:
+            raise asyncio.TimeoutError
+        try:
+            return await asyncio.wait_for(geracao.fila.get(), timeout=min(INTERVALO_DESCONEXAO_S, restante))
+        except asyncio.TimeoutError:
+            if await requisicao.is_disconnected():
+                geracao.cancelar()
+                return None
+
+async def stream_local(geracao: GeracaoLocalStream, requisicao: Request):
+    service_name, fim_da_fila, uso, inicio = geracao.service_name, geracao.fim_da_fila, geracao.uso, geracao.inicio
+    primeiro_token = None
+    try:
+        while True:
+            item = await proximo_pedaco(geracao, requisicao)
+            if item is None:
+                return
+            if item is fim_da_fila:
+                break
+            if isinstance(item, Exception):
+                yield evento_sse({"detail": f"Erro no serviço local '{service_name}': {item}"}, "erro")
+                return
+            if not item:
+                continue
+            if primeiro_token is None:
+                primeiro_token = time.perf_counter()
+            yield evento_sse({"texto": item})
+        _, espera_fila = await geracao.futuro
+        tempos = {**tempos_geracao(inicio, primeiro_token, uso["completion_tokens"]), "espera_fila_s": round(espera_fila, 4)}
+        yield evento_sse({"uso": uso, "tempos": tempos}, "fim")
+    except asyncio.TimeoutError:
+        yield evento_sse({"detail": f"O serviço local '{service_name}' ficou mais de {TIMEOUT_ENTRE_TOKENS_S:.0f} segundos sem gerar."}, "erro")
+    finally:
+        geracao.cancelar()
+
+async def stream_nuvem(service_name: str, model_id: str, prompt: str, params_inferencia: dict):
+    """Repassa o streaming SSE do OpenRouter ('choices[0].delta.content'), pedindo o uso de tokens no último pedaço."""
+    json_data = {
+        "model": model_id,
+        "messages": [{"role": "user", "content": prompt}],
+        **params_inferencia,
+        "stream": True,
+        "usage": {"include": True},
+    }
+    inicio = time.perf_counter()
+    primeiro_token = None
+    pedacos = 0
+    uso = None
+    try:
+        print(f"\n-> Roteando requisição (streaming) do serviço '{service_name}' para OpenRouter (Modelo: {model_id})...")
+        async with cliente_nuvem.stream(json_data) as response:
+            if response.status_code >= 400:
+                corpo = (await response.aread()).decode("utf-8", errors="replace")
+                yield evento_sse({"detail": f"Erro na chamada do serviço de nuvem '{service_name}': "
+                                            f"HTTP {response.status_code}: {corpo[:500]}"}, "erro")
+                return
+            async for linha in response.aiter_lines():
+                # Linhas que começam com ':' são comentários de keep-alive do OpenRouter.
+                if not linha.startswith("data:"):
+                    continue
+                dados = linha[len("data:"):].strip()
+                if dados == "[DONE]":
+                    break
+                pedaco = json.loads(dados)
+                if pedaco.get("error"):
+                    yield evento_sse({"detail": f"Erro no serviço de nuvem '{service_name}': {pedaco['error']}"}, "erro")
+                    return
+                if pedaco.get("usage"):
+                    uso = pedaco["usage"]
+                for escolha in pedaco.get("choices") or []:
+                    texto = (escolha.get("delta") or {}).get("content")
+                    if not texto:
+                        continue
+                    if primeiro_token is None:
+                        primeiro_token = time.perf_counter()
+                    pedacos += 1
+                    yield evento_sse({"texto": texto})
+    except ProvedorSobrecarregado as e:
+        # O status HTTP já foi enviado (200): o Retry-After vai no próprio evento de erro.
+        yield evento_sse({"detail": str(e), "status": e.status_code, "retry_after_s": e.retry_after_s}, "erro")
+        return
+    except Exception as e:
+        yield evento_sse({"detail": f"Erro na chamada do serviço de nuvem '{service_name}': {e}"}, "erro")
+        return
+    uso = uso or {"completion_tokens": pedacos}
+    yield evento_sse({"uso": uso, "tempos": tempos_geracao(inicio, primeiro_token, uso.get("completion_tokens") or pedacos)}, "fim")
+
+async def handle_request_stream(service_name: str, prompt: str, endpoint: str, requisicao: Request) -> StreamingResponse:
+    service_config = CONFIG.get("servicos", {}).get(service_name)
+    if not service_config:
+        raise HTTPException(status_code=404, detail=f"Serviço '{service_name}' não encontrado na configuração.")
+    service_type = service_config.get("tipo")
+    params_inferencia = CONFIG.get("parametros_inferencia_padrao", {})
+
+    if service_type == "local":
+        model_obj = loaded_local_models.get(service_name)
+        if not model_obj:
+            raise HTTPException(status_code=503, detail=f"Modelo local para o serviço '{service_name}' não está carregado.")
+        # Enfileira antes de responder: com a fila cheia o cliente recebe 503, não um stream vazio.
+        geracao = GeracaoLocalStream(service_name, prompt, params_inferencia)
+        geracao.futuro = enviar_ao_agendador(service_name, endpoint, geracao.produzir)
+        return RespostaStreamCancelavel(stream_local(geracao, requisicao), geracao.cancelar,
+                                        media_type="text/event-stream", headers=CABECALHOS_SSE)
+    elif service_type == "nuvem":
+        if not OPENROUTER_KEY:
+            raise HTTPException(status_code=503, detail="A chave OPENROUTER_API_KEY é necessária para serviços de nuvem.")
+        try:
+            cliente_nuvem.disjuntor.verificar()
+        except CircuitoAberto as e:
+            raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": str(e.retry_after_s)})
+        eventos = stream_nuvem(service_name, service_config.get("id_openrouter"), prompt, params_inferencia)
+    else:
+        raise HTTPException(status_code=501, detail=f"Tipo de serviço '{service_type}' não implementado.")
+    return StreamingResponse(eventos, media_type="text/event-stream", headers=CABECALHOS_SSE)
+
+
+@app.post("/contar_tokens")
+async def endpoint_contar_tokens(request: ContagemTokensRequest):
+    """
+    Conta os tokens dos textos com o tokenizador do modelo do serviço e informa a
+    janela de contexto dele. Serviços de nuvem não expõem o tokenizador: nesse caso
+    a contagem é estimada (~4 caracteres por token) e a janela vem da configuração.
+    """
+    service_config = CONFIG.get("servicos", {}).get(request.servico)
+    if not service_config:
+        raise HTTPException(status_code=404, detail=f"Serviço '{request.servico}' não encontrado na configuração.")
+    model_obj = loaded_local_models.get(request.servico)
+    if service_config.get("tipo") == "local" and model_obj:
+        # Fora do agendador de propósito: tokenize() só lê o vocabulário do modelo
+        # (llama_tokenize não toca no contexto nem no cache KV da geração), então pode
+        # rodar junto com uma geração na mesma réplica. Na fila, cada contagem de
+        # orçamento esperaria uma geração inteira terminar.
+        def tokenizar():
+            return [len(model_obj.tokenize(texto.encode("utf-8"), add_bos=False)) for texto in request.textos]
+        tokens = await asyncio.to_thread(tokenizar)
+        return {"tokens": tokens, "metodo": "tokenizador", "n_ctx": model_obj.n_ctx()}
+    n_ctx = CONFIG.get("parametros_orcamento", {}).get("n_ctx_nuvem")
+    return {"tokens": [len(texto) // 4 + 1 for texto in request.textos], "metodo": "estimativa", "n_ctx": n_ctx}
+
+
 @app.post("/sumarizar")
 async def endpoint_sumarizar(request: PromptRequest):
-    return await handle_request("sumarizador", request.prompt)
+    return await handle_request("sumarizador", request.prompt, "sumarizar")
 
 
 @app.post("/gerar")
 async def endpoint_gerar(request: PromptRequest):
-    return await handle_request("gerador_principal", request.prompt)
\ No newline at end of file
+    return await handle_request("gerador_principal", request.prompt, "gerar")
+
+
+@app.post("/sumarizar_stream")
+async def endpoint_sumarizar_stream(request: PromptRequest, requisicao: Request):
+    return await handle_request_stream("sumarizador", request.prompt, "sumarizar_stream", requisicao)
+
+
+@app.post("/gerar_stream")
+async def endpoint_gerar_stream(request: PromptRequest, requisicao: Request):
+    return await handle_request_stream("gerador_principal", request.prompt, "gerar_stream", requisicao)
+
+
+@app.get("/estado")
+async def endpoint_estado():
+    """Fila, réplicas ocupadas e tempos médios de cada modelo local, e o estado da rota de nuvem."""
+    return {"agendadores": {nome: agendador.estado() for nome, agendador in agendadores.items()},
+            "nuvem": cliente_nuvem.estado()}
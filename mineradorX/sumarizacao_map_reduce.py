@@ -0,0 +1,81 @@
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Callable
+
+# --- SUMARIZAÇÃO MAP-REDUCE ---
+# Em vez de um único prompt de sumarização com todos os chunks (um prefill
+# enorme e serial), os chunks são divididos em grupos pequenos que cabem na
+# janela do sumarizador e extraídos em paralelo no gateway (map). Grupos que
+# respondem CONTEXTO_INSUFICIENTE são descartados assim que chegam; os
+# extratos restantes, na ordem de relevância, formam o contexto final (reduce).
+MARCADOR_INSUFICIENTE = "CONTEXTO_INSUFICIENTE"
+TAMANHO_GRUPO_RESUMO = 3
+MAX_SUMARIZACOES_PARALELAS = 4
+
+def agrupar_por_orcamento(tokens: list[int], orcamento: int, tamanho_grupo: int = TAMANHO_GRUPO_RESUMO) -> list[list[int]]:
+    """
+    Agrupa os índices dos chunks, em ordem, em grupos de até 'tamanho_grupo' que
+    caibam em 'orcamento' tokens. Chunks maiores que o orçamento ficam de fora.
+    """
+    grupos = []
+    atual, usados = [], 0
+    for i, quantidade in enumerate(tokens):
+        if quantidade > orcamento:
+            continue
+        if atual and (len(atual) >= tamanho_grupo or usados + quantidade > orcamento):
+            grupos.append(atual)
+            atual, usados = [], 0
+        atual.append(i)
+        usados += quantidade
+    if atual:
+        grupos.append(atual)
+    return grupos
+
+def sumarizar_map_reduce(textos: list[str], tokens: list[int], orcamento: int, montar_prompt: Callable[[str], str],
+                         chamar: Callable[[str], str], paralelismo: int = MAX_SUMARIZACOES_PARALELAS,
+                         log: Callable[[str], None] = print) -> tuple[str, dict]:
+    """
+    Extrai cada grupo de chunks concorrentemente com 'chamar(prompt)' e junta os
+    extratos úteis. Retorna (contexto, relatório com as latências de cada fase).
+    Avisos de grupos que falharam vão para 'log'.
+    """
+    inicio = time.perf_counter()
+    grupos = agrupar_por_orcamento(tokens, orcamento)
+    extratos = [None] * len(grupos)
+    duracoes = []
+    descartados = erros = 0
+
+    def extrair(indice_grupo: int) -> tuple[int, str, float]:
+        inicio_grupo = time.perf_counter()
+        contexto_grupo = "\n\n".join(textos[i] for i in grupos[indice_grupo])
+        return indice_grupo, chamar(montar_prompt(contexto_grupo)).strip(), time.perf_counter() - inicio_grupo
+
+    with ThreadPoolExecutor(max_workers=max(1, min(paralelismo, len(grupos)))) as executor:
+        for futuro in as_completed([executor.submit(extrair, i) for i in range(len(grupos))]):
+            indice_grupo, extrato, duracao = futuro.result()
+            duracoes.append(duracao)
+            if extrato.startswith("ERRO"):
+                erros += 1
+                log(f"      ⚠️ Grupo {indice_grupo + 1}/{len(grupos)} falhou: {extrato[:120]}")
+            elif not extrato or MARCADOR_INSUFICIENTE in extrato:
+                descartados += 1
+            else:
+                extratos[indice_grupo] = extrato
+    fim_mapa = time.perf_counter()
+
+    uteis = [extrato for extrato in extratos if extrato]
+    contexto = "\n\n".join(uteis) if uteis else MARCADOR_INSUFICIENTE
+    fim_reducao = time.perf_counter()
+
+    relatorio = {
+        "grupos": len(grupos),
+        "chunks_fora_do_orcamento": len(tokens) - sum(len(g) for g in grupos),
+        "descartados_insuficientes": descartados,
+        "erros": erros,
+        "mapa_s": fim_mapa - inicio,
+        # Quanto o map levaria em série: a soma das chamadas individuais.
+        "soma_chamadas_s": sum(duracoes),
+        "maior_chamada_s": max(duracoes, default=0.0),
+        "reducao_s": fim_reducao - fim_mapa,
+    }
+    return contexto, relatorio
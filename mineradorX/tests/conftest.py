@@ -0,0 +1,5 @@
+import os
+import sys
+
+# Os módulos do mineradorX se importam pelo nome (são rodados de dentro da pasta).
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
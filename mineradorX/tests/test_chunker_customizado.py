@@ -0,0 +1,80 @@
+import re
+
+from chunker_customizado import _dividir_bloco_codigo, _dividir_em_janelas, chunkificar_por_tokens
+
+
+class TokenizadorFalso:
+    """
+    WordPiece simplificado: cada palavra vira um sub-token inicial de até 'inicial'
+    letras e os seguintes, com '##', de até 'continuacao' letras.
+    """
+
+    def __init__(self, inicial=4, continuacao=4):
+        self.inicial = inicial
+        self.continuacao = continuacao
+
+    def _tokens(self, texto):
+        tokens = []
+        for match in re.finditer(r'\w+|[^\w\s]', texto):
+            palavra, inicio = match.group(), match.start()
+            i, tamanho = 0, self.inicial
+            while i < len(palavra):
+                fim = min(i + tamanho, len(palavra))
+                tokens.append((("##" if i else "") + palavra[i:fim], (inicio + i, inicio + fim)))
+                i, tamanho = fim, self.continuacao
+        return tokens
+
+    def __call__(self, texto, add_special_tokens=False, return_offsets_mapping=False):
+        tokens = self._tokens(texto)
+        codificado = {"input_ids": [token for token, _ in tokens]}
+        if return_offsets_mapping:
+            codificado["offset_mapping"] = [offset for _, offset in tokens]
+        return codificado
+
+    def convert_ids_to_tokens(self, ids):
+        return ids
+
+
+def contar(tokenizador, texto):
+    return len(tokenizador(texto)["input_ids"])
+
+
+def test_janelas_cortam_no_inicio_de_palavra():
+    tokenizador = TokenizadorFalso()
+    texto = "abcdefgh " * 10  # 2 tokens por palavra
+    pedacos = _dividir_em_janelas(tokenizador, texto, 5)
+    assert all(pedaco.split() == ["abcdefgh"] * 2 for pedaco in pedacos)
+
+
+def test_palavra_maior_que_a_janela_e_cortada_no_limite():
+    tokenizador = TokenizadorFalso()
+    palavra = "x" * 4 * 25  # 25 sub-tokens
+    pedacos = _dividir_em_janelas(tokenizador, f"antes {palavra} depois", 10)
+    # "antes" sai sozinho (corte no início da palavra longa); dentro dela não há início
+    # de palavra, então o corte é no limite da janela, não um sub-token por pedaço.
+    assert [contar(tokenizador, pedaco) for pedaco in pedacos] == [2, 10, 10, 7]
+    assert "".join(pedacos[1:]).split() == [palavra, "depois"]
+
+
+def test_linha_de_codigo_enorme_vira_poucas_janelas():
+    tokenizador = TokenizadorFalso()
+    linha = "echo " + "a" * 4 * 100
+    bloco = f"```bash\nls -la\n{linha}\npwd\n```"
+    pedacos = _dividir_bloco_codigo(tokenizador, bloco, 32)
+    assert pedacos[:2] == ["```bash\nls -la", "echo"]
+    assert [contar(tokenizador, pedaco) for pedaco in pedacos[2:-1]] == [32, 32, 32, 4]
+    assert "".join(pedacos[2:-1]) == "a" * 4 * 100
+    chunks = chunkificar_por_tokens(bloco, tokenizador, min_tokens=8, max_tokens=34)
+    assert chunks == pedacos
+
+
+def test_pedaco_que_comeca_no_meio_da_palavra_e_recontado():
+    # Início de palavra com 1 letra e continuações com 4: o pedaço que começa no meio
+    # da palavra, tokenizado sozinho, gasta um token a mais do que na palavra inteira.
+    tokenizador = TokenizadorFalso(inicial=1, continuacao=4)
+    palavra = "p" + "q" * 4 * 12  # 13 sub-tokens
+    pedacos = _dividir_em_janelas(tokenizador, palavra, 5)
+    assert all(contar(tokenizador, pedaco) <= 5 for pedaco in pedacos)
+    assert "".join(pedacos) == palavra
+    chunks = chunkificar_por_tokens(f"Antes. {palavra} depois.", tokenizador, min_tokens=2, max_tokens=7)
+    assert all(contar(tokenizador, chunk) <= 5 for chunk in chunks)
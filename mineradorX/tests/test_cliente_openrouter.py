@@ -0,0 +1,144 @@
+import json
+import socket
+import struct
+import asyncio
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import httpx
+import pytest
+
+from cliente_openrouter import CircuitoAberto, ClienteOpenRouter, ProvedorSobrecarregado
+
+RESPOSTA_OK = {"choices": [{"message": {"content": "ok"}}]}
+
+
+class ProvedorFalso(BaseHTTPRequestHandler):
+    """
+    Responde cada POST conforme o roteiro do servidor: um status HTTP (com Retry-After
+    opcional), "fechar" (fecha a conexão sem responder nada) ou "resetar" (lê o pedido
+    e derruba a conexão com RST, como uma falha no meio da leitura). Roteiro vazio = 200.
+    """
+
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *args):
+        pass
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers["Content-Length"]))
+        self.server.pedidos += 1
+        acao = self.server.roteiro.pop(0) if self.server.roteiro else 200
+        if acao in ("fechar", "resetar"):
+            if acao == "resetar":
+                self.connection.setsockopt(socket.SOL_SOCKET, socket.SO_LINGER, struct.pack("ii", 1, 0))
+            self.close_connection = True
+            self.connection.close()
+            return
+        status, retry_after = acao if isinstance(acao, tuple) else (acao, None)
+        corpo = json.dumps(RESPOSTA_OK if status == 200 else {"error": status}).encode()
+        self.send_response(status)
+        if retry_after is not None:
+            self.send_header("Retry-After", str(retry_after))
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(corpo)))
+        self.end_headers()
+        self.wfile.write(corpo)
+
+
+@pytest.fixture
+def servidor():
+    srv = ThreadingHTTPServer(("127.0.0.1", 0), ProvedorFalso)
+    srv.roteiro, srv.pedidos = [], 0
+    threading.Thread(target=srv.serve_forever, daemon=True).start()
+    yield srv
+    srv.shutdown()
+    srv.server_close()
+
+
+def chamar(servidor, *pedidos, **config):
+    """Roda 'completar' uma vez por pedido num cliente novo; retorna os resultados (ou exceções)."""
+
+    async def rodar():
+        cliente = ClienteOpenRouter(None, {"url_base": f"http://127.0.0.1:{servidor.server_port}/v1",
+                                           "http2": False, "backoff_base_s": 0.01, "backoff_max_s": 1.0, **config})
+        await cliente.iniciar()
+        resultados = []
+        try:
+            for pedido in pedidos:
+                if isinstance(pedido, (int, float)):
+                    await asyncio.sleep(pedido)
+                    continue
+                try:
+                    resultados.append(await cliente.completar(pedido))
+                except Exception as e:
+                    resultados.append(e)
+        finally:
+            await cliente.fechar()
+        return cliente, resultados
+
+    return asyncio.run(rodar())
+
+
+def test_retenta_5xx_429_e_conexao_fechada_sem_resposta(servidor):
+    servidor.roteiro = [500, 503, (429, 0), "fechar"]
+    _, resultados = chamar(servidor, {}, tentativas=4)
+    assert resultados == [RESPOSTA_OK]
+    assert servidor.pedidos == 5
+
+
+def test_respeita_retry_after(servidor):
+    servidor.roteiro = [(429, 0.3)]
+    inicio = time.perf_counter()
+    _, resultados = chamar(servidor, {})
+    assert resultados == [RESPOSTA_OK]
+    assert time.perf_counter() - inicio >= 0.3
+
+
+def test_sobrecarga_vira_provedor_sobrecarregado(servidor):
+    # Retry-After maior que o backoff máximo: não espera, devolve o 429 na hora.
+    servidor.roteiro = [(429, 120)]
+    _, (erro,) = chamar(servidor, {})
+    assert isinstance(erro, ProvedorSobrecarregado)
+    assert (erro.status_code, erro.retry_after_s) == (429, 120)
+    assert servidor.pedidos == 1
+
+    # 503 que sobra depois das retentativas.
+    servidor.roteiro, servidor.pedidos = [503] * 3, 0
+    _, (erro,) = chamar(servidor, {}, tentativas=2)
+    assert isinstance(erro, ProvedorSobrecarregado) and erro.status_code == 503
+    assert servidor.pedidos == 3
+
+
+def test_nao_retenta_falha_de_leitura(servidor):
+    # O pedido chegou ao provedor: repetir poderia processar (e cobrar) duas vezes.
+    servidor.roteiro = ["resetar"]
+    cliente, (erro,) = chamar(servidor, {}, tentativas=3)
+    assert isinstance(erro, httpx.ReadError)
+    assert servidor.pedidos == 1
+    assert cliente.disjuntor.falhas_seguidas == 1
+
+
+def test_disjuntor_abre_meio_abre_e_fecha(servidor):
+    servidor.roteiro = [500, 502]
+    cliente, (erro, recusado, ok) = chamar(servidor, {}, {}, 0.25, {}, tentativas=1,
+                                            falhas_para_abrir_circuito=2, circuito_aberto_s=0.2)
+    assert isinstance(erro, httpx.HTTPStatusError) and erro.response.status_code == 502
+    # Aberto: recusa sem chegar ao provedor.
+    assert isinstance(recusado, CircuitoAberto)
+    assert servidor.pedidos == 3
+    # Passado o tempo, a chamada de teste funciona e o circuito fecha.
+    assert ok == RESPOSTA_OK
+    assert cliente.disjuntor.estado == "fechado"
+
+
+def test_disjuntor_reabre_se_o_teste_falha(servidor):
+    servidor.roteiro = [500, 500]
+    cliente, resultados = chamar(servidor, {}, 0.25, {}, {}, tentativas=0,
+                                 falhas_para_abrir_circuito=1, circuito_aberto_s=0.2)
+    assert isinstance(resultados[0], httpx.HTTPStatusError)
+    assert isinstance(resultados[1], httpx.HTTPStatusError)
+    assert isinstance(resultados[2], CircuitoAberto)
+    assert servidor.pedidos == 2
+    assert cliente.disjuntor.estado == "aberto"
@@ -0,0 +1,69 @@
+import pytest
+from langchain_community.embeddings import DeterministicFakeEmbedding
+
+import gerenciador_indices
+from armazenamento_indices import carregar_indice
+from empacotador_contexto import mesclar_adjacentes
+
+
+def paragrafo(nome: str) -> str:
+    # Uma frase longa terminada em ponto vira exatamente um chunk no modo "caracteres".
+    return f"O paragrafo {nome} " + " ".join([f"descreve {nome} com detalhes"] * 20) + "."
+
+
+@pytest.fixture
+def contexto(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(gerenciador_indices, "obter_embeddings", lambda: DeterministicFakeEmbedding(size=16))
+    gerenciador_indices.obter_embeddings_indexacao.cache_clear()
+    fonte = tmp_path / "fonte.txt"
+    yield fonte, {"nome_exibicao": "Teste", "fontes": [str(fonte)]}
+    gerenciador_indices.obter_embeddings_indexacao.cache_clear()
+
+
+def docs_do_indice(tmp_path) -> list:
+    db = carregar_indice(str(tmp_path / "indices_rag" / "teste"), DeterministicFakeEmbedding(size=16))
+    return [db.docstore.search(id_) for id_ in db.index_to_docstore_id.values()]
+
+
+def test_posicoes_refeitas_ao_editar_paragrafo_do_meio(contexto, tmp_path):
+    fonte, definicao = contexto
+    nomes = ["a", "b", "c", "d", "e", "f"]
+    fonte.write_text("\n\n".join(paragrafo(n) for n in nomes), encoding="utf-8")
+    gerenciador_indices.criar_ou_atualizar_contexto("teste", definicao, processos_chunking=1)
+
+    # Troca o parágrafo do meio e insere um novo antes dele: os chunks seguintes são
+    # reaproveitados do índice, mas todos mudam de posição.
+    nomes = ["a", "b", "novo", "x", "d", "e", "f"]
+    fonte.write_text("\n\n".join(paragrafo(n) for n in nomes), encoding="utf-8")
+    gerenciador_indices.criar_ou_atualizar_contexto("teste", definicao, processos_chunking=1)
+
+    docs = docs_do_indice(tmp_path)
+    posicoes = {doc.page_content: doc.metadata["posicao"] for doc in docs}
+    assert posicoes == {paragrafo(n): i for i, n in enumerate(nomes)}
+    assert {doc.metadata["source"] for doc in docs} == {str(fonte)}
+
+    # Fora de ordem de relevância, os vizinhos voltam a formar um trecho único, na ordem da fonte.
+    selecionados = list(enumerate(sorted(docs, key=lambda doc: doc.page_content)))
+    assert mesclar_adjacentes(selecionados) == ["\n".join(paragrafo(n) for n in nomes)]
+
+
+def test_duplicata_usa_posicao_da_fonte_escolhida(contexto, tmp_path):
+    fonte, definicao = contexto
+    outra = tmp_path / "outra.txt"
+    definicao = {**definicao, "fontes": [str(outra), str(fonte)]}
+    fonte.write_text("\n\n".join(paragrafo(n) for n in ["a", "b", "c"]), encoding="utf-8")
+    outra.write_text("\n\n".join(paragrafo(n) for n in ["z", "y", "c"]), encoding="utf-8")
+    gerenciador_indices.criar_ou_atualizar_contexto("teste", definicao, processos_chunking=1)
+
+    # "c" aparece nas duas fontes: fica com a primeira fonte do contexto e a posição nela.
+    docs = {doc.page_content: doc.metadata for doc in docs_do_indice(tmp_path)}
+    assert (docs[paragrafo("c")]["source"], docs[paragrafo("c")]["posicao"]) == (str(outra), 2)
+    assert docs[paragrafo("c")]["fontes"] == sorted([str(outra), str(fonte)])
+
+    # Sem a outra fonte, "c" volta a ser localizado pela que sobrou.
+    definicao = {**definicao, "fontes": [str(fonte)]}
+    gerenciador_indices.criar_ou_atualizar_contexto("teste", definicao, processos_chunking=1)
+    docs = {doc.page_content: doc.metadata for doc in docs_do_indice(tmp_path)}
+    assert (docs[paragrafo("c")]["source"], docs[paragrafo("c")]["posicao"]) == (str(fonte), 2)
+    assert "fontes" not in docs[paragrafo("c")]